@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+from django.template.base import (FilterExpression, Node, NodeList,
+                                  TagHelperNode, Variable, TOKEN_VAR)
+from django.template.defaulttags import ForNode, WithNode
+from django.template.loader import get_template
+from django.template.loader_tags import ExtendsNode, IncludeNode
+try:
+    from django.template.loader_tags import ConstantIncludeNode
+except ImportError:
+    # Django >= 1.7 includes constant template names with IncludeNode too
+    ConstantIncludeNode = None
+from django.template.smartif import TokenBase
+from django.templatetags.i18n import BlockTranslateNode
+
+# A path segment matching any key, attribute or list item
+ANY = '*'
+# Marks the end of a path whose value is used as a whole
+TERMINAL = None
+# Names bound by the template itself rather than taken from the context
+LOCAL = object()
+# Set in the scope of templates included with "only"
+ISOLATED = object()
+
+# Names Django's template Context always provides
+BUILTIN_NAMES = ('True', 'False', 'None')
+
+
+class TemplateAnalysis(object):
+    """Collects the dotted variable paths a parsed Django template reads from
+    its context.
+
+    ``paths`` is a trie of nested dicts: ``{'user': {'username': {None:
+    True}}}`` for ``{{ user.username }}``. A ``None`` key means the value at
+    that point is used as a whole (printed, compared, passed to a filter),
+    and a ``'*'`` key stands for any item, key or attribute - what a ``for``
+    loop or a numeric lookup reads.
+
+    ``for``, ``with`` and ``include ... with`` bind names to paths, so a loop
+    variable's lookups are recorded under the sequence it iterates over.
+    Included templates and the parents of extended ones are analysed too.
+    Whenever the analysis can't tell what a template reads - an include or
+    extends of a variable template name, or a tag that takes the whole
+    context - ``complete`` is set to False.
+    """
+
+    def __init__(self):
+        self.paths = {}
+        self.complete = True
+        # Templates being visited, and the scopes each was visited in
+        self._stack = []
+        self._visited = set()
+
+    def add(self, path, terminal=True):
+        level = self.paths
+        for segment in path:
+            level = level.setdefault(segment, {})
+        if terminal:
+            level[TERMINAL] = True
+
+    def incomplete(self, reason):
+        logger.debug('Template analysis incomplete: %s', reason)
+        self.complete = False
+
+    def variable_path(self, variable, scope):
+        """Return the context path a ``Variable`` reads, or None if it is a
+        literal or a name bound by the template."""
+        if not isinstance(variable, Variable) or not variable.lookups:
+            return None
+        name = variable.lookups[0]
+        if name in scope:
+            base = scope[name]
+        elif scope.get(ISOLATED) or name in BUILTIN_NAMES:
+            return None
+        else:
+            base = (name,)
+        if base is LOCAL:
+            return None
+        return base + tuple(ANY if lookup.isdigit() else lookup
+                            for lookup in variable.lookups[1:])
+
+    def expression_path(self, expression, scope):
+        """Record a ``FilterExpression``'s filter arguments and return the
+        path of its value, or None if it can't be aliased.
+
+        Filtered values are recorded whole, since filters may use anything
+        in them.
+        """
+        for _, args in expression.filters:
+            for is_variable, arg in args:
+                if is_variable:
+                    self.visit_variable(arg, scope)
+        path = self.variable_path(expression.var, scope)
+        if path is not None and expression.filters:
+            self.add(path)
+            return None
+        return path
+
+    def visit_variable(self, variable, scope, terminal=True):
+        path = self.variable_path(variable, scope)
+        if path is not None:
+            self.add(path, terminal)
+
+    def visit_expression(self, expression, scope):
+        path = self.expression_path(expression, scope)
+        if path is not None:
+            self.add(path)
+
+    def bind(self, scope, extra_context, isolated=False):
+        """Return a new scope with ``extra_context`` (names to
+        ``FilterExpression`` values) bound in it."""
+        bound = {ISOLATED: True} if isolated else dict(scope)
+        for name, expression in extra_context.iteritems():
+            path = self.expression_path(expression, scope)
+            bound[name] = LOCAL if path is None else path
+        return bound
+
+    def visit_template(self, template, scope):
+        if id(template) in self._stack:
+            self.incomplete('a template includes itself')
+            return
+        key = (id(template), frozenset(scope.iteritems()))
+        if key in self._visited:
+            return
+        self._visited.add(key)
+        self._stack.append(id(template))
+        try:
+            self.visit(template.nodelist, scope)
+        finally:
+            self._stack.pop()
+
+    def load_template(self, template_name, what):
+        try:
+            return get_template(template_name)
+        except Exception:
+            logger.debug('Could not load %s template %s', what,
+                         template_name, exc_info=True)
+            self.incomplete('the %s template %s failed to load' %
+                            (what, template_name))
+            return None
+
+    def visit_node(self, node, scope):
+        if isinstance(node, ForNode):
+            path = self.expression_path(node.sequence, scope)
+            loop_scope = dict(scope, forloop=LOCAL)
+            if path is not None:
+                self.add(path + (ANY,), terminal=False)
+                # Several loop variables unpack each item
+                item_path = path + (ANY,) * (1 + (len(node.loopvars) > 1))
+            for loopvar in node.loopvars:
+                loop_scope[loopvar] = LOCAL if path is None else item_path
+            self.visit(node.nodelist_loop, loop_scope)
+            self.visit(node.nodelist_empty, scope)
+        elif isinstance(node, WithNode):
+            self.visit(node.nodelist, self.bind(scope, node.extra_context))
+        elif (ConstantIncludeNode is not None and
+                isinstance(node, ConstantIncludeNode)):
+            if node.template is None:
+                self.incomplete('an included template failed to load')
+                return
+            self.visit_template(node.template, self.bind(
+                scope, node.extra_context, node.isolated_context))
+        elif isinstance(node, IncludeNode):
+            # The template name is node.template_name before Django 1.7
+            template_name = (getattr(node, 'template_name', None) or
+                             node.template)
+            if (template_name.filters or
+                    not isinstance(template_name.var, basestring)):
+                self.bind(scope, node.extra_context)
+                self.incomplete('a template is included by a variable name')
+                return
+            template = self.load_template(template_name.var, 'included')
+            if template is not None:
+                self.visit_template(template, self.bind(
+                    scope, node.extra_context, node.isolated_context))
+        elif isinstance(node, ExtendsNode):
+            self.visit(node.nodelist, scope)
+            parent_name = node.parent_name.var
+            if not isinstance(parent_name, basestring):
+                self.incomplete('a template extends a variable template')
+                return
+            parent = self.load_template(parent_name, 'parent')
+            if parent is not None:
+                self.visit_template(parent, dict(scope, block=LOCAL))
+        elif isinstance(node, BlockTranslateNode):
+            if node.counter is not None:
+                self.visit_expression(node.counter, scope)
+            scope = self.bind(scope, node.extra_context)
+            if node.countervar:
+                # The count the counter's value is bound to
+                scope[node.countervar] = LOCAL
+            for token in node.singular + (node.plural or []):
+                if token.token_type == TOKEN_VAR:
+                    self.visit_variable(Variable(token.contents), scope)
+        else:
+            if isinstance(node, TagHelperNode) and node.takes_context:
+                self.incomplete('%s takes the whole context' %
+                                (node.__class__.__name__,))
+            # Anything else is searched for variables wherever it keeps them
+            for value in node.__dict__.itervalues():
+                self.visit(value, scope)
+
+    def visit(self, value, scope):
+        if isinstance(value, Node):
+            self.visit_node(value, scope)
+        elif isinstance(value, FilterExpression):
+            self.visit_expression(value, scope)
+        elif isinstance(value, Variable):
+            self.visit_variable(value, scope)
+        elif isinstance(value, TokenBase):
+            # {% if %} conditions
+            for child in (value.first, value.second, value.value):
+                self.visit(child, scope)
+        elif isinstance(value, (list, tuple, NodeList)):
+            for item in value:
+                self.visit(item, scope)
+        elif isinstance(value, dict):
+            for item in value.itervalues():
+                self.visit(item, scope)
+
+
+def template_variable_paths(template):
+    """Return the trie of context paths a parsed template reads, as
+    described on ``TemplateAnalysis``, or None if it can't be worked out
+    completely."""
+    analysis = TemplateAnalysis()
+    analysis.visit_template(template, {})
+    if not analysis.complete:
+        return None
+    return analysis.paths
@@ -0,0 +1,324 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import resource
+import platform
+import tempfile
+import contextlib
+import multiprocessing
+
+import django
+from django.conf import settings
+
+import jade_tools
+from jade_tools import compiler, contextmaker, profiling, workers
+
+PHASES = ('find_compilable_jade_templates', 'preprocess_includes', 'compile',
+          'mock', 'serialize')
+
+
+def generate_tree(root, pages=20, include_depth=2, fan_out=2,
+                  fixture_size=10):
+    """Write a synthetic ``jade_templates`` tree to ``root``.
+
+    Every page in ``pages/`` includes ``fan_out`` partials, each of which
+    includes ``fan_out`` partials of the next level, down to
+    ``include_depth`` levels, and loops over the ``fixture_size`` items in
+    its JSON fixture. Returns the number of files written.
+    """
+    written = 0
+    for directory in ('pages', 'partials'):
+        if not os.path.isdir(os.path.join(root, directory)):
+            os.makedirs(os.path.join(root, directory))
+    for level in xrange(include_depth):
+        for index in xrange(fan_out):
+            lines = ['div.partial-%d-%d' % (level, index),
+                     '    p Level %d partial of {{ title }}' % (level,),
+                     '    ul',
+                     '        {% for item in items %}',
+                     '        li(class="{{ item.kind }}") {{ item.name }}',
+                     '        {% endfor %}']
+            if level + 1 < include_depth:
+                lines.extend('    include level%d_%d' % (level + 1, child)
+                             for child in xrange(fan_out))
+            with open(os.path.join(root, 'partials', 'level%d_%d.jade' %
+                                   (level, index)), 'w') as partial:
+                partial.write('\n'.join(lines) + '\n')
+            written += 1
+    for page in xrange(pages):
+        lines = ['doctype html',
+                 'html',
+                 '    head',
+                 '        title {{ title }}',
+                 '    body',
+                 '        h1 {{ title }}',
+                 '        {% for item in items %}',
+                 '        div.item',
+                 '            h2 {{ item.name }}',
+                 '            {% if item.tags %}',
+                 '            p {{ item.tags|join:", " }}',
+                 '            {% endif %}',
+                 '            p {{ item.description }}',
+                 '        {% endfor %}']
+        if include_depth:
+            lines.extend('        include ../partials/level0_%d' % (index,)
+                         for index in xrange(fan_out))
+        base = os.path.join(root, 'pages', 'page_%04d' % (page,))
+        with open('%s.jade' % (base,), 'w') as page_file:
+            page_file.write('\n'.join(lines) + '\n')
+        with open('%s.json' % (base,), 'w') as fixture:
+            json.dump(synthetic_fixture(page, fixture_size), fixture,
+                      indent=4)
+        written += 2
+    return written
+
+
+def synthetic_fixture(page, fixture_size):
+    return {'title': 'Page %d' % (page,),
+            'items': [{'name': 'Item %d' % (index,),
+                       'kind': 'kind-%d' % (index % 3,),
+                       'description': 'Description of item %d. ' % (index,)
+                                      * 4,
+                       'tags': ['tag-%d' % (tag,) for tag in xrange(index % 4)]}
+                      for index in xrange(fixture_size)]}
+
+
+class SyntheticItem(object):
+    """A context object with plain, method and nested attributes, like the
+    ones views usually put in a context."""
+
+    def __init__(self, index, owner=None):
+        self.name = 'Item %d' % (index,)
+        self.index = index
+        self.tags = ['tag-%d' % (tag,) for tag in xrange(index % 4)]
+        self.owner = owner
+
+    def summary(self):
+        return '%s with %d tags' % (self.name, len(self.tags))
+
+    def __unicode__(self):
+        return self.name
+
+
+def synthetic_context(fixture_size):
+    owner = SyntheticItem(-1)
+    return {'title': 'Synthetic context',
+            'items': [SyntheticItem(index, owner)
+                      for index in xrange(fixture_size)],
+            'lookup': dict(('key-%d' % (index,), {'value': index})
+                           for index in xrange(fixture_size))}
+
+
+@contextlib.contextmanager
+def quiet_logging():
+    """Keep debug logging - which dumps every template's source in DEBUG
+    mode - from dominating the timings."""
+    logging.disable(logging.INFO)
+    try:
+        yield
+    finally:
+        logging.disable(logging.NOTSET)
+
+
+class Benchmark(object):
+    """Times the phases of a build on a synthetic template tree.
+
+    The tree is generated in a temporary directory and compiled as if it
+    were ``app``'s ``jade_templates``, so it runs against any project with
+    nothing but its own database. Each phase is run ``repeat`` times from
+    cold caches and its wall times are recorded separately.
+    """
+
+    def __init__(self, app, pages=20, include_depth=2, fan_out=2,
+                 fixture_size=10, repeat=3):
+        self.app = app
+        self.parameters = {'pages': pages, 'include_depth': include_depth,
+                           'fan_out': fan_out, 'fixture_size': fixture_size,
+                           'repeat': repeat}
+        self.repeat = repeat
+        self.timings = dict((phase, []) for phase in PHASES)
+
+    def time_phase(self, phase, fn, *args):
+        # Partials are expanded afresh on every run
+        self.compiler.include_expander = compiler.IncludeExpander()
+        compiler.reset_template_loaders()
+        started = time.time()
+        result = fn(*args)
+        self.timings[phase].append(time.time() - started)
+        return result
+
+    def find_templates(self):
+        return list(self.compiler.find_compilable_jade_templates())
+
+    def preprocess_includes(self, pages):
+        for tmpl_data in pages:
+            jade_file = os.path.join(
+                tmpl_data['path'], '%s.jade' % (tmpl_data['base_file_name'],))
+            self.compiler.preprocess_includes(
+                open(jade_file).read().decode('utf8'),
+                base_dir=tmpl_data['path'])
+
+    def compile(self, pages, html_path):
+        for tmpl_data in pages:
+            html = self.compiler.compile(**tmpl_data)
+            with open(os.path.join(html_path, '%s.html' %
+                                   (tmpl_data['base_file_name'],)),
+                      'w') as html_file:
+                html_file.write(html.encode('utf8'))
+
+    def mock(self, pages):
+        pipeline = compiler.MockPipeline()
+        for tmpl_data in pages:
+            self.compiler.mock(pipeline=pipeline, **tmpl_data)
+
+    def serialize(self, context):
+        contextmaker.ContextMaker(
+            None, max_length=self.parameters['fixture_size']).serialize(
+                context)
+
+    def run(self):
+        root = tempfile.mkdtemp(prefix='jade_tools_benchmark_')
+        template_dirs = settings.TEMPLATE_DIRS
+        try:
+            with quiet_logging():
+                generate_tree(os.path.join(root, 'jade_templates'),
+                              **dict((key, value) for key, value
+                                     in self.parameters.iteritems()
+                                     if key != 'repeat'))
+                html_path = os.path.join(root, 'templates',
+                                         self.app.replace('.', '/'))
+                os.makedirs(html_path)
+                self.compiler = compiler.DjangoJadeCompiler(self.app,
+                                                            base_context={})
+                self.compiler.template_path = os.path.join(root,
+                                                           'jade_templates')
+                # Every repeat after the first would only time cache hits
+                self.compiler.compile_cache = None
+                # Mock pages are loaded by name like the compiled templates
+                # of any other app
+                settings.TEMPLATE_DIRS = ((os.path.join(root, 'templates'),)
+                                          + tuple(template_dirs))
+                context = synthetic_context(self.parameters['fixture_size'])
+                for _ in xrange(self.repeat):
+                    pages = self.time_phase('find_compilable_jade_templates',
+                                            self.find_templates)
+                    self.time_phase('preprocess_includes',
+                                    self.preprocess_includes, pages)
+                    self.time_phase('compile', self.compile, pages, html_path)
+                    self.time_phase('mock', self.mock, pages)
+                    self.time_phase('serialize', self.serialize, context)
+        finally:
+            settings.TEMPLATE_DIRS = template_dirs
+            shutil.rmtree(root)
+        return self.results()
+
+    def results(self):
+        phases = {}
+        for phase, runs in self.timings.iteritems():
+            ordered = sorted(runs)
+            phases[phase] = {'runs': runs,
+                             'min': ordered[0],
+                             'median': ordered[len(ordered) // 2],
+                             'mean': sum(runs) / len(runs)}
+        return {'format': 1,
+                'jade_tools': jade_tools.__version__,
+                'django': django.get_version(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                'parameters': self.parameters,
+                'phases': phases}
+
+
+def compare(results, baseline):
+    """Return ``(phase, baseline_median, median, ratio)`` for every phase
+    in both sets of results."""
+    comparison = []
+    for phase in PHASES:
+        if phase in results['phases'] and phase in baseline['phases']:
+            before = baseline['phases'][phase]['median']
+            after = results['phases'][phase]['median']
+            comparison.append((phase, before, after,
+                               after / before if before else None))
+    if baseline.get('parameters') != results['parameters']:
+        logger.warning('The baseline was run with different parameters: %s',
+                       baseline.get('parameters'))
+    return comparison
+
+
+def peak_memory():
+    """Return the most memory this process has had resident, in bytes."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, OS X bytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def fixture_loading_run(job):
+    """Render one mock page in a worker set up by
+    ``workers.initialize_mock_worker``, returning how long loading its
+    fixture and rendering took and how far that raised peak memory."""
+    app, tmpl_data, lazy = job
+    compiler.DjangoJadeCompiler.lazy_fixtures = lazy
+    name = workers.get_compiler(app).template_name(
+        tmpl_data['base_file_name'], tmpl_data['template_path'])
+    gc.collect()
+    before = peak_memory()
+    profiler = profiling.start()
+    try:
+        _, html = workers.mock_to_html((app, tmpl_data))
+    finally:
+        profiling.stop()
+    phases = profiler.timings[name]
+    return {'fixture_seconds': phases['fixture'][0],
+            'render_seconds': phases['render'][0],
+            'peak_memory': peak_memory() - before,
+            'output': hashlib.sha1(html.encode('utf8')).hexdigest()}
+
+
+def compare_fixture_loading(app, tmpl_data, url_map, base_context, repeat=3):
+    """Render a mock page ``repeat`` times with its fixture loaded whole and
+    ``repeat`` times with it loaded lazily, each time in a fresh process so
+    peak memory isn't carried over, and return the best time and peak
+    memory growth of each."""
+    results = {'format': 1,
+               'fixture_size': os.path.getsize(os.path.join(
+                   tmpl_data['path'],
+                   '%s.json' % (tmpl_data['base_file_name'],))),
+               'modes': {}}
+    outputs = set()
+    for mode in ('eager', 'lazy'):
+        runs = []
+        for _ in xrange(repeat):
+            workers.close_connections()
+            pool = multiprocessing.Pool(
+                1, initializer=workers.initialize_mock_worker,
+                initargs=(url_map, base_context))
+            try:
+                runs.append(pool.apply(fixture_loading_run,
+                                       ((app, tmpl_data, mode == 'lazy'),)))
+                pool.close()
+            except:
+                pool.terminate()
+                raise
+            finally:
+                pool.join()
+        outputs.update(run['output'] for run in runs)
+        results['modes'][mode] = {
+            'seconds': min(run['fixture_seconds'] + run['render_seconds']
+                           for run in runs),
+            'fixture_seconds': min(run['fixture_seconds'] for run in runs),
+            'render_seconds': min(run['render_seconds'] for run in runs),
+            'peak_memory': min(run['peak_memory'] for run in runs)}
+    results['same_output'] = len(outputs) == 1
+    return results
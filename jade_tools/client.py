@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""Runs ``jade_tools`` subcommands on a server started with ``manage.py
+jade_tools serve``, without importing Django::
+
+    python -m jade_tools.client [--socket PATH] compile --template app:page
+
+Output and exit status are those of the command run by the server.
+"""
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import json
+import errno
+import socket
+
+DEFAULT_SOCKET = '.jade_tools.sock'
+
+
+def run(argv, socket_path=DEFAULT_SOCKET):
+    """Send ``argv`` to the server at ``socket_path`` and return its
+    response."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(socket_path)
+        sock.sendall(json.dumps({'argv': argv, 'cwd': os.getcwd()}) + '\n')
+        return json.loads(sock.makefile('rb').readline())
+    finally:
+        sock.close()
+
+
+def main(argv):
+    socket_path = DEFAULT_SOCKET
+    if argv[:1] == ['--socket'] and len(argv) > 1:
+        socket_path, argv = argv[1], argv[2:]
+    elif argv[:1] and argv[0].startswith('--socket='):
+        socket_path, argv = argv[0][len('--socket='):], argv[1:]
+    try:
+        response = run(argv, socket_path)
+    except socket.error, e:
+        if e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            raise
+        sys.stderr.write('No jade_tools server on %s; start one with '
+                         'manage.py jade_tools serve.\n' % (socket_path,))
+        return 2
+    sys.stdout.write(response['stdout'].encode('utf8'))
+    sys.stderr.write(response['stderr'].encode('utf8'))
+    return response['status']
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import hashlib
+import threading
+
+import jade_tools
+from jade_tools import discovery
+from jade_tools.manifest import write_file_atomically
+
+# Modules whose code decides what pyjade compiles Jade to
+COMPILER_MODULES = ('pyjade.compiler', 'pyjade.lexer', 'pyjade.parser',
+                    'pyjade.nodes', 'pyjade.utils',
+                    'pyjade.ext.django.compiler')
+
+_compiler_version = None
+
+
+def compiler_version():
+    """Return a string identifying the pyjade release and code in use.
+
+    pyjade is often installed from a git checkout with an unchanging version
+    number, so the source of its compiler modules is hashed as well.
+    """
+    global _compiler_version
+    if _compiler_version is None:
+        try:
+            import pkg_resources
+            version = pkg_resources.get_distribution('pyjade').version
+        except Exception:
+            version = 'unknown'
+        digest = hashlib.sha1(jade_tools.__version__)
+        for module_name in COMPILER_MODULES:
+            __import__(module_name)
+            source_file = sys.modules[module_name].__file__
+            if source_file.endswith(('.pyc', '.pyo')):
+                source_file = source_file[:-1]
+            try:
+                digest.update(open(source_file, 'rb').read())
+            except IOError:
+                digest.update(module_name)
+        _compiler_version = '%s-%s' % (version, digest.hexdigest()[:12])
+    return _compiler_version
+
+
+class CompileCache(object):
+    """A directory of pyjade compile results, keyed by a hash of the Jade
+    source and the compiler that compiled it.
+
+    Entries are content addressed and written atomically, so a directory
+    can be shared between checkouts, branches and CI jobs, and used by
+    several processes at once. Reading an entry touches it; once the
+    entries take up more than ``max_size`` bytes, the least recently used
+    are removed. A cache directory the process can't write to, such as one
+    shared read-only with CI jobs, is still read from.
+    """
+
+    def __init__(self, directory, max_size=100 * 1024 * 1024):
+        self.directory = directory
+        self.max_size = max_size
+        self._size = None
+        self._lock = threading.Lock()
+
+    def key(self, source):
+        # pyjade only uses a template's name in parse errors, so partials
+        # with the same source share an entry
+        digest = hashlib.sha1(compiler_version())
+        digest.update('\0')
+        digest.update(source.encode('utf8'))
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], '%s.html' % (key[2:],))
+
+    def get(self, key):
+        """Return the compiled template for ``key``, or None."""
+        path = self.path(key)
+        try:
+            compiled = open(path, 'rb').read().decode('utf8')
+        except (IOError, OSError):
+            return None
+        try:
+            os.utime(path, None)
+        except OSError:
+            # A read-only cache; entries just age by when they were written
+            pass
+        logger.debug('Compile cache hit %s', key)
+        return compiled
+
+    def set(self, key, compiled):
+        content = compiled.encode('utf8')
+        try:
+            write_file_atomically(self.path(key), content)
+        except (IOError, OSError), e:
+            logger.debug('Could not add %s to the compile cache: %s', key, e)
+            return
+        with self._lock:
+            if self._size is None:
+                self._size = self.total_size()
+            else:
+                self._size += len(content)
+            if self._size > self.max_size:
+                self.evict()
+
+    def entries(self):
+        """Return ``(last_used, size, path)`` for every entry."""
+        entries = []
+        for path, files in discovery.walk(self.directory):
+            for file_name in files:
+                if not file_name.endswith('.html'):
+                    continue
+                file_path = os.path.join(path, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except OSError:
+                    # Evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, file_path))
+        return entries
+
+    def total_size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Remove the least recently used entries until the cache is back
+        to 90% of its maximum size, leaving room before the next
+        eviction."""
+        entries = sorted(self.entries())
+        size = sum(entry_size for _, entry_size, _ in entries)
+        target = self.max_size * 0.9
+        removed = 0
+        for _, entry_size, file_path in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(file_path)
+            except OSError:
+                pass
+            size -= entry_size
+            removed += 1
+        self._size = size
+        logger.debug('Evicted %d compile cache entries', removed)
@@ -8,11 +8,12 @@ logger = logging.getLogger(__name__)
 import re
 import os
 import json
+import time
+from StringIO import StringIO
 
 from django.conf import settings
 from django.core.handlers.wsgi import WSGIHandler
 from django.core import urlresolvers
-from django.db.models import get_app
 from django.template import loader, RequestContext
 from django.test import RequestFactory
 
@@ -20,6 +21,8 @@ from pyjade.ext.django.loader import Loader
 from pyjade.ext.django.compiler import Compiler
 from pyjade.utils import process
 
+from jade_tools import discovery, profiling
+
 class DictWithSpecialUnicode(dict):
     def __unicode__(self):
         if "" in self:
@@ -34,57 +37,533 @@ class DictWithSpecialUnicode(dict):
             return repr(dict(self))
 
 
-class DjangoJadeCompiler(object):
+class IncludeExpander(object):
+    """Expands Jade ``include`` statements in one linear pass per file.
+
+    The expanded source of every partial is memoized, together with the
+    mtimes of the partial and everything it includes, so a partial shared by
+    many pages is only read and expanded once per run. The files being
+    expanded are passed down the recursion rather than kept on the
+    expander, so threads can share one.
+    """
 
     INCLUDE_RE = re.compile(
         r'^(?P<indent>[\t ]*)include +(?P<included>\S+) *$',
         re.MULTILINE)
 
+    def __init__(self):
+        self._cache = {}
+
+    def resolve(self, included_path, base_dir):
+        """Return the file an ``include`` statement refers to.
+
+        Paths are relative to ``base_dir`` and may omit the .jade extension.
+        """
+        included_path = os.path.normpath(
+            os.path.join(base_dir, included_path)).strip()
+        if os.path.exists(included_path):
+            return included_path
+        elif os.path.exists("%s.jade" % included_path):
+            return "%s.jade" % included_path
+        raise Exception("Include path doesn't exists")
+
+    def _mtimes(self, paths):
+        return dict((path, os.path.getmtime(path)) for path in paths)
+
+    def expand_file(self, path, expanding=frozenset()):
+        """Return ``(expanded_source, dependencies)`` for a Jade file.
+
+        ``expanding`` holds the files whose includes led here.
+        """
+        cached = self._cache.get(path)
+        if cached is not None:
+            mtimes, expanded, dependencies = cached
+            try:
+                if self._mtimes(mtimes) == mtimes:
+                    return expanded, dependencies
+            except OSError:
+                pass
+        if path in expanding:
+            raise Exception("Recursive include of %s" % (path,))
+        logger.debug('Expanding includes of %s', path)
+        source = open(path, 'r').read().decode('utf8')
+        expanded, dependencies = self.expand_with_dependencies(
+            source, os.path.dirname(path), expanding | frozenset([path]))
+        self._cache[path] = (self._mtimes([path] + list(dependencies)),
+                             expanded, dependencies)
+        return expanded, dependencies
+
+    def expand_with_dependencies(self, template_src, base_dir,
+                                 expanding=frozenset()):
+        """Return ``(expanded_source, dependencies)`` for Jade source whose
+        relative includes are resolved against ``base_dir``."""
+        pieces = []
+        dependencies = set()
+        position = 0
+        for match in self.INCLUDE_RE.finditer(template_src):
+            base_indent, included_path = match.groups()
+            included_path = self.resolve(included_path, base_dir)
+            logger.debug('Found include statement: base indent is "%s" and '
+                         'included path is %s', base_indent, included_path)
+            included_src, included_dependencies = self.expand_file(
+                included_path, expanding)
+            dependencies.add(included_path)
+            dependencies.update(included_dependencies)
+            pieces.append(template_src[position:match.start()])
+            pieces.append(base_indent)
+            pieces.append(
+                included_src.replace(u'\n', u'\n'+base_indent).rstrip())
+            position = match.end()
+        if not pieces:
+            return template_src, frozenset()
+        pieces.append(template_src[position:])
+        return u''.join(pieces), frozenset(dependencies)
+
+    def expand(self, template_src, base_dir):
+        return self.expand_with_dependencies(template_src, base_dir)[0]
+
+
+def reset_template_loaders():
+    """Make Django's template loaders forget the templates they cached, so
+    templates compiled since are loaded afresh."""
+    for template_loader in loader.template_source_loaders or ():
+        if hasattr(template_loader, 'reset'):
+            template_loader.reset()
+
+
+def partial_html_file(html_path, tmpl_data):
+    """Return where the HTML of a partial compiled on its own goes, given
+    its app's template directory.
+
+    Partials keep their directories, as their template names do; pages are
+    written straight into ``html_path``.
+    """
+    return os.path.join(html_path, tmpl_data['template_path'],
+                        '%s.html' % (tmpl_data['base_file_name'],))
+
+
+def load_fixture(fp):
+    """Load a JSON fixture as a context for mocking.
+
+    Objects become ``DictWithSpecialUnicode`` instances, and objects shared
+    through ``"__id__"``/``"__ref__"`` markers (see
+    ``ContextMaker.share_objects``) are resolved back into the same dict.
+    """
+    shared = {}
+
+    def object_hook(d):
+        d = DictWithSpecialUnicode(d)
+        if '__id__' in d:
+            shared[d.pop('__id__')] = d
+        return d
+
+    fixture = json.load(fp, object_hook=object_hook)
+    if shared:
+        fixture = resolve_references(fixture, shared)
+    return fixture
+
+
+def resolve_references(value, shared):
+    if isinstance(value, dict):
+        if len(value) == 1 and '__ref__' in value:
+            return shared[value['__ref__']]
+        for key, item in value.iteritems():
+            value[key] = resolve_references(item, shared)
+    elif isinstance(value, list):
+        for i, item in enumerate(value):
+            value[i] = resolve_references(item, shared)
+    return value
+
+
+class LazyFixture(object):
+    """The raw text of a JSON fixture, decoded piecemeal by the
+    ``LazyJSON`` objects in it.
+
+    Values are located by skipping over the text without building them, so
+    only what a template actually looks up is ever decoded. Every object is
+    decoded to the same ``LazyJSON`` however it is reached, and
+    ``"__ref__"`` markers resolve to the object carrying the ``"__id__"``,
+    as ``load_fixture`` does.
+    """
+
+    WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+    STRING_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.DOTALL)
+    # The next bracket outside a string, skipping everything before it in
+    # one match
+    BRACKET_RE = re.compile(
+        r'[^"\[\]{}]*(?:"[^"\\]*(?:\\.[^"\\]*)*"[^"\[\]{}]*)*([\[\]{}])',
+        re.DOTALL)
+    # Strings as well as brackets, for finding "__id__" keys
+    TOKEN_RE = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"|[\[\]{}]', re.DOTALL)
+    SCALAR_RE = re.compile(r'[^,\]}\s]+')
+    REF_RE = re.compile(r'\{\s*"__ref__"\s*:\s*([^,\]}\s]+|"[^"\\]*")\s*\}')
+
+    def __init__(self, text):
+        self.text = text
+        self.decoder = json.JSONDecoder()
+        self.objects = {}
+        # Where the objects with an "__id__" start, once looked for
+        self.ids = None
+
+    def skip_whitespace(self, position):
+        return self.WHITESPACE_RE.match(self.text, position).end()
+
+    def value_end(self, position):
+        """Return where the value starting at ``position`` ends."""
+        char = self.text[position]
+        if char == '"':
+            return self.STRING_RE.match(self.text, position).end()
+        elif char in '{[':
+            depth = 0
+            for match in self.BRACKET_RE.finditer(self.text, position):
+                if match.group(1) in '{[':
+                    depth += 1
+                else:
+                    depth -= 1
+                    if not depth:
+                        return match.end()
+            raise ValueError('Unterminated JSON value at %d' % (position,))
+        return self.SCALAR_RE.match(self.text, position).end()
+
+    def members(self, start, close):
+        """Yield ``(key, value_start, value_end)`` for each member of the
+        object or array at ``start``; keys are None in arrays."""
+        position = self.skip_whitespace(start + 1)
+        while self.text[position] != close:
+            key = None
+            if close == '}':
+                key, position = self.decoder.raw_decode(self.text, position)
+                position = self.skip_whitespace(
+                    self.skip_whitespace(position) + 1)
+            end = self.value_end(position)
+            yield key, position, end
+            position = self.skip_whitespace(end)
+            if self.text[position] == ',':
+                position = self.skip_whitespace(position + 1)
+
+    def value(self, start, end):
+        char = self.text[start]
+        if char == '{':
+            ref = self.REF_RE.match(self.text, start)
+            if ref is not None and ref.end() == end:
+                return self.resolve(json.loads(ref.group(1)))
+            return self.object_at(start)
+        elif char == '[':
+            return [self.value(item_start, item_end)
+                    for _, item_start, item_end in self.members(start, ']')]
+        return self.decoder.raw_decode(self.text, start)[0]
+
+    def object_at(self, start):
+        obj = self.objects.get(start)
+        if obj is None:
+            obj = self.objects[start] = LazyJSON(self, start)
+        return obj
+
+    def resolve(self, shared_id):
+        if self.ids is None:
+            self.ids = self.find_ids()
+        return self.object_at(self.ids[shared_id])
+
+    def find_ids(self):
+        """Return where every object with an ``"__id__"`` starts, by id."""
+        ids, starts = {}, []
+        for match in self.TOKEN_RE.finditer(self.text):
+            token = match.group()
+            if token == '{':
+                starts.append(match.start())
+            elif token == '}':
+                starts.pop()
+            elif token == '"__id__"':
+                position = self.skip_whitespace(match.end())
+                if self.text[position] == ':':
+                    ids[self.decoder.raw_decode(
+                        self.text, self.skip_whitespace(position + 1))[0]] = (
+                            starts[-1])
+        return ids
+
+
+class LazyJSON(DictWithSpecialUnicode):
+    """A fixture object whose members are decoded when they are looked up.
+
+    Members are only located when the first lookup misses, and decoded one
+    at a time into the dict itself; anything needing all of them, like
+    iterating, copying or printing without a ``""`` label, decodes the rest.
+
+    ``dict(obj)``, ``d.update(obj)``, ``**obj`` and ``json.dumps(obj)`` read
+    the dict's storage directly, bypassing all of this, and so only see the
+    members decoded so far; call ``materialize()`` first.
+    """
+
+    def __init__(self, fixture, start):
+        super(LazyJSON, self).__init__()
+        self._fixture = fixture
+        self._start = start
+        self._pending = None
+
+    def _index(self):
+        if self._pending is None:
+            self._pending = {}
+            for key, start, end in self._fixture.members(self._start, '}'):
+                if key != '__id__':
+                    self._pending[key] = (start, end)
+        return self._pending
+
+    def _decode(self, key):
+        start, end = self._index().pop(key)
+        value = self._fixture.value(start, end)
+        dict.__setitem__(self, key, value)
+        return value
+
+    def _materialize(self):
+        for key in self._index().keys():
+            self._decode(key)
+
+    def materialize(self):
+        """Decode every member, and those of the objects in them, and return
+        this object."""
+        pending = [self]
+        seen = set()
+        while pending:
+            value = pending.pop()
+            if id(value) in seen:
+                continue
+            seen.add(id(value))
+            if isinstance(value, LazyJSON):
+                value._materialize()
+                pending.extend(dict.itervalues(value))
+            elif isinstance(value, list):
+                pending.extend(value)
+        return self
+
+    def __getitem__(self, key):
+        if dict.__contains__(self, key):
+            return dict.__getitem__(self, key)
+        if key in self._index():
+            return self._decode(key)
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return dict.__contains__(self, key) or key in self._index()
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __unicode__(self):
+        if "" not in self:
+            self._materialize()
+        return super(LazyJSON, self).__unicode__()
+
+    def __repr__(self):
+        if "" not in self:
+            self._materialize()
+        return super(LazyJSON, self).__repr__()
+
+    def __eq__(self, other):
+        self._materialize()
+        if isinstance(other, LazyJSON):
+            other._materialize()
+        return dict.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __delitem__(self, key):
+        self._materialize()
+        dict.__delitem__(self, key)
+
+    def pop(self, key, *default):
+        self._materialize()
+        return dict.pop(self, key, *default)
+
+    def __reduce_ex__(self, protocol):
+        # Copies and pickles are plain fixture dicts, without the fixture
+        self._materialize()
+        return (DictWithSpecialUnicode, (), None, None,
+                dict.iteritems(self))
+
+
+def _materializing(name):
+    def method(self, *args):
+        self._materialize()
+        return getattr(dict, name)(self, *args)
+    method.__name__ = name
+    return method
+
+for _name in ('__iter__', '__len__', 'keys', 'values', 'items', 'iterkeys',
+              'itervalues', 'iteritems', 'copy', 'popitem', 'update',
+              'setdefault'):
+    setattr(LazyJSON, _name, _materializing(_name))
+
+
+def load_lazy_fixture(fp):
+    """Load a JSON fixture as a context for mocking like ``load_fixture``,
+    but only decode the parts of it a template looks up."""
+    fixture = LazyFixture(fp.read())
+    position = fixture.skip_whitespace(0)
+    if fixture.text[position:position + 1] != '{':
+        return load_fixture(StringIO(fixture.text))
+    return fixture.object_at(position)
+
+
+class URLMap(object):
+    """A URL map compiled into a flat lookup table.
+
+    In the map, a view name points either at a URL or at a dict that is
+    matched against the reverse arguments one level at a time, with
+    ``__default__`` used when nothing else matches. Positional arguments are
+    matched in order by value; keyword arguments are matched by keys of the
+    form ``"name=value"``::
+
+        {"article": {"2014": {"__default__": "./article.html"}},
+         "author": {"slug=jag": "./jag.html", "__default__": "./author.html"}}
+
+    A level falling back to ``__default__`` uses up the positional argument
+    it stands for or, with keyword arguments, the one named in its other
+    keys; if it names none of them, the keyword arguments are left for the
+    levels below.
+
+    Every dict level is flattened into one table keyed on the view name and
+    the keys leading to it, and lookups are memoized.
+    """
+
+    DEFAULT = '__default__'
+
+    def __init__(self, url_map):
+        self.table = {}
+        # The keyword argument names each level matches on
+        self.level_names = {}
+        self._memo = {}
+        for viewname, mapped in url_map.iteritems():
+            self._flatten(viewname, (), mapped)
+
+    def _flatten(self, viewname, keys, mapped):
+        if isinstance(mapped, basestring):
+            self.table[(viewname, keys)] = mapped
+        else:
+            # Branches are marked with None
+            self.table[(viewname, keys)] = None
+            self.level_names[(viewname, keys)] = frozenset(
+                unicode(key).partition('=')[0] for key in mapped
+                if '=' in unicode(key))
+            for key, value in mapped.iteritems():
+                self._flatten(viewname, keys + (unicode(key),), value)
+
+    def lookup(self, viewname, args=None, kwargs=None):
+        """Return the mapped URL for a reverse() call, or None if the map
+        has nothing for it."""
+        args = tuple(unicode(arg) for arg in args or ())
+        kwargs = tuple(sorted(u'%s=%s' % (name, value)
+                              for name, value in (kwargs or {}).iteritems()))
+        try:
+            memo_key = (viewname, args, kwargs)
+            return self._memo[memo_key]
+        except KeyError:
+            pass
+        except TypeError:
+            # The arguments are strings by now, so the view is unhashable;
+            # the map's view names are strings, so it can't be in the map
+            return None
+        url = self._memo[memo_key] = self._lookup(viewname, args, kwargs)
+        return url
+
+    def _lookup(self, viewname, args, kwargs):
+        keys = ()
+        if (viewname, keys) not in self.table:
+            return None
+        args = list(args)
+        kwargs = list(kwargs)
+        while True:
+            url = self.table[(viewname, keys)]
+            if url is not None:
+                return url
+            if args:
+                candidates = [args.pop(0)]
+            else:
+                candidates = kwargs
+            for candidate in candidates:
+                if (viewname, keys + (candidate,)) in self.table:
+                    if candidates is kwargs:
+                        kwargs.remove(candidate)
+                    keys += (candidate,)
+                    break
+            else:
+                if not candidates or (
+                        (viewname, keys + (self.DEFAULT,)) not in self.table):
+                    return None
+                if candidates is kwargs:
+                    # __default__ stands in for the keyword arguments this
+                    # level matches on
+                    names = self.level_names[(viewname, keys)]
+                    kwargs = [kwarg for kwarg in kwargs
+                              if kwarg.partition('=')[0] not in names]
+                keys += (self.DEFAULT,)
+
+
+class DjangoJadeCompiler(object):
+
+    INCLUDE_RE = IncludeExpander.INCLUDE_RE
+
+    # Shared by every compiler in the process, so partials are expanded once
+    # per run rather than once per app or page.
+    include_expander = IncludeExpander()
+    # A compilecache.CompileCache to reuse pyjade output from, if any
+    compile_cache = None
+    # Whether partials are compiled to templates of their own, which pages
+    # pull in with {% include %}, instead of being inlined
+    include_templates = False
+    # Whether mock fixtures are decoded as templates look them up rather
+    # than all at once
+    lazy_fixtures = False
+
+    # Jade that only works as part of the including page
+    PAGE_DEPENDENT_RE = re.compile(
+        r'^\s*(?:extends|block|append|prepend|mixin|\+|\|)', re.MULTILINE)
+
     def __init__(self, app, url_map=None, base_context=None):
         self.app = app
-        self.template_path = os.path.join(
-            os.path.dirname(get_app(app).__file__), 'jade_templates')
+        self.template_path = os.path.join(discovery.app_directory(app),
+                                          'jade_templates')
         self.base_context = base_context
 
     @classmethod
     def preempt_url_patterns(cls, url_map):
-        # Monkeypatch reverse for a clickable static demo
-        super_reverse = urlresolvers.reverse
+        # Monkeypatch reverse for a clickable static demo. An earlier patch,
+        # e.g. one inherited by a forked worker, is replaced, not wrapped.
+        super_reverse = getattr(urlresolvers.reverse, 'super_reverse',
+                                urlresolvers.reverse)
+        url_lookup = URLMap(url_map)
         def reverse(viewname, **kwargs):
-            # Django rules say args or kwargs, not both
-            view_args = kwargs.get('args')
-            view_kwargs = kwargs.get('kwargs')
-            # FIXME: I don't have a good solution for handling kwargs yet...
-            if view_kwargs:
-                raise NotImplementedError, "Reversing urlpatterns with kwargs " \
-                                           "is not supported yet by " \
-                                           "django-jade-tools"
-            view_args = list(view_args)  # Use a copy of the original view args
-            if viewname in url_map:
-                url_mapped_view = url_map[viewname]
-                while not isinstance(url_mapped_view, basestring):
-                    next_arg = view_args.pop(0)
-                    if unicode(next_arg) in url_mapped_view:
-                        url_mapped_view = url_mapped_view[unicode(next_arg)]
-                    elif '__default__' in url_mapped_view:
-                        url_mapped_view = url_mapped_view['__default__']
-                    else:
-                        return super_reverse(viewname, **kwargs)
-                return url_mapped_view
-            return super_reverse(viewname, **kwargs)
+            url = url_lookup.lookup(viewname, kwargs.get('args'),
+                                    kwargs.get('kwargs'))
+            if url is None:
+                return super_reverse(viewname, **kwargs)
+            return url
+        reverse.super_reverse = super_reverse
         urlresolvers.reverse = reverse
 
+    @classmethod
+    def restore_url_patterns(cls):
+        """Undo ``preempt_url_patterns``."""
+        urlresolvers.reverse = getattr(urlresolvers.reverse, 'super_reverse',
+                                       urlresolvers.reverse)
+
     def find_compilable_jade_templates(self, standalone=True):
         if standalone:
             standalone_file = os.path.join(self.template_path, 'standalone.txt')
-            standalone_paths = []
+            standalone_paths = discovery.PrefixTrie()
             if os.path.exists(standalone_file):
                 logger.debug('Loading standalone paths...')
                 standalone_txt = open(standalone_file).read().strip()
                 for line in standalone_txt.split('\n'):
-                    standalone_paths.append(line.strip())
-        for path, dirs, files in os.walk(self.template_path):
+                    standalone_paths.add(line.strip())
+        for path, files in discovery.walk(self.template_path):
             logger.debug('Looking for jade templates in %s', path)
+            file_set = set(files)
             for jade_file in files:
                 # If we've got a .jade file with a corresponding .json file,
                 # it is compilable.
@@ -95,13 +574,12 @@ class DjangoJadeCompiler(object):
                                                      start=self.template_path)
                 base_file, _ = os.path.splitext(jade_file)
                 json_file = '%s.json' % base_file
-                if json_file not in files:
+                if json_file not in file_set:
                     if standalone:
-                        if not any(
-                                [os.path.commonprefix(
-                                        [template_path_base,
-                                         standalone_path]) == template_path_base
-                                 for standalone_path in standalone_paths]):
+                        # Templates in directories that prefix a line of
+                        # standalone.txt are compiled without a fixture
+                        if not standalone_paths.is_prefix_of_any(
+                                template_path_base):
                             logger.debug('Skipping %s - no corresponding json '
                                          'file %s and not in standalone paths',
                                          jade_file, json_file)
@@ -116,56 +594,135 @@ class DjangoJadeCompiler(object):
                        'path': path,
                        'template_path': template_path_base}
 
-    def preprocess_includes(self, template_src):
-        # Can't do finditer() here because the indices of matches change
-        match = self.INCLUDE_RE.search(template_src)
-        while match:
-            base_indent, included_path = match.groups()
-            included_path = os.path.normpath(
-                os.path.join(os.getcwd(), included_path)).strip()
-            logger.debug('Found include statement: base indent is "%s" and '
-                         'included path is %s; pwd is %s', base_indent,
-                         included_path, os.getcwd())
-            if os.path.exists(included_path):
-                included_src = open(included_path, 'r').read()
-            elif os.path.exists("%s.jade" % included_path):
-                included_src = open("%s.jade" % included_path, 'r').read()
-            else:
-                raise Exception("Include path doesn't exists")
-            included_src = included_src.decode('utf8')
-            if self.INCLUDE_RE.search(included_src):
-                current_pwd = os.getcwd()
-                logger.debug('Current working dir is %s - '
-                             'changing relative to template', current_pwd)
-                os.chdir(os.path.dirname(included_path))
-                logger.debug('Now in %s to process %s', os.getcwd(),
-                             included_path)
-                included_src = self.preprocess_includes(included_src)
-                os.chdir(current_pwd)
-                logger.debug('Now back in %s', current_pwd)
-            template_src = (
-                template_src[0:match.start()] + base_indent +
-                included_src.replace(u'\n', u'\n'+base_indent).rstrip() +
-                template_src[match.end():]
-            )
-            match = self.INCLUDE_RE.search(template_src)
-        return template_src
+    def find_includes(self, base_file_name, path, template_path):
+        """Return the files a template pulls in through ``include``,
+        transitively, as a sorted list of absolute paths."""
+        jade_file = os.path.join(path, '%s.jade' % (base_file_name,))
+        return sorted(self.include_expander.expand_file(jade_file)[1])
+
+    def partial_tmpl_data(self, partial_file):
+        """Return the template data of a partial, or None if it lies
+        outside this app's Jade templates."""
+        relative_path = os.path.relpath(partial_file, self.template_path)
+        if relative_path.split(os.sep)[0] == os.pardir:
+            return None
+        template_path, jade_file = os.path.split(relative_path)
+        return {'base_file_name': os.path.splitext(jade_file)[0],
+                'path': os.path.dirname(partial_file),
+                'template_path': template_path}
+
+    def partial_template_name(self, tmpl_data):
+        """Return the Django template name a partial compiles to."""
+        return '%s/%s.html' % (self.app.replace('.', '/'), os.path.join(
+            tmpl_data['template_path'], tmpl_data['base_file_name']))
+
+    def can_link(self, template_src, match, partial_file):
+        """Whether the ``include`` statement ``match`` can become a Django
+        ``{% include %}`` of the partial's own template.
+
+        Not if lines nested under the include continue the partial's
+        elements, which only works when its source is pasted in, nor if
+        the partial uses blocks, mixins or text that belong to the page.
+        """
+        base_indent = match.group('indent')
+        for line in template_src[match.end():].split('\n'):
+            if line.strip():
+                indent = len(line) - len(line.lstrip())
+                if indent > len(base_indent):
+                    return False
+                break
+        partial_src = self.include_expander.expand_file(partial_file)[0]
+        return not self.PAGE_DEPENDENT_RE.search(partial_src)
+
+    def link_includes(self, template_src, base_dir):
+        """Turn the ``include`` statements that allow it into Django
+        ``{% include %}`` tags, returning the new source and the files of
+        the partials it includes that way.
+
+        Other includes are left for ``preprocess_includes`` to inline.
+        """
+        pieces, partials = [], []
+        position = 0
+        for match in self.INCLUDE_RE.finditer(template_src):
+            partial_file = self.include_expander.resolve(
+                match.group('included'), base_dir)
+            tmpl_data = self.partial_tmpl_data(partial_file)
+            if tmpl_data is None or not self.can_link(template_src, match,
+                                                      partial_file):
+                continue
+            pieces.append(template_src[position:match.start()])
+            pieces.append(u'%s{%% include "%s" %%}' % (
+                match.group('indent'), self.partial_template_name(tmpl_data)))
+            partials.append(partial_file)
+            position = match.end()
+        pieces.append(template_src[position:])
+        return u''.join(pieces), partials
+
+    def linked_partial_files(self, jade_file):
+        """Return the files of the partials a Jade file itself pulls in with
+        ``{% include %}`` when ``include_templates`` is on."""
+        source = open(jade_file).read().decode('utf8')
+        return self.link_includes(source, os.path.dirname(jade_file))[1]
+
+    def find_linked_partials(self, base_file_name, path, template_path):
+        """Return the template data of every partial a template pulls in
+        with ``{% include %}`` when ``include_templates`` is on, including
+        those of the partials themselves.
+
+        Partials come after the partials they include, which have to be
+        compiled first: parsing a template loads the templates it includes.
+        """
+        found, seen = [], set()
+
+        def visit(jade_file):
+            for partial_file in self.linked_partial_files(jade_file):
+                if partial_file not in seen:
+                    seen.add(partial_file)
+                    visit(partial_file)
+                    found.append(partial_file)
+        visit(os.path.join(path, '%s.jade' % (base_file_name,)))
+        return [self.partial_tmpl_data(partial_file)
+                for partial_file in found]
+
+    def preprocess_includes(self, template_src, base_dir=None):
+        """Inline the partials pulled in by ``include`` statements.
 
+        Relative include paths are resolved against ``base_dir``, which
+        defaults to the current working directory.
+        """
+        if base_dir is None:
+            base_dir = os.getcwd()
+        return self.include_expander.expand(template_src, base_dir)
+
+    def template_name(self, base_file_name, template_path):
+        """Return a template's name as ``app:path``, e.g. for profiles."""
+        return '%s:%s' % (self.app, os.path.join(template_path,
+                                                 base_file_name))
 
     def compile(self, base_file_name, path, template_path):
+        return self.compile_to_template(base_file_name, path,
+                                        template_path)[0]
+
+    def compile_to_template(self, base_file_name, path, template_path):
+        """Compile a Jade template, returning both the generated Django
+        template source and the parsed ``Template``."""
         jade_template_path = os.path.join(template_path,
                                           '%s.jade' % (base_file_name,))
         logger.debug('Working with jade template %s', jade_template_path)
-        # Change the pwd to the template's location
-        current_pwd = os.getcwd()
-        os.chdir(path)
+        name = self.template_name(base_file_name, template_path)
+        # Includes are resolved relative to the template's location rather
+        # than the working directory, so compiling is safe to run in parallel
         # Hackery to allow for pre-processing the jade source
         jade_loader = Loader(
             ('django.template.loaders.filesystem.Loader',))
-        tmpl_src, display_name = jade_loader.load_template_source(
-            jade_template_path, [self.template_path,])
+        with profiling.phase(name, 'load'):
+            tmpl_src, display_name = jade_loader.load_template_source(
+                jade_template_path, [self.template_path,])
         if self.INCLUDE_RE.search(tmpl_src):
-            tmpl_src = self.preprocess_includes(tmpl_src)
+            with profiling.phase(name, 'includes'):
+                if self.include_templates:
+                    tmpl_src = self.link_includes(tmpl_src, path)[0]
+                tmpl_src = self.preprocess_includes(tmpl_src, base_dir=path)
         # WHITESPACE! HUH! WHAAAAT IS IT GOOD FOR? ABSOLUTELY NOTHING!
         tmpl_src = u'\n'.join([line for line in tmpl_src.split('\n')
                                if line.strip()])
@@ -177,39 +734,80 @@ class DjangoJadeCompiler(object):
                 u'Template is: \n%s',
                 u'\n'.join(['%4d: %s' % (i, s)
                            for i, s in enumerate(tmpl_src.split('\n'))]))
-        compiled_jade = process(tmpl_src, filename=jade_template_path,
-                                compiler=Compiler)
+        compiled_jade = None
+        if self.compile_cache is not None:
+            cache_key = self.compile_cache.key(tmpl_src)
+            with profiling.phase(name, 'cache'):
+                compiled_jade = self.compile_cache.get(cache_key)
+        if compiled_jade is None:
+            with profiling.phase(name, 'jade'):
+                compiled_jade = process(tmpl_src, filename=jade_template_path,
+                                        compiler=Compiler)
+            if self.compile_cache is not None:
+                self.compile_cache.set(cache_key, compiled_jade)
         try:
-            tmpl = loader.get_template_from_string(compiled_jade, origin,
-                                                   jade_template_path)
+            with profiling.phase(name, 'parse'):
+                tmpl = loader.get_template_from_string(
+                    compiled_jade, origin, jade_template_path)
         except Exception, e:
             logger.exception('Failed to compile Jade-derived HTML template:')
             logger.exception(
                 u'\n'.join(['%4d: %s' % (i, s)
                            for i, s in enumerate(compiled_jade.split(u'\n'))]))
             raise
-        os.chdir(current_pwd)
-        return compiled_jade
+        return compiled_jade, tmpl
 
-    def mock(self, base_file_name, path, template_path):
+    def mock(self, base_file_name, path, template_path, pipeline=None):
         html_template_path = os.path.join(self.app.replace('.', '/'),
                                           '%s.html' % (base_file_name,))
         json_file_path = os.path.join(path, '%s.json' % (base_file_name,))
-        tmpl = loader.get_template(html_template_path)
-        # We need to simulate request middleware but without short-circuiting
-        # the response
-        request_factory = RequestFactory()
-        req = request_factory.get('/%s' % (html_template_path,),
-                                  data={})
-        handler = WSGIHandler()
-        handler.load_middleware()
-        for middleware_method in handler._request_middleware:
-            middleware_method(req)
+        name = self.template_name(base_file_name, template_path)
+        with profiling.phase(name, 'get_template'):
+            tmpl = loader.get_template(html_template_path)
+        if pipeline is None:
+            pipeline = MockPipeline()
+        with profiling.phase(name, 'request'):
+            req = pipeline.make_request('/%s' % (html_template_path,))
+        with profiling.phase(name, 'fixture'):
+            fixture = (load_lazy_fixture if self.lazy_fixtures
+                       else load_fixture)(open(json_file_path))
         # Render the template with a RequestContext
-        ctx = RequestContext(
-            req,
-            json.load(open(json_file_path),
-                      object_hook=lambda d: DictWithSpecialUnicode(d)))
+        ctx = RequestContext(req, fixture)
         logger.debug('Updating context with base context %s', self.base_context)
         ctx.update(self.base_context)
-        return tmpl.render(ctx)
+        with profiling.phase(name, 'render'):
+            return tmpl.render(ctx)
+
+
+class MockPipeline(object):
+    """The request handling state shared by mock renders.
+
+    Loading the middleware stack is done once, when the pipeline is created,
+    so a run rendering many pages only pays for it once.
+    """
+
+    def __init__(self):
+        started = time.time()
+        self.request_factory = RequestFactory()
+        self.handler = WSGIHandler()
+        with profiling.phase('-', 'middleware'):
+            self.handler.load_middleware()
+        self.setup_time = time.time() - started
+        self.requests_made = 0
+        logger.debug('Loaded mock middleware in %.1fms',
+                     self.setup_time * 1000)
+
+    def make_request(self, path):
+        # We need to simulate request middleware but without short-circuiting
+        # the response
+        req = self.request_factory.get(path, data={})
+        for middleware_method in self.handler._request_middleware:
+            middleware_method(req)
+        self.requests_made += 1
+        return req
+
+    @property
+    def setup_time_saved(self):
+        """Roughly how long loading the middleware for every request would
+        have taken on top of the single load actually done."""
+        return self.setup_time * max(self.requests_made - 1, 0)
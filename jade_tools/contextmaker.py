@@ -9,12 +9,48 @@ import contextlib
 import inspect
 import decimal
 import itertools
+import json
+import time
+import types
+from collections import deque
+from importlib import import_module
 
-from django.core.urlresolvers import reverse
-from django.db import models
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.serializers.json import DateTimeAwareJSONEncoder
+from django.core.urlresolvers import resolve, reverse
+from django.db import connection, models
 from django.db.models.query import QuerySet
-from django.test.client import Client
+from django.test.client import Client, RequestFactory
 from django.template.loader import BaseLoader
+from django.utils.functional import LazyObject, empty
+
+from jade_tools.analysis import ANY, TERMINAL
+
+try:
+    from django.test.utils import CaptureQueriesContext
+except ImportError:
+    # Django < 1.6
+    class CaptureQueriesContext(object):
+        """Counts the queries run on ``connection`` in a ``with`` block,
+        like the class of the same name in later Djangos."""
+
+        def __init__(self, connection):
+            self.connection = connection
+
+        def __len__(self):
+            return self.final_queries - self.initial_queries
+
+        def __enter__(self):
+            self.use_debug_cursor = self.connection.use_debug_cursor
+            self.connection.use_debug_cursor = True
+            self.initial_queries = len(self.connection.queries)
+            self.final_queries = None
+            return self
+
+        def __exit__(self, *exc_info):
+            self.connection.use_debug_cursor = self.use_debug_cursor
+            self.final_queries = len(self.connection.queries)
 
 class BlankStringLoader(BaseLoader):
     is_usable = True
@@ -28,14 +64,162 @@ class BlankStringLoader(BaseLoader):
 def repr_maybe(value):
     return repr(value) if not isinstance(value, basestring) else value
 
+def json_key(key):
+    """Convert a dict key the way ``json.dumps`` does."""
+    if isinstance(key, basestring):
+        return key
+    if key is True or key is False or key is None:
+        return json.dumps(key)
+    if isinstance(key, float):
+        return repr(key)
+    return unicode(key)
+
+# A part of the context the template doesn't read
+PRUNED = object()
+
+def merge_paths(*tries):
+    """Combine path tries (see ``analysis.TemplateAnalysis``) into one.
+
+    None stands for every path and ``PRUNED`` for none.
+    """
+    tries = [paths for paths in tries if paths is not PRUNED]
+    if not tries:
+        return PRUNED
+    if [paths for paths in tries if paths is None or TERMINAL in paths]:
+        return None
+    merged = tries[0]
+    for paths in tries[1:]:
+        merged = dict(merged)
+        for key, below in paths.iteritems():
+            if key in merged:
+                below = merge_paths(merged[key], below)
+            merged[key] = {TERMINAL: True} if below is None else below
+    return merged
+
+def child_paths(paths, key):
+    """Return the paths read below ``key`` of a value read through
+    ``paths``."""
+    if paths is None or paths is PRUNED:
+        return paths
+    return merge_paths(paths.get(key, PRUNED), paths.get(ANY, PRUNED))
+
+class ContextNode(object):
+    """A list, dict or object in a context being serialized.
+
+    Children are produced lazily by a generator - values for lists,
+    ``(key, value)`` pairs otherwise - where each value is another node or a
+    plain value for the JSON encoder. An OBJECT with no children other than
+    its label is serialized as just the label.
+
+    A node left out when a budget ran out is ``truncated``: it is serialized
+    as a dict with its label, if any, and a ``"__truncated__"`` key naming
+    the budget.
+    """
+    LIST, DICT, OBJECT = 'list', 'dict', 'object'
+
+    def __init__(self, kind, children, label=None):
+        self.kind = kind
+        self.children = children
+        self.label = label
+        # Set once the node has been built or written
+        self.output = None
+        self.shared_id = None
+        self.truncated = None
+
+class DirectViewCaller(object):
+    """Gets the context of a view by calling it directly.
+
+    The view is looked up with ``resolve()`` and called with a
+    ``RequestFactory`` request that has only been through the given
+    middleware (dotted paths, as in ``MIDDLEWARE_CLASSES``). The
+    ``TemplateResponse`` it returns is never rendered, so no templates are
+    loaded and no response middleware runs.
+    """
+
+    def __init__(self, middleware=()):
+        self.request_factory = RequestFactory()
+        self.middleware = []
+        for middleware_path in middleware:
+            try:
+                self.middleware.append(
+                    self.import_middleware(middleware_path)())
+            except MiddlewareNotUsed:
+                pass
+
+    def import_middleware(self, middleware_path):
+        module_name, _, class_name = middleware_path.rpartition('.')
+        try:
+            return getattr(import_module(module_name), class_name)
+        except (ImportError, AttributeError, ValueError), e:
+            raise ImproperlyConfigured('Error importing middleware %s: %s' %
+                                       (middleware_path, e))
+
+    def make_request(self, url):
+        request = self.request_factory.get(url)
+        if 'django.contrib.auth' in settings.INSTALLED_APPS:
+            # Views expect a user; auth middleware may replace it
+            from django.contrib.auth.models import AnonymousUser
+            request.user = AnonymousUser()
+        return request
+
+    def get_context(self, url):
+        match = resolve(url.split('?')[0])
+        request = self.make_request(url)
+        response = None
+        for middleware in self.middleware:
+            if hasattr(middleware, 'process_request'):
+                response = middleware.process_request(request)
+                if response is not None:
+                    break
+        if response is None:
+            for middleware in self.middleware:
+                if hasattr(middleware, 'process_view'):
+                    response = middleware.process_view(
+                        request, match.func, match.args, match.kwargs)
+                    if response is not None:
+                        break
+        if response is None:
+            response = match.func(request, *match.args, **match.kwargs)
+        context = getattr(response, 'context_data', None)
+        if context is None:
+            raise ValueError('%s returned a %s without context data for %s' %
+                             (match.view_name or match.func,
+                              response.__class__.__name__, url))
+        return context
+
 class ContextMaker(object):
     def __init__(self, view_name, args=[], kwargs={}, max_length=10,
-                 max_depth=3):
+                 max_depth=3, share_objects=False, model_fields=False,
+                 client=None, paths=None, max_nodes=None, max_bytes=None,
+                 max_seconds=None, view_caller=None):
         self.view_name = view_name
         self.args = args
         self.kwargs = kwargs
         self.max_length = max_length
         self.max_depth = max_depth
+        # Serialize each object once and refer back to it afterwards
+        self.share_objects = share_objects
+        # Serialize model instances from their _meta fields only, fetching
+        # related rows up front
+        self.model_fields = model_fields
+        # The variable paths a template reads, as found by
+        # analysis.template_variable_paths; None serializes everything
+        self.paths = paths
+        # Budgets for the whole context. When any is set, the context is
+        # walked breadth first, so what runs out is the deepest parts.
+        self.max_nodes = max_nodes
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        # The budget that ran out, if any
+        self.truncated = None
+        self.queries_issued = None
+        # A test client can be shared by several makers
+        self.client = client
+        # A DirectViewCaller to get the context through instead of a full
+        # request, if any
+        self.view_caller = view_caller
+        self._shared = {}
+        self._last_shared_id = 0
 
     @contextlib.contextmanager
     def shortcircuit_template_loader(self):
@@ -49,106 +233,539 @@ class ContextMaker(object):
     def fake_request_to_get_context(self):
         with self.shortcircuit_template_loader():
             url = reverse(self.view_name, args=self.args, kwargs=self.kwargs)
-            client = Client()
+            client = self.client or Client()
             response = client.get(url)
         return response.context_data
 
-    def serialize_queryset(self, qs, depth):
-        if depth:
-            return [self.serialize_object(obj, depth-1)
-                    for obj in qs[:self.max_length]]
-        else:
-            return repr_maybe(qs)
+    def direct_request_to_get_context(self):
+        url = reverse(self.view_name, args=self.args, kwargs=self.kwargs)
+        return self.view_caller.get_context(url)
 
-    def serialize_iterable(self, list_, depth):
-        if depth:
-            return [self.serialize_foo(item, depth-1)
-                    for item in itertools.islice(list_, 0, self.max_length)]
-        else:
-            return [repr_maybe(item)
-                    for item in itertools.islice(list_, 0, self.max_length)]
+    def item_paths(self, paths):
+        """Return the paths read from each item of a list read through
+        ``paths``."""
+        paths = child_paths(paths, ANY)
+        # Items nobody looks into still count towards the list's length
+        return {} if paths is PRUNED else paths
 
-    def serialize_dict(self, dict_, depth):
-        if depth:
-            return {key: self.serialize_foo(value, depth-1)
-                    for key, value in dict_.iteritems()}
+    def queryset_node(self, qs, depth, paths=None):
+        if not depth:
+            return repr_maybe(qs)
+        item_paths = self.item_paths(paths)
+        if self.model_fields and qs._result_cache is None:
+            # Otherwise it was prefetched already
+            select, prefetch = self.related_lookups(qs.model, depth-1,
+                                                    paths=item_paths)
+            if select:
+                qs = qs.select_related(*select)
+            if prefetch:
+                qs = qs.prefetch_related(*prefetch)
+        if self.model_fields:
+            children = (self.node(obj, depth-1, item_paths)
+                        for obj in qs[:self.max_length])
         else:
-            return {key: repr_maybe(value)
-                    for key, value in dict.iteritems()}
+            children = (self.object_node(obj, depth-1, item_paths)
+                        for obj in qs[:self.max_length])
+        return ContextNode(ContextNode.LIST, children)
 
-    def serialize_object(self, obj, depth):
-        # logger.debug("#####")
-        # logger.debug('%s %s', type(obj), obj)
-        to_return = {"": unicode(obj)}
-        for attrname in [a for a in dir(obj) if not a.startswith('_')]:
-            # logger.debug('attrname is %s', attrname)
-            try:
-                attr = getattr(obj, attrname)
-            except AttributeError:
+    def related_lookups(self, model, depth, prefix='', paths=None):
+        """Return the ``select_related`` and ``prefetch_related`` lookups
+        that ``model_node`` follows for instances of ``model`` serialized at
+        ``depth``, leaving out relations outside ``paths``."""
+        select, prefetch = [], []
+        if depth < 1:
+            return select, prefetch
+        # Related objects are only serialized from depth 2 on, but joining
+        # them a level earlier saves a query per row for __unicode__
+        # methods that use them
+        for field in model._meta.fields:
+            related_paths = child_paths(paths, field.name)
+            if field.rel and related_paths is not PRUNED:
+                path = prefix + field.name
+                select.append(path)
+                related_select, related_prefetch = self.related_lookups(
+                    field.rel.to, depth-1, '%s__' % (path,), related_paths)
+                select.extend(related_select)
+                prefetch.extend(related_prefetch)
+        for field in model._meta.many_to_many if depth >= 2 else ():
+            related_paths = child_paths(paths, field.name)
+            if related_paths is PRUNED:
                 continue
-            # logger.debug('attr is %s %s', type(attr), attr)
-            if not depth:
-                to_return[attrname] = repr_maybe(attr)
+            path = prefix + field.name
+            prefetch.append(path)
+            # Many-to-many rows are a queryset level further down
+            related_select, related_prefetch = self.related_lookups(
+                field.rel.to, depth-2, '%s__' % (path,),
+                self.item_paths(related_paths))
+            prefetch.extend(related_select + related_prefetch)
+        return select, prefetch
+
+    def model_node(self, obj, depth, paths=None):
+        """Serialize a model instance from its concrete and many-to-many
+        fields, without calling its methods or touching reverse relations.
+
+        When ``paths`` are known, only the fields on them are serialized;
+        methods and reverse relations on them are looked up as
+        ``object_node`` would, since the template uses them anyway.
+        """
+        shared = self.shared_node(obj, depth, paths)
+        if shared is not None:
+            return shared
+        return self.share(obj, depth, paths, ContextNode(
+            ContextNode.DICT, self.model_children(obj, depth, paths),
+            label=unicode(obj)))
+
+    def model_children(self, obj, depth, paths=None):
+        fields = [('pk', 'pk')]
+        for field in obj._meta.fields:
+            if field.rel:
+                # The key is always there; the object is only worth fetching
+                # if its fields would be more than reprs
+                fields.append((field.attname, field.attname))
+                if depth >= 2:
+                    fields.append((field.name, field.name))
+            else:
+                fields.append((field.name, field.attname))
+        for name, attname in fields:
+            field_paths = child_paths(paths, name)
+            if field_paths is not PRUNED:
+                yield name, self.node(getattr(obj, attname, None), depth-1,
+                                      field_paths)
+        if depth >= 2:
+            for field in obj._meta.many_to_many:
+                field_paths = child_paths(paths, field.name)
+                if field_paths is not PRUNED:
+                    yield field.name, self.queryset_node(
+                        getattr(obj, field.name).all(), depth-1, field_paths)
+        if paths is not None and ANY not in paths:
+            fields.extend((field.name, field.name)
+                          for field in obj._meta.many_to_many)
+            for child in self.object_children(
+                    obj, depth, paths, skip=set(name for name, _ in fields)):
+                yield child
+
+    def iterable_children(self, list_, depth, paths=None):
+        item_paths = self.item_paths(paths)
+        for item in itertools.islice(list_, 0, self.max_length):
+            yield (self.node(item, depth-1, item_paths) if depth
+                   else repr_maybe(item))
+
+    # How far below a dict method the template reaches the dict's values,
+    # e.g. {% for key, value in dict.items %} reads dict.items.*.*
+    DICT_METHOD_DEPTHS = (('items', 2), ('iteritems', 2), ('values', 1),
+                          ('itervalues', 1))
+    DICT_KEY_METHODS = ('keys', 'iterkeys')
+
+    def dict_value_paths(self, paths):
+        """Return the paths read from every value of a dict read through
+        ``paths``."""
+        value_paths = [paths.get(ANY, PRUNED)]
+        for method, method_depth in self.DICT_METHOD_DEPTHS:
+            method_paths = paths.get(method, PRUNED)
+            for _ in xrange(method_depth):
+                method_paths = child_paths(method_paths, ANY)
+            value_paths.append(method_paths)
+        if [method for method in self.DICT_KEY_METHODS if method in paths]:
+            value_paths.append({})
+        return merge_paths(*value_paths)
+
+    def dict_children(self, dict_, depth, paths=None):
+        if paths is None:
+            for key, value in dict_.iteritems():
+                yield key, (self.node(value, depth-1) if depth
+                            else repr_maybe(value))
+            return
+        value_paths = self.dict_value_paths(paths)
+        if value_paths is PRUNED:
+            # Only look up the keys the template reads
+            keys = [key for key in paths if key in dict_]
+        else:
+            keys = dict_.iterkeys()
+        for key in keys:
+            key_paths = merge_paths(paths.get(key, PRUNED), value_paths)
+            if key_paths is PRUNED:
                 continue
+            value = dict_[key]
+            yield key, (self.node(value, depth-1, key_paths) if depth
+                        else repr_maybe(value))
+
+    # Methods of model instances that must never be called
+    MODEL_METHOD_EXCLUSIONS = ('save', 'delete', 'save_base', 'clean',
+                               'clean_fields', 'full_clean')
+
+    # Attribute plans, by class
+    _attribute_plans = {}
+
+    @classmethod
+    def attribute_plan(cls, klass):
+        """Return how to serialize the public attributes of ``klass``'s
+        instances, as ``(plan, known_names)``.
+
+        ``plan`` is a sequence of ``(attrname, is_method)`` pairs covering
+        every public attribute; ``is_method`` is None for methods that are
+        never called, as they need arguments or change the database, but
+        are still shown where the depth runs out. ``known_names`` is the
+        set of their names. The plan is built once per class, so
+        serializing many instances of it only introspects the class once.
+        """
+        try:
+            return cls._attribute_plans[klass]
+        except KeyError:
+            pass
+        plan, known_names = [], set()
+        is_model = issubclass(klass, models.Model)
+        for attrname in dir(klass):
+            if attrname.startswith('_'):
+                continue
+            known_names.add(attrname)
+            class_attr = getattr(klass, attrname, None)
             # only argumentless methods are allowed
-            if isinstance(attr, type(self.serialize_object)):
-                # logger.debug('instancemethod')
+            if isinstance(class_attr, types.MethodType):
                 # Common exceptions
-                if (isinstance(obj, models.Model) and
-                            attrname in ('save', 'delete', 'save_base',
-                                         'clean', 'clean_fields',
-                                         'full_clean')):
+                if is_model and attrname in cls.MODEL_METHOD_EXCLUSIONS:
+                    plan.append((attrname, None))
                     continue
-                argspec = inspect.getargspec(attr)
-                # logger.debug('%s', argspec)
+                argspec = inspect.getargspec(class_attr)
                 args, defaults = argspec.args, argspec.defaults
                 if args and args[0] == 'self':
                     # this should always be the case.
                     args.pop(0)
-                # logger.debug('%s %s', args, defaults)
                 if args and (not defaults or len(defaults) < len(args)):
                     # This function requires arguments
-                    # logger.debug('requires args')
+                    plan.append((attrname, None))
                     continue
+                plan.append((attrname, True))
+            else:
+                plan.append((attrname, False))
+        cls._attribute_plans[klass] = (tuple(plan), frozenset(known_names))
+        return cls._attribute_plans[klass]
+
+    def shared_node(self, obj, depth, paths=None):
+        """Return what to emit for an object that was already serialized, or
+        None if it has to be serialized.
+
+        An object seen at least as deep is reused; this includes objects
+        still being serialized, which is what breaks cycles. Its first
+        occurrence gets an ``"__id__"`` key and repeats become
+        ``{"__ref__": id}``, which ``compiler.load_fixture`` puts back
+        together. Objects that serialized to a plain string are just
+        repeated. An object reached through different template paths is
+        serialized once for each, as different parts of it are needed.
+        """
+        if not self.share_objects:
+            return None
+        shared = self._shared.get((id(obj), id(paths)))
+        if shared is None or shared[2] < depth:
+            return None
+        node = shared[3]
+        if node.output is not None and not isinstance(node.output, dict):
+            return node.output
+        if node.shared_id is None:
+            self._last_shared_id += 1
+            node.shared_id = self._last_shared_id
+            if node.output is not None:
+                node.output['__id__'] = node.shared_id
+        return {'__ref__': node.shared_id}
+
+    def share(self, obj, depth, paths, node):
+        if self.share_objects:
+            # Holding on to obj and paths keeps their ids from being reused
+            self._shared[(id(obj), id(paths))] = (obj, paths, depth, node)
+        return node
+
+    def object_node(self, obj, depth, paths=None):
+        shared = self.shared_node(obj, depth, paths)
+        if shared is not None:
+            return shared
+        return self.share(obj, depth, paths, ContextNode(
+            ContextNode.OBJECT, self.object_children(obj, depth, paths),
+            label=unicode(obj)))
+
+    def object_children(self, obj, depth, paths=None, skip=()):
+        plan, known_names = self.attribute_plan(
+            getattr(obj, '__class__', type(obj)))
+        if paths is not None and ANY not in paths:
+            # Only look up the attributes the template reads
+            plan = [(attrname, is_method) for attrname, is_method in plan
+                    if attrname in paths]
+            instance_attrs = [(attrname, False) for attrname in paths
+                              if attrname not in known_names
+                              and attrname in getattr(obj, '__dict__', ())
+                              and not attrname.startswith('_')]
+        else:
+            instance_attrs = [(attrname, False)
+                              for attrname in getattr(obj, '__dict__', ())
+                              if not attrname.startswith('_')
+                              and attrname not in known_names]
+        for attrname, is_method in itertools.chain(plan, instance_attrs):
+            if attrname in skip:
+                continue
+            attr_paths = child_paths(paths, attrname)
+            if attr_paths is PRUNED:
+                continue
+            try:
+                attr = getattr(obj, attrname)
+            except AttributeError:
+                continue
+            if not depth:
+                yield attrname, repr_maybe(attr)
+                continue
+            if is_method is None:
+                continue
+            if is_method:
                 try:
-                    to_return[attrname] = self.serialize_foo(attr(),
-                                                             depth-1)
+                    child = self.node(attr(), depth-1, attr_paths)
                 except Exception, e:
-                    to_return[attrname] = repr_maybe(e)
+                    child = repr_maybe(e)
+                yield attrname, child
             else:
-                # logger.debug('not instancemethod')
-                to_return[attrname] = self.serialize_foo(attr, depth-1)
-        if len(to_return) == 1:
-            return to_return.values()[0]
-        return to_return
+                yield attrname, self.node(attr, depth-1, attr_paths)
 
-    def serialize_foo(self, foo, depth):
+    def node(self, foo, depth, paths=None):
+        """Return ``foo`` ready for serializing to ``depth``: a
+        ``ContextNode`` whose children are worked out lazily, or a plain
+        value the JSON encoder can handle.
+
+        ``paths`` are the variable paths read below ``foo``; None means
+        all of them.
+        """
         if not depth:
             return repr_maybe(foo)
+        if isinstance(foo, LazyObject):
+            # Like request.user: the wrapper passes __class__ through to the
+            # wrapped object, but not __dict__
+            if foo._wrapped is empty:
+                foo._setup()
+            foo = foo._wrapped
         # We don't decrement depth here, as this is merely a dispatch method
         if isinstance(foo, type):
             return repr_maybe(foo)
         if isinstance(foo, QuerySet):
-            return self.serialize_queryset(foo, depth)
+            return self.queryset_node(foo, depth, paths)
+        if self.model_fields and isinstance(foo, models.Model):
+            return self.model_node(foo, depth, paths)
         if isinstance(foo, basestring):
             return foo
         if isinstance(foo, dict):
-            return self.serialize_dict(foo, depth)
+            return ContextNode(ContextNode.DICT,
+                               self.dict_children(foo, depth, paths))
         if hasattr(foo, '__iter__'):
-            return self.serialize_iterable(foo, depth)
+            return ContextNode(ContextNode.LIST,
+                               self.iterable_children(foo, depth, paths))
         # Anything that isn't a primitive should be treated as an object
         if not isinstance(foo, (int, long, bool, float, complex,
                                 decimal.Decimal, set)):
-            return self.serialize_object(foo, depth)
+            return self.object_node(foo, depth, paths)
         # Trust that our json serializer knows what to do here, then.
         return foo
 
+    def build(self, node):
+        """Turn a node into plain lists and dicts."""
+        if not isinstance(node, ContextNode):
+            return node
+        if node.kind == ContextNode.LIST and node.truncated is None:
+            return [self.build(child) for child in node.children]
+        output = node.output = {}
+        if node.label is not None:
+            output[""] = node.label
+        if node.shared_id is not None:
+            output['__id__'] = node.shared_id
+        if node.truncated is not None:
+            output['__truncated__'] = node.truncated
+        for key, child in node.children:
+            output[key] = self.build(child)
+        if node.kind == ContextNode.OBJECT and output.keys() == [""]:
+            node.output = output[""]
+        return node.output
+
+    def iter_json(self, node, encoder, indent=None, level=0):
+        """Yield the JSON for a node in chunks, working out its children as
+        they are written."""
+        if not isinstance(node, ContextNode):
+            yield encoder.encode(node)
+            return
+        if indent is None:
+            newline = closing = ''
+        else:
+            newline = '\n' + ' ' * (indent * (level + 1))
+            closing = '\n' + ' ' * (indent * level)
+        if node.kind == ContextNode.LIST and node.truncated is None:
+            opened = False
+            for child in node.children:
+                yield ',' + newline if opened else '[' + newline
+                opened = True
+                for chunk in self.iter_json(child, encoder, indent, level+1):
+                    yield chunk
+            if opened:
+                yield closing
+                yield ']'
+            else:
+                yield '[]'
+            return
+        children = iter(node.children)
+        if node.kind == ContextNode.OBJECT and node.truncated is None:
+            # Objects with nothing but a label are written as the label
+            try:
+                first_child = next(children)
+            except StopIteration:
+                node.output = node.label
+                yield encoder.encode(node.label)
+                return
+            children = itertools.chain([first_child], children)
+        # Written objects can't gain an "__id__" later, so any that might be
+        # referenced get one up front
+        if self.share_objects and node.kind != ContextNode.LIST and (
+                node.label is not None and node.shared_id is None):
+            self._last_shared_id += 1
+            node.shared_id = self._last_shared_id
+        node.output = {}
+        head = []
+        if node.label is not None:
+            head.append(("", node.label))
+        if node.shared_id is not None:
+            head.append(('__id__', node.shared_id))
+        if node.truncated is not None:
+            head.append(('__truncated__', node.truncated))
+        opened = False
+        for key, child in itertools.chain(head, children):
+            yield ',' + newline if opened else '{' + newline
+            opened = True
+            yield encoder.encode(json_key(key)) + ': '
+            for chunk in self.iter_json(child, encoder, indent, level+1):
+                yield chunk
+        if opened:
+            yield closing
+            yield '}'
+        else:
+            yield '{}'
+
+    def exhausted_budget(self, nodes, size, started):
+        """Return the name of the first budget used up, or None."""
+        if self.max_nodes is not None and nodes >= self.max_nodes:
+            return 'nodes'
+        if self.max_bytes is not None and size >= self.max_bytes:
+            return 'bytes'
+        if (self.max_seconds is not None and
+                time.time() - started >= self.max_seconds):
+            return 'seconds'
+        return None
+
+    def expand(self, root):
+        """Work out the children of ``root`` and every node below it,
+        breadth first, until a budget runs out. Nodes not reached by then are
+        truncated.
+
+        Budgets are checked between nodes, so each can be overrun by the
+        children of one node. Sizes are estimated from the unindented JSON.
+        """
+        encoder = DateTimeAwareJSONEncoder()
+        started = time.time()
+        nodes = size = 0
+        queue = deque([root])
+        while queue:
+            node = queue.popleft()
+            if self.truncated is None:
+                self.truncated = self.exhausted_budget(nodes, size, started)
+                if self.truncated is not None:
+                    logger.warning('The %s budget ran out after %d nodes; '
+                                   'truncating %d unvisited nodes',
+                                   self.truncated, nodes, len(queue) + 1)
+            if self.truncated is not None:
+                node.children = ()
+                node.truncated = self.truncated
+                continue
+            children = []
+            for child in node.children:
+                if node.kind == ContextNode.LIST:
+                    value = child
+                else:
+                    value = child[1]
+                    size += len(json_key(child[0])) + 4
+                nodes += 1
+                if isinstance(value, ContextNode):
+                    size += len(value.label or '') + 2
+                    queue.append(value)
+                else:
+                    size += len(encoder.encode(value))
+                children.append(child)
+            node.children = children
+        return root
+
+    def context_node(self, context):
+        self._shared = {}
+        self._last_shared_id = 0
+        self.truncated = None
+        root = ContextNode(ContextNode.DICT,
+                           self.dict_children(context, self.max_depth,
+                                              self.paths))
+        if (self.max_nodes, self.max_bytes, self.max_seconds) != (None,) * 3:
+            self.expand(root)
+        return root
+
+    # The serialize_* methods build the whole serialized value in memory
+    def serialize_queryset(self, qs, depth):
+        return self.build(self.queryset_node(qs, depth))
+
+    def serialize_model(self, obj, depth):
+        return self.build(self.model_node(obj, depth))
+
+    def serialize_iterable(self, list_, depth):
+        return self.build(ContextNode(ContextNode.LIST,
+                                      self.iterable_children(list_, depth)))
+
+    def serialize_dict(self, dict_, depth):
+        return self.build(ContextNode(ContextNode.DICT,
+                                      self.dict_children(dict_, depth)))
+
+    def serialize_object(self, obj, depth):
+        return self.build(self.object_node(obj, depth))
+
+    def serialize_foo(self, foo, depth):
+        return self.build(self.node(foo, depth))
+
     def serialize(self, context):
-        return self.serialize_dict(context, depth=self.max_depth)
+        try:
+            return self.build(self.context_node(context))
+        finally:
+            self._shared = {}
 
-    def generate_context(self):
-        context = self.fake_request_to_get_context()
+    def get_context(self):
+        if self.view_caller is not None:
+            context = self.direct_request_to_get_context()
+        else:
+            context = self.fake_request_to_get_context()
         # We don't need the view in there...
         del context['view']
-        return self.serialize(context)
+        return context
+
+    def generate_context(self):
+        context = self.get_context()
+        with CaptureQueriesContext(connection) as queries:
+            serialized = self.serialize(context)
+        self.queries_issued = len(queries)
+        logger.debug('Serializing the context issued %d queries',
+                     self.queries_issued)
+        return serialized
 
+    def generate_context_json(self, indent=4):
+        """Yield the serialized context as chunks of JSON.
+
+        The context is walked as it is written, so the whole serialized
+        structure is never held in memory at once - unless a budget is set,
+        as ``expand`` walks it breadth first before anything is written.
+        With ``share_objects``, every object is written with an
+        ``"__id__"``, since it can't be added once a later reference turns
+        up.
+        """
+        context = self.get_context()
+        encoder = DateTimeAwareJSONEncoder()
+        with CaptureQueriesContext(connection) as queries:
+            try:
+                for chunk in self.iter_json(self.context_node(context),
+                                            encoder, indent):
+                    yield chunk
+            finally:
+                self._shared = {}
+        self.queries_issued = len(queries)
+        logger.debug('Serializing the context issued %d queries',
+                     self.queries_issued)
@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os
+from importlib import import_module
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+from django.conf import settings
+
+_jade_apps = None
+
+
+def app_directory(app):
+    """Return the directory of an installed app given its dotted name."""
+    return os.path.dirname(import_module(app).__file__)
+
+
+def jade_apps():
+    """Return the installed apps that have a ``jade_templates`` directory.
+
+    The list is worked out once and kept until ``forget_jade_apps`` is
+    called, which every ``jade_tools`` command does when it starts.
+    """
+    global _jade_apps
+    if _jade_apps is None:
+        _jade_apps = [app for app in settings.INSTALLED_APPS
+                      if os.path.isdir(os.path.join(app_directory(app),
+                                                    'jade_templates'))]
+        logger.debug('Apps with Jade templates: %s', _jade_apps)
+    return _jade_apps
+
+
+def forget_jade_apps():
+    global _jade_apps
+    _jade_apps = None
+
+
+def walk(top):
+    """Like ``os.walk``, yielding ``(path, files)`` for ``top`` and every
+    directory below it, but listing each directory once with ``scandir``
+    when it is available. As with ``os.walk``, symlinked directories are
+    neither followed nor listed as files."""
+    if scandir is None:
+        for path, dirs, files in os.walk(top):
+            yield path, files
+        return
+    pending = [top]
+    while pending:
+        path = pending.pop()
+        files = []
+        try:
+            entries = list(scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            if entry.is_dir(follow_symlinks=False):
+                pending.append(entry.path)
+            elif not (entry.is_symlink() and entry.is_dir()):
+                files.append(entry.name)
+        yield path, files
+
+
+class PrefixTrie(object):
+    """Answers "is this string a prefix of any of the stored strings?" in
+    time proportional to the length of the string."""
+
+    def __init__(self, strings=()):
+        self.root = {}
+        for string in strings:
+            self.add(string)
+
+    def add(self, string):
+        node = self.root
+        for char in string:
+            node = node.setdefault(char, {})
+
+    def is_prefix_of_any(self, string):
+        if not self.root:
+            return False
+        node = self.root
+        for char in string:
+            node = node.get(char)
+            if node is None:
+                return False
+        return True
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os
+import threading
+from collections import OrderedDict
+
+from django.template.base import TemplateDoesNotExist
+from django.template.loader import BaseLoader
+
+from jade_tools import discovery
+from jade_tools.compiler import DjangoJadeCompiler
+
+
+class LRUCache(object):
+    """A bounded mapping that evicts the least recently used entry."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._entries.pop(key)
+            except KeyError:
+                return default
+            self._entries[key] = value
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = value
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class Loader(BaseLoader):
+    """Template loader that compiles Jade sources on demand.
+
+    ``app/foo.html`` resolves to ``jade_templates/foo.jade`` inside the
+    installed app ``app`` (dotted app names map to slashes, as in the output
+    of the compile subcommand). Parsed templates are kept in an LRU cache and
+    recompiled when the mtime of the source or of anything it includes
+    changes, so no offline compile step is needed. Loads from several
+    threads at once are safe: the cache is locked and the include expander
+    compilers share keeps no per-call state::
+
+        TEMPLATE_LOADERS = (
+            ('jade_tools.loader.Loader', 512),
+            'django.template.loaders.app_directories.Loader',
+        )
+    """
+    is_usable = True
+
+    def __init__(self, max_size=256):
+        self.cache = LRUCache(max_size)
+        self._compilers = {}
+
+    def get_compiler(self, app):
+        compiler_obj = self._compilers.get(app)
+        if compiler_obj is None:
+            # Threads racing here agree on whichever compiler is stored first
+            compiler_obj = self._compilers.setdefault(app,
+                                                      DjangoJadeCompiler(app))
+        return compiler_obj
+
+    def find_jade_template(self, template_name):
+        """Return ``(compiler, tmpl_data)`` for the Jade source behind an HTML
+        template name."""
+        base_name, extension = os.path.splitext(template_name)
+        if extension != '.html':
+            raise TemplateDoesNotExist(template_name)
+        for app in discovery.jade_apps():
+            prefix = '%s/' % (app.replace('.', '/'),)
+            if not base_name.startswith(prefix):
+                continue
+            compiler_obj = self.get_compiler(app)
+            template_path, base_file_name = os.path.split(
+                base_name[len(prefix):])
+            path = os.path.join(compiler_obj.template_path, template_path)
+            if os.path.exists(os.path.join(path,
+                                           '%s.jade' % (base_file_name,))):
+                return compiler_obj, {'base_file_name': base_file_name,
+                                      'path': path,
+                                      'template_path': template_path}
+        raise TemplateDoesNotExist(template_name)
+
+    def _mtimes(self, paths):
+        return dict((path, os.path.getmtime(path)) for path in paths)
+
+    def load_template(self, template_name, template_dirs=None):
+        cached = self.cache.get(template_name)
+        if cached is not None:
+            template, mtimes = cached
+            try:
+                if self._mtimes(mtimes) == mtimes:
+                    return template, None
+            except OSError:
+                pass
+            logger.debug('Jade source of %s changed - recompiling',
+                         template_name)
+            self.cache.delete(template_name)
+        compiler_obj, tmpl_data = self.find_jade_template(template_name)
+        jade_file = os.path.join(
+            tmpl_data['path'], '%s.jade' % (tmpl_data['base_file_name'],))
+        # Take the mtimes first, so an edit made while compiling is noticed
+        # on the next load
+        mtimes = self._mtimes(
+            [jade_file] + compiler_obj.find_includes(**tmpl_data))
+        _, template = compiler_obj.compile_to_template(**tmpl_data)
+        self.cache.set(template_name, (template, mtimes))
+        return template, None
+
+    def load_template_source(self, template_name, template_dirs=None):
+        compiler_obj, tmpl_data = self.find_jade_template(template_name)
+        return compiler_obj.compile(**tmpl_data), template_name
+
+    def reset(self):
+        self.cache.clear()
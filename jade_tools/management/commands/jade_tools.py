@@ -8,16 +8,20 @@ logger = logging.getLogger(__name__)
 import sys
 import os
 import json
+import time
+from collections import OrderedDict
 from optparse import make_option
 
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
-from django.core.files.storage import FileSystemStorage
-from django.core.files.base import ContentFile
+from django.core.servers import basehttp
 from django.core.serializers.json import DateTimeAwareJSONEncoder
-from django.db.models import get_app
 
-from jade_tools import compiler, contextmaker
+from jade_tools import (analysis, benchmark, compiler, contextmaker,
+                        discovery, preview, profiling, server, workers)
+from jade_tools.compilecache import CompileCache
+from jade_tools.manifest import BuildManifest, write_file_atomically
+from jade_tools.watcher import TemplateWatcher
 
 class Command(BaseCommand):
     args = '<subcommand>'
@@ -88,73 +92,788 @@ class Command(BaseCommand):
             help='In lists and other unmapped iterables, the maximum number of '
                  'objects per iterable to include when generating static '
                  'context files'
+        ),
+        make_option(
+            '--max-nodes',
+            action='store',
+            dest='max_nodes',
+            default=0,
+            type=int,
+            help='The most values to put in a static context file. With any '
+                 'budget set, the context is walked breadth first, and what '
+                 'is left when a budget runs out is marked "__truncated__".'
+        ),
+        make_option(
+            '--max-bytes',
+            action='store',
+            dest='max_bytes',
+            default=0,
+            type=int,
+            help='Roughly the largest static context file to generate, in '
+                 'bytes'
+        ),
+        make_option(
+            '--max-seconds',
+            action='store',
+            dest='max_seconds',
+            default=0,
+            type=float,
+            help='The longest to spend walking the context for a static '
+                 'context file, in seconds'
+        ),
+        make_option(
+            '--direct',
+            action='store_true',
+            dest='direct',
+            default=False,
+            help='When generating static context files, call the view '
+                 'directly with a bare request instead of making a full '
+                 'test request, and read the context off its '
+                 'TemplateResponse without rendering it'
+        ),
+        make_option(
+            '--middleware',
+            action='store',
+            dest='middleware',
+            default='',
+            help='Comma-delimited middleware classes to put --direct '
+                 'requests through. Defaults to none.'
+        ),
+        make_option(
+            '--share-objects',
+            action='store_true',
+            dest='share_objects',
+            default=False,
+            help='When generating static context files, serialize objects '
+                 'reached through several paths only once and refer back to '
+                 'them elsewhere, which also stops reference cycles'
+        ),
+        make_option(
+            '--model-fields',
+            action='store_true',
+            dest='model_fields',
+            default=False,
+            help='When generating static context files, serialize model '
+                 'instances from their fields only, fetching related rows '
+                 'with select_related/prefetch_related instead of calling '
+                 'every method and reverse relation'
+        ),
+        make_option(
+            '--prune',
+            action='store_true',
+            dest='prune',
+            default=False,
+            help='When generating static context files, only serialize the '
+                 'variables the Jade template reads, as found by analysing '
+                 'the compiled template. Needs --template outside batches.'
+        ),
+        make_option(
+            '--template',
+            action='store',
+            dest='template',
+            default='',
+            help='The Jade template (without extension) to work on, as '
+                 '"<app>:<path>": the only one compile and mock build, and '
+                 'the one make_context --prune analyses and benchmark loads '
+                 'the fixture of'
+        ),
+        make_option(
+            '--stream',
+            action='store_true',
+            dest='stream',
+            default=False,
+            help='Write static context files as the context is walked, '
+                 'instead of serializing it all in memory first. Budgets '
+                 'are spent breadth first, so with --max-nodes, --max-bytes '
+                 'or --max-seconds the context is still walked in memory '
+                 'before any of it is written.'
+        ),
+        make_option(
+            '--output',
+            action='store',
+            dest='output',
+            default='',
+            help='The file to write a generated static context file, or the '
+                 'JSON results of a benchmark, to. Defaults to stdout for '
+                 'context files.'
+        ),
+        make_option(
+            '--batch',
+            action='store',
+            dest='batch',
+            default='',
+            help='A JSON file listing views to generate static context files '
+                 'for in one run, as objects with "view_name", optional '
+                 '"args" and "kwargs", and a "template" of the form '
+                 '"<app>:<path>" naming the Jade template (without '
+                 'extension) the context file is written next to'
+        ),
+        make_option(
+            '--manifest',
+            action='store',
+            dest='manifest',
+            default='.jade_tools_manifest.json',
+            help='The file recording the source and include hashes of every '
+                 'compiled template, so unchanged templates are skipped on '
+                 'the next build. Pass an empty value to disable it.'
+        ),
+        make_option(
+            '--jobs',
+            action='store',
+            dest='jobs',
+            default=1,
+            type=int,
+            help='The number of worker processes to compile templates, '
+                 'render mock pages or generate batches of static context '
+                 'files with'
+        ),
+        make_option(
+            '--interval',
+            action='store',
+            dest='interval',
+            default=0.25,
+            type=float,
+            help='How often, in seconds, the watch subcommand polls for '
+                 'changed files'
+        ),
+        make_option(
+            '--with-mock',
+            action='store_true',
+            dest='with_mock',
+            default=False,
+            help='Also re-render the mock HTML of affected pages in the '
+                 'watch subcommand'
+        ),
+        make_option(
+            '--pages',
+            action='store',
+            dest='pages',
+            default=20,
+            type=int,
+            help='The number of pages in the synthetic template tree the '
+                 'benchmark subcommand builds'
+        ),
+        make_option(
+            '--include-depth',
+            action='store',
+            dest='include_depth',
+            default=2,
+            type=int,
+            help='How many levels of partials benchmark pages include'
+        ),
+        make_option(
+            '--fan-out',
+            action='store',
+            dest='fan_out',
+            default=2,
+            type=int,
+            help='How many partials each benchmark page and partial includes'
+        ),
+        make_option(
+            '--fixture-size',
+            action='store',
+            dest='fixture_size',
+            default=10,
+            type=int,
+            help='The number of items in each benchmark fixture and context'
+        ),
+        make_option(
+            '--repeat',
+            action='store',
+            dest='repeat',
+            default=3,
+            type=int,
+            help='How many times the benchmark runs each phase'
+        ),
+        make_option(
+            '--compare',
+            action='store',
+            dest='compare',
+            default='',
+            help='The JSON results of an earlier benchmark run to compare '
+                 'against'
+        ),
+        make_option(
+            '--profile',
+            action='store',
+            dest='profile',
+            default='',
+            help='Time every phase of building each template - loading, '
+                 'include expansion, Jade processing, parsing, rendering and '
+                 'writing - print the slowest and write a JSON report to '
+                 'this file'
+        ),
+        make_option(
+            '--include-templates',
+            action='store_true',
+            dest='include_templates',
+            default=False,
+            help='Compile Jade partials to Django templates of their own and '
+                 'include them in pages with {% include %}, instead of '
+                 'inlining them into every page. Partials whose includes '
+                 'have lines nested under them, or that use the page\'s '
+                 'blocks, mixins or text, are still inlined.'
+        ),
+        make_option(
+            '--lazy-fixtures',
+            action='store_true',
+            dest='lazy_fixtures',
+            default=False,
+            help='Decode the parts of mock fixtures pages look up as they '
+                 'are rendered, instead of loading whole fixtures up front. '
+                 'With --template, the benchmark subcommand compares both '
+                 'ways of loading that page\'s fixture.'
+        ),
+        make_option(
+            '--compile-cache',
+            action='store',
+            dest='compile_cache',
+            default='',
+            help='A directory to keep pyjade compile results in, keyed by a '
+                 'hash of the expanded Jade source and the pyjade version, '
+                 'so identical sources are never compiled twice. It can be '
+                 'shared between checkouts and CI jobs. The benchmark '
+                 'subcommand doesn\'t use it, to time actual compiles.'
+        ),
+        make_option(
+            '--compile-cache-size',
+            action='store',
+            dest='compile_cache_size',
+            default=100,
+            type=int,
+            help='The size in megabytes the compile cache is kept under by '
+                 'removing the least recently used entries'
+        ),
+        make_option(
+            '--force',
+            action='store_true',
+            dest='force',
+            default=False,
+            help='Rebuild every template, even those the manifest says are '
+                 'up to date'
+        ),
+        make_option(
+            '--socket',
+            action='store',
+            dest='socket',
+            default='.jade_tools.sock',
+            help='The Unix socket the serve subcommand listens on for '
+                 'python -m jade_tools.client'
+        ),
+        make_option(
+            '--listen',
+            action='store',
+            dest='listen',
+            default='127.0.0.1:8000',
+            help='The address and port the preview subcommand serves mock '
+                 'pages on'
         )
     )
 
-    def handle_compile(self, app, **other_options):
-        app_list = [app] if app else settings.INSTALLED_APPS
+    def build_selection(self, app, template):
+        """Return the apps to build and a function telling whether to build
+        a template in them, given the --app and --template options."""
+        if template:
+            app, template_dir, base_file_name = self.jade_template(template)
+            return [app], lambda tmpl_data: (
+                (tmpl_data['template_path'], tmpl_data['base_file_name']) ==
+                (template_dir, base_file_name))
+        app_list = [app] if app else discovery.jade_apps()
         if [a for a in app_list if a not in settings.INSTALLED_APPS]:
             raise CommandError('Invalid app specified. Only installed apps may '
                                'be used.')
+        return app_list, lambda tmpl_data: True
+
+    def handle_compile(self, app, template, manifest, force, jobs,
+                       **other_options):
+        app_list, selected = self.build_selection(app, template)
+        build_manifest = BuildManifest(manifest)
+        pending, partials, skipped = [], OrderedDict(), 0
         for app in app_list:
-            html_path = os.path.join(
-                os.path.dirname(get_app(app).__file__), 'templates',
-                app.replace('.', '/'))
+            html_path = self.html_path(app)
             compiler_obj = compiler.DjangoJadeCompiler(app)
             for tmpl_data in compiler_obj.find_compilable_jade_templates():
+                if not selected(tmpl_data):
+                    continue
                 logger.debug('Template data: %s', tmpl_data)
-                html = compiler_obj.compile(**tmpl_data)
-                logger.info('Saving HTML file %s', html_path)
-                if not os.path.exists(html_path):
-                    os.makedirs(html_path)
-                open(os.path.join(html_path,
+                html_file = os.path.join(
+                    html_path, '%s.html' % (tmpl_data['base_file_name'],))
+                if compiler_obj.include_templates:
+                    for partial_data in compiler_obj.find_linked_partials(
+                            **tmpl_data):
+                        partials[compiler.partial_html_file(
+                            html_path, partial_data)] = (compiler_obj,
+                                                         partial_data)
+                job = self.compile_job(build_manifest, compiler_obj,
+                                       tmpl_data, html_file, force)
+                if job is None:
+                    skipped += 1
+                else:
+                    pending.append(job)
+        partial_jobs = []
+        for stage in self.partial_stages(partials.values()):
+            partial_jobs.append([])
+            for compiler_obj, tmpl_data in stage:
+                job = self.compile_job(
+                    build_manifest, compiler_obj, tmpl_data,
+                    compiler.partial_html_file(
+                        self.html_path(compiler_obj.app), tmpl_data), force)
+                if job is None:
+                    skipped += 1
+                else:
+                    partial_jobs[-1].append(job)
+        manifest_updates = dict((job[2], (jade_file, inputs))
+                                for job, jade_file, inputs
+                                in pending + [job for stage in partial_jobs
+                                              for job in stage])
+        try:
+            # Templates can only be parsed once the partials they include
+            # exist
+            for stage in partial_jobs + [pending]:
+                jobs_done = workers.run_jobs(
+                    workers.compile_to_file, [job for job, _, _ in stage],
+                    jobs)
+                for _, _, html_file in jobs_done:
+                    jade_file, inputs = manifest_updates[html_file]
+                    build_manifest.record(
+                        build_manifest.key('compile', jade_file), inputs)
+        finally:
+            # Keep whatever did compile even if a template failed
+            build_manifest.save()
+        self.stdout.write('Compiled %d template(s), skipped %d unchanged.' %
+                          (len(manifest_updates), skipped))
+
+    def partial_stages(self, partials):
+        """Split ``(compiler_obj, tmpl_data)`` pairs for partials, in the
+        order ``find_linked_partials`` gives them, into stages that each
+        only include partials of earlier stages, so every stage can be
+        compiled in parallel."""
+        stages, stage_of = [], {}
+        for compiler_obj, tmpl_data in partials:
+            jade_file = os.path.join(
+                tmpl_data['path'], '%s.jade' % (tmpl_data['base_file_name'],))
+            stage = max([stage_of.get(partial_file, -1) + 1 for partial_file
+                         in compiler_obj.linked_partial_files(jade_file)] or
+                        [0])
+            stage_of[jade_file] = stage
+            if stage == len(stages):
+                stages.append([])
+            stages[stage].append((compiler_obj, tmpl_data))
+        return stages
+
+    def compile_job(self, build_manifest, compiler_obj, tmpl_data, html_file,
+                    force):
+        """Return ``(job, jade_file, inputs)`` for compiling a template, or
+        None if the manifest says its HTML is up to date."""
+        jade_file = os.path.join(
+            tmpl_data['path'], '%s.jade' % (tmpl_data['base_file_name'],))
+        inputs = build_manifest.fingerprint(
+            [jade_file] + compiler_obj.find_includes(**tmpl_data))
+        # Includes compile differently with partials linked rather than
+        # inlined
+        inputs['--include-templates'] = compiler_obj.include_templates
+        if (not force and os.path.exists(html_file) and
+                build_manifest.is_current(
+                    build_manifest.key('compile', jade_file), inputs)):
+            logger.info('Skipping %s - neither it nor its includes have '
+                        'changed', jade_file)
+            return None
+        return (compiler_obj.app, tmpl_data, html_file), jade_file, inputs
+
+    def handle_mock(self, app, template, url_map, output_prefix,
+                    base_context, jobs, manifest, force, **other_options):
+        app_list, selected = self.build_selection(app, template)
+        self.prepare_mock(url_map, output_prefix, base_context)
+        # One incremental compile up front; templates it finds current are
+        # left alone
+        self.handle_compile(app, template=template, jobs=jobs,
+                            manifest=manifest, force=force, **other_options)
+        build_manifest = BuildManifest(manifest)
+        base_context_data = (json.load(open(base_context))
+                             if base_context else {})
+        compilers, pages, skipped = {}, [], 0
+        manifest_updates = {}
+        for app in app_list:
+            compilers[app] = compiler.DjangoJadeCompiler(
+                app, base_context=base_context_data)
+            for tmpl_data in compilers[app].find_compilable_jade_templates(standalone=False):
+                if not selected(tmpl_data):
+                    continue
+                logger.debug('Template data: %s', tmpl_data)
+                output_file = self.mock_output_file(tmpl_data, output_prefix)
+                # A page only changes if its compiled template, the compiled
+                # partials it includes, its fixture, the base context or the
+                # URL map did
+                partial_files = []
+                if compilers[app].include_templates:
+                    partial_files = [
+                        compiler.partial_html_file(self.html_path(app),
+                                                   partial_data)
+                        for partial_data in compilers[app].find_linked_partials(
+                            **tmpl_data)]
+                inputs = build_manifest.fingerprint(
+                    [os.path.join(self.html_path(app),
                                   '%s.html' % (tmpl_data['base_file_name'],)),
-                     'w').write(html.encode('utf8') if isinstance(html, unicode) else html)
+                     os.path.join(tmpl_data['path'],
+                                  '%s.json' % (tmpl_data['base_file_name'],))]
+                    + partial_files
+                    + [path for path in (base_context, url_map) if path])
+                if (not force and os.path.exists(output_file) and
+                        build_manifest.is_current(
+                            build_manifest.key('mock', output_file), inputs)):
+                    logger.info('Skipping %s - its inputs have not changed',
+                                output_file)
+                    skipped += 1
+                    continue
+                manifest_updates[output_file] = inputs
+                pages.append((app, tmpl_data))
+        parallel = jobs > 1 and len(pages) > 1
+        if parallel:
+            rendered = workers.run_jobs(
+                workers.mock_to_html, pages, jobs,
+                initializer=workers.initialize_mock_worker,
+                initargs=(json.load(open(url_map)) if url_map else {},
+                          base_context_data))
+        else:
+            rendered = (((app, tmpl_data), compilers[app].mock(
+                            pipeline=self.mock_pipeline, **tmpl_data))
+                        for app, tmpl_data in pages)
+        try:
+            for (app, tmpl_data), html in rendered:
+                output_file = self.save_mock_page(compilers[app], tmpl_data,
+                                                  html, output_prefix)
+                build_manifest.record(build_manifest.key('mock', output_file),
+                                      manifest_updates[output_file])
+        finally:
+            build_manifest.save()
+        if parallel:
+            self.stdout.write('Rendered %d mock page(s) with %d worker(s), '
+                              'skipped %d unchanged.' %
+                              (len(pages), jobs, skipped))
+        else:
+            self.stdout.write(
+                'Rendered %d mock page(s), skipped %d unchanged; sharing one '
+                'request pipeline saved %dms of middleware setup.' % (
+                    self.mock_pipeline.requests_made, skipped,
+                    self.mock_pipeline.setup_time_saved * 1000))
 
-    def handle_mock(self, app, url_map, output_prefix, base_context,
-                    **other_options):
-        app_list = [app] if app else settings.INSTALLED_APPS
-        if [a for a in app_list if a not in settings.INSTALLED_APPS]:
-            raise CommandError('Invalid app specified. Only installed apps may '
-                               'be used.')
+    def prepare_mock(self, url_map, output_prefix, base_context):
         if url_map and not os.path.exists(url_map):
             raise CommandError('No such URL map at that path.')
         if base_context and not os.path.exists(base_context):
-            raise CommandError('No such URL map at that path.')
+            raise CommandError('No such base context at that path.')
         if '..' in output_prefix.split('/') or output_prefix.startswith('/'):
             raise CommandError('Treachery! No root paths or parent navigation '
                                'when specifying an output prefix, you clever '
                                'devil.')
         compiler.DjangoJadeCompiler.preempt_url_patterns(
             json.load(open(url_map)) if url_map else {})
-        for app in app_list:
-            self.handle_compile(app)
-            compiler_obj = compiler.DjangoJadeCompiler(
-                app,
-                base_context=(json.load(open(base_context))
-                              if base_context else {}))
-            for tmpl_data in compiler_obj.find_compilable_jade_templates(standalone=False):
-                logger.debug('Template data: %s', tmpl_data)
-                html = compiler_obj.mock(**tmpl_data)
-                faux_file = ContentFile(html)
-                html_path = os.path.join(output_prefix,
-                                         tmpl_data['template_path'],
-                                         '%s.html' % tmpl_data['base_file_name'])
-                logger.info('Saving HTML file %s', html_path)
-                storage_obj = FileSystemStorage(location=settings.STATIC_ROOT)
-                storage_obj.save(html_path, faux_file)
+        # Shared by every page rendered in this run
+        self.mock_pipeline = compiler.MockPipeline()
+
+    def mock_page(self, compiler_obj, tmpl_data, output_prefix):
+        html = compiler_obj.mock(pipeline=self.mock_pipeline, **tmpl_data)
+        self.save_mock_page(compiler_obj, tmpl_data, html, output_prefix)
+
+    def mock_output_file(self, tmpl_data, output_prefix):
+        return os.path.join(settings.STATIC_ROOT, output_prefix,
+                            tmpl_data['template_path'],
+                            '%s.html' % tmpl_data['base_file_name'])
+
+    def save_mock_page(self, compiler_obj, tmpl_data, html, output_prefix):
+        output_file = self.mock_output_file(tmpl_data, output_prefix)
+        logger.info('Saving HTML file %s', output_file)
+        # Replace the previous render in place; readers never see a partial
+        # file
+        with profiling.phase(compiler_obj.template_name(
+                tmpl_data['base_file_name'], tmpl_data['template_path']),
+                'write'):
+            write_file_atomically(
+                output_file,
+                html.encode('utf8') if isinstance(html, unicode) else html)
+        return output_file
+
+    def handle_watch(self, app, interval, with_mock, url_map, output_prefix,
+                     base_context, **other_options):
+        app_list, _ = self.build_selection(app, None)
+        # Start from an up to date build so only later edits need handling
+        self.handle_compile(app, **other_options)
+        if with_mock:
+            self.prepare_mock(url_map, output_prefix, base_context)
+        compilers = [compiler.DjangoJadeCompiler(
+                         app,
+                         base_context=(json.load(open(base_context))
+                                       if base_context else {}))
+                     for app in app_list]
+        html_paths = dict((compiler_obj, self.html_path(compiler_obj.app))
+                          for compiler_obj in compilers)
+
+        def rebuild(pages):
+            started = time.time()
+            partials = OrderedDict()
+            for compiler_obj, tmpl_data in pages:
+                if not compiler_obj.include_templates:
+                    continue
+                try:
+                    for partial_data in compiler_obj.find_linked_partials(
+                            **tmpl_data):
+                        partials[compiler.partial_html_file(
+                            html_paths[compiler_obj], partial_data)] = (
+                                compiler_obj, partial_data)
+                except Exception:
+                    logger.exception('Could not resolve includes of %s',
+                                     tmpl_data['base_file_name'])
+            for html_file, (compiler_obj, tmpl_data) in partials.items():
+                try:
+                    workers.compile_to_file(
+                        (compiler_obj.app, tmpl_data, html_file))
+                except Exception:
+                    logger.exception('Failed to compile %s', html_file)
+            for compiler_obj, tmpl_data in pages:
+                html_file = os.path.join(
+                    html_paths[compiler_obj],
+                    '%s.html' % (tmpl_data['base_file_name'],))
+                try:
+                    workers.compile_to_file(
+                        (compiler_obj.app, tmpl_data, html_file))
+                except Exception:
+                    logger.exception('Failed to compile %s', html_file)
+            if with_mock:
+                compiler.reset_template_loaders()
+                for compiler_obj, tmpl_data in pages:
+                    if not os.path.exists(os.path.join(
+                            tmpl_data['path'],
+                            '%s.json' % (tmpl_data['base_file_name'],))):
+                        continue
+                    try:
+                        self.mock_page(compiler_obj, tmpl_data, output_prefix)
+                    except Exception:
+                        logger.exception('Failed to mock %s',
+                                         tmpl_data['base_file_name'])
+            self.stdout.write('Rebuilt %d page(s) in %dms.' % (
+                len(pages), (time.time() - started) * 1000))
+
+        self.stdout.write('Watching for changes. Press Ctrl-C to stop.')
+        try:
+            TemplateWatcher(compilers, interval=interval).watch(rebuild)
+        except KeyboardInterrupt:
+            pass
+
+    def handle_preview(self, app, url_map, output_prefix, base_context,
+                       listen, **other_options):
+        app_list, _ = self.build_selection(app, None)
+        addr, _, port = listen.rpartition(':')
+        if not port.isdigit():
+            raise CommandError('Invalid address to listen on; use '
+                               'address:port or port.')
+        self.prepare_mock(url_map, output_prefix, base_context)
+        compilers = [compiler.DjangoJadeCompiler(app) for app in app_list]
+        preview_server = preview.PreviewServer(
+            compilers,
+            dict((compiler_obj, self.html_path(compiler_obj.app))
+                 for compiler_obj in compilers),
+            output_prefix=output_prefix, url_map=url_map,
+            base_context=base_context, pipeline=self.mock_pipeline)
+        self.stdout.write('Previewing %d mock page(s) at http://%s:%s/. '
+                          'Press Ctrl-C to stop.' % (
+                              len(preview_server.pages), addr or '127.0.0.1', port))
+        try:
+            # One request at a time; rendering shares Django's global state
+            basehttp.run(addr or '127.0.0.1', int(port), preview_server)
+        except KeyboardInterrupt:
+            pass
+
+    def html_path(self, app):
+        return os.path.join(discovery.app_directory(app),
+                            'templates', app.replace('.', '/'))
 
     def handle_make_context(self, view_name, view_args, max_depth, max_items,
+                            max_nodes, max_bytes, max_seconds, direct,
+                            middleware, share_objects, model_fields, prune,
+                            template, stream, output, batch, jobs,
                             **other_options):
+        # Budgets of 0 are no budgets
+        maker_options = dict(max_depth=max_depth, max_length=max_items,
+                             max_nodes=max_nodes or None,
+                             max_bytes=max_bytes or None,
+                             max_seconds=max_seconds or None,
+                             share_objects=share_objects,
+                             model_fields=model_fields)
+        middleware = tuple(path.strip() for path in middleware.split(',')
+                           if path.strip())
+        if batch:
+            if direct:
+                maker_options['direct_middleware'] = middleware
+            return self.make_context_batch(batch, jobs, maker_options, prune)
+        if prune and not template:
+            raise CommandError('Pruning needs the --template the context is '
+                               'for.')
         args = view_args.split(',')
-        maker = contextmaker.ContextMaker(view_name, args,
-                                          max_depth=max_depth,
-                                          max_length=max_items)
-        sys.stdout.write(json.dumps(
-            maker.generate_context(),
-            cls=DateTimeAwareJSONEncoder,
-            indent=4
-        ).encode('utf-8'))
+        maker = contextmaker.ContextMaker(
+            view_name, args,
+            paths=self.template_paths(template) if prune else None,
+            view_caller=(contextmaker.DirectViewCaller(middleware)
+                         if direct else None),
+            **maker_options)
+        if stream and (max_nodes or max_bytes or max_seconds):
+            self.stderr.write('With a budget, the context is walked in memory '
+                              'before it is streamed.')
+        output_file = open(output, 'wb') if output else sys.stdout
+        try:
+            if stream:
+                for chunk in maker.generate_context_json(indent=4):
+                    output_file.write(chunk.encode('utf-8'))
+            else:
+                output_file.write(json.dumps(
+                    maker.generate_context(),
+                    cls=DateTimeAwareJSONEncoder,
+                    indent=4
+                ).encode('utf-8'))
+        finally:
+            if output:
+                output_file.close()
+        # stdout may be the fixture itself
+        self.stderr.write('Serializing the context issued %d queries.' %
+                          (maker.queries_issued,))
+        if maker.truncated:
+            self.stderr.write('The %s budget ran out; the rest of the context '
+                              'is marked "__truncated__".' %
+                              (maker.truncated,))
+
+    def jade_template(self, template):
+        """Return the app, directory and base file name of a Jade template
+        given as ``app:path``."""
+        app, _, template_path = (template or '').partition(':')
+        if app not in settings.INSTALLED_APPS or not template_path:
+            raise CommandError('Templates are given as "<installed app>:'
+                               '<path>", not %r.' % (template,))
+        template_dir, base_file_name = os.path.split(template_path)
+        if not os.path.exists(os.path.join(
+                discovery.app_directory(app), 'jade_templates',
+                '%s.jade' % (template_path,))):
+            raise CommandError('No Jade template %s.jade in %s.' %
+                               (template_path, app))
+        return app, template_dir, base_file_name
+
+    def template_paths(self, template):
+        """Return the variable paths the Jade template ``app:path`` reads,
+        or None if they can't all be worked out."""
+        app, template_dir, base_file_name = self.jade_template(template)
+        compiler_obj = compiler.DjangoJadeCompiler(app)
+        _, tmpl = compiler_obj.compile_to_template(
+            base_file_name=base_file_name,
+            path=os.path.join(compiler_obj.template_path, template_dir),
+            template_path=template_dir)
+        paths = analysis.template_variable_paths(tmpl)
+        if paths is None:
+            logger.warning('Could not work out every variable %s reads - '
+                           'serializing its whole context', template)
+        return paths
+
+    def make_context_batch(self, batch, jobs, maker_options, prune=False):
+        if not os.path.exists(batch):
+            raise CommandError('No such batch file at that path.')
+        context_jobs = []
+        for entry in json.load(open(batch)):
+            app, template_dir, base_file_name = self.jade_template(
+                entry.get('template'))
+            if 'view_name' not in entry:
+                raise CommandError('Batch entry for %s has no "view_name".' %
+                                   (entry['template'],))
+            options = maker_options
+            if prune:
+                options = dict(maker_options,
+                               paths=self.template_paths(entry['template']))
+            context_jobs.append((entry, options, os.path.join(
+                discovery.app_directory(app), 'jade_templates', template_dir,
+                '%s.json' % (base_file_name,))))
+        started = time.time()
+        queries = 0
+        for _, queries_issued in workers.run_jobs(
+                workers.make_context_file, context_jobs, jobs):
+            queries += queries_issued
+        self.stdout.write('Generated %d context file(s) in %.1fs; '
+                          'serializing them issued %d queries.' %
+                          (len(context_jobs), time.time() - started, queries))
+
+    def handle_benchmark(self, app, pages, include_depth, fan_out,
+                         fixture_size, repeat, output, compare, template,
+                         **other_options):
+        if template:
+            return self.benchmark_fixture_loading(template, repeat, output,
+                                                  **other_options)
+        # Any installed app will do; the templates are generated elsewhere
+        app = app or 'jade_tools'
+        if app not in settings.INSTALLED_APPS:
+            raise CommandError('Invalid app specified. Only installed apps may '
+                               'be used.')
+        if compare and not os.path.exists(compare):
+            raise CommandError('No such benchmark results at that path.')
+        if min(pages, repeat, fan_out) < 1 or min(include_depth,
+                                                  fixture_size) < 0:
+            raise CommandError('Benchmarks need at least one page, run and '
+                               'partial per level.')
+        results = benchmark.Benchmark(
+            app, pages=pages, include_depth=include_depth, fan_out=fan_out,
+            fixture_size=fixture_size, repeat=repeat).run()
+        for phase in benchmark.PHASES:
+            timings = results['phases'][phase]
+            self.stdout.write('%-32s min %8.1fms  median %8.1fms' % (
+                phase, timings['min'] * 1000, timings['median'] * 1000))
+        if compare:
+            self.stdout.write('Compared to %s:' % (compare,))
+            for phase, before, after, ratio in benchmark.compare(
+                    results, json.load(open(compare))):
+                self.stdout.write('%-32s %8.1fms -> %8.1fms  %s' % (
+                    phase, before * 1000, after * 1000,
+                    'x%.2f' % (ratio,) if ratio is not None else '-'))
+        if output:
+            write_file_atomically(output, json.dumps(results, indent=2,
+                                                     sort_keys=True))
+
+    def handle_serve(self, socket, **other_options):
+        self.stdout.write('Serving compile, mock and make_context on %s; '
+                          'run them with python -m jade_tools.client.' %
+                          (socket,))
+        try:
+            server.CommandServer(socket, Command).serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+    def benchmark_fixture_loading(self, template, repeat, output, url_map,
+                                  base_context, **other_options):
+        app, template_dir, base_file_name = self.jade_template(template)
+        tmpl_data = {'base_file_name': base_file_name,
+                     'path': os.path.join(discovery.app_directory(app),
+                                          'jade_templates', template_dir),
+                     'template_path': template_dir}
+        if not os.path.exists(os.path.join(tmpl_data['path'],
+                                           '%s.json' % (base_file_name,))):
+            raise CommandError('%s has no fixture to load.' % (template,))
+        if repeat < 1:
+            raise CommandError('Benchmarks need at least one run.')
+        self.prepare_mock(url_map, '', base_context)
+        self.handle_compile(app, template=template, **other_options)
+        results = benchmark.compare_fixture_loading(
+            app, tmpl_data, json.load(open(url_map)) if url_map else {},
+            json.load(open(base_context)) if base_context else {},
+            repeat=repeat)
+        self.stdout.write('Loading and rendering %s (%.1fKB fixture), best '
+                          'of %d:' % (template, results['fixture_size'] / 1024.,
+                                      repeat))
+        for mode in ('eager', 'lazy'):
+            timings = results['modes'][mode]
+            self.stdout.write(
+                '%-6s %8.1fms (fixture %.1fms, render %.1fms)  peak memory '
+                '+%.1fMB' % (mode, timings['seconds'] * 1000,
+                             timings['fixture_seconds'] * 1000,
+                             timings['render_seconds'] * 1000,
+                             timings['peak_memory'] / 1024. / 1024))
+        if not results['same_output']:
+            self.stderr.write('The lazy fixture rendered differently!')
+        if output:
+            write_file_atomically(output, json.dumps(results, indent=2,
+                                                     sort_keys=True))
 
     def handle(self, *args, **options):
         if len(args) != 1:
@@ -164,4 +883,26 @@ class Command(BaseCommand):
             subcommand_fn = getattr(self, 'handle_%s' % subcommand)
         except AttributeError:
             raise CommandError('Invalid subcommand specified.')
-        subcommand_fn(**options)
+        # Apps may have gained or lost Jade templates since the last command
+        # this process ran
+        discovery.forget_jade_apps()
+        compiler.DjangoJadeCompiler.include_templates = options[
+            'include_templates']
+        compiler.DjangoJadeCompiler.lazy_fixtures = options['lazy_fixtures']
+        # Set every time, as a server runs many commands in one process
+        compiler.DjangoJadeCompiler.compile_cache = (
+            CompileCache(options['compile_cache'],
+                         options['compile_cache_size'] * 1024 * 1024)
+            if options['compile_cache'] else None)
+        if not options['profile']:
+            return subcommand_fn(**options)
+        profiling.start()
+        try:
+            subcommand_fn(**options)
+        finally:
+            profiler = profiling.stop()
+            report = profiler.report()
+            write_file_atomically(options['profile'],
+                                  json.dumps(report, indent=2, sort_keys=True))
+            for line in profiler.summary(report):
+                self.stdout.write(line)
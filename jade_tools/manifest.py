@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os
+import json
+import hashlib
+import tempfile
+
+import jade_tools
+
+
+class BuildManifest(object):
+    """Persistent record of the inputs each build output was produced from.
+
+    Every entry maps a build key (e.g. a template) to a dict of input file
+    paths and their content hashes. An output only needs rebuilding when the
+    hashes of its inputs differ from the ones recorded for it last time.
+    Paths are stored relative to the manifest's directory, so a manifest
+    stays valid when the project is checked out somewhere else.
+
+    Passing a false-y path gives a manifest that never considers anything
+    current and is never saved.
+    """
+
+    FORMAT_VERSION = 2
+
+    def __init__(self, path):
+        self.path = path
+        self.root = os.path.dirname(os.path.abspath(path or '.'))
+        self.entries = {}
+        self._hashes = {}
+        if path and os.path.exists(path):
+            try:
+                data = json.load(open(path))
+            except ValueError:
+                logger.warning('Ignoring unreadable build manifest %s', path)
+                data = {}
+            if (data.get('format') == self.FORMAT_VERSION and
+                    data.get('jade_tools') == jade_tools.__version__):
+                self.entries = data.get('entries', {})
+            else:
+                logger.info('Build manifest %s is from another version of '
+                            'jade_tools - rebuilding everything', path)
+
+    def hash_file(self, path):
+        """Return the SHA-1 of a file's contents, or None if it is missing.
+
+        Hashes are memoized on the file's mtime and size, so asking for the
+        same unchanged file repeatedly only reads it once.
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        cached = self._hashes.get(path)
+        if cached and cached[0] == (stat.st_mtime, stat.st_size):
+            return cached[1]
+        digest = hashlib.sha1(open(path, 'rb').read()).hexdigest()
+        self._hashes[path] = ((stat.st_mtime, stat.st_size), digest)
+        return digest
+
+    def relative(self, path):
+        return os.path.relpath(os.path.abspath(path), self.root)
+
+    def key(self, kind, path):
+        """Return the key of the ``kind`` of build output (e.g.
+        ``"compile"``) made from or to ``path``."""
+        return '%s:%s' % (kind, self.relative(path))
+
+    def fingerprint(self, paths):
+        return dict((self.relative(path), self.hash_file(path))
+                    for path in paths)
+
+    def is_current(self, key, inputs):
+        if not self.path:
+            return False
+        return self.entries.get(key) == inputs
+
+    def record(self, key, inputs):
+        self.entries[key] = inputs
+
+    def save(self):
+        if not self.path:
+            return
+        write_file_atomically(self.path, json.dumps(
+            {'format': self.FORMAT_VERSION,
+             'jade_tools': jade_tools.__version__,
+             'entries': self.entries},
+            indent=2, sort_keys=True))
+        logger.debug('Saved build manifest %s', self.path)
+
+
+def write_file_atomically(path, content):
+    """Replace ``path`` with ``content`` via a temporary file and a rename,
+    creating parent directories as needed.
+
+    ``content`` is a byte string or an iterable of byte strings.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as tmp_file:
+            if isinstance(content, str):
+                tmp_file.write(content)
+            else:
+                for chunk in content:
+                    tmp_file.write(chunk)
+        # mkstemp creates files only the owner can read
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmp_path, 0666 & ~umask)
+        os.rename(tmp_path, path)
+    except:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
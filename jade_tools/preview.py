@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os
+import cgi
+import json
+import time
+import urlparse
+import traceback
+
+from django.conf import settings
+
+from jade_tools import compiler, workers
+
+
+class PreviewServer(object):
+    """A WSGI application serving mock pages, each rendered when it is first
+    requested rather than all of them up front.
+
+    Pages are served where ``mock`` would have saved them under
+    ``STATIC_ROOT``, i.e. at ``STATIC_URL`` plus the output prefix and the
+    page's path, so relative links between pages and links to static files
+    work the same. A rendered page is kept until its Jade source, fixture,
+    includes, the base context or the URL map change; the next request for
+    it then compiles and renders it again.
+    """
+
+    def __init__(self, compilers, html_paths, output_prefix='', url_map=None,
+                 base_context=None, pipeline=None):
+        self.compilers = compilers
+        self.html_paths = html_paths
+        self.url_prefix = '%s/' % (os.path.join(
+            urlparse.urlparse(settings.STATIC_URL).path,
+            output_prefix).rstrip('/'),)
+        self.url_map = url_map
+        self.base_context = base_context
+        self.pipeline = pipeline or compiler.MockPipeline()
+        self.pages = {}
+        self.rendered = {}
+        self.input_mtimes = None
+        self.static_handler = None
+        if 'django.contrib.staticfiles' in settings.INSTALLED_APPS:
+            from django.contrib.staticfiles.handlers import StaticFilesHandler
+            from django.core.handlers.wsgi import WSGIHandler
+            self.static_handler = StaticFilesHandler(WSGIHandler())
+        self.discover()
+
+    def discover(self):
+        """(Re)build the map of URLs to the pages that have a fixture."""
+        self.pages = {}
+        for compiler_obj in self.compilers:
+            for tmpl_data in compiler_obj.find_compilable_jade_templates(
+                    standalone=False):
+                if not os.path.exists(self.fixture_file(tmpl_data)):
+                    continue
+                url = '%s%s.html' % (self.url_prefix, os.path.join(
+                    tmpl_data['template_path'], tmpl_data['base_file_name']))
+                self.pages[url] = (compiler_obj, tmpl_data)
+        logger.debug('Previewing %d page(s)', len(self.pages))
+
+    def fixture_file(self, tmpl_data):
+        return os.path.join(tmpl_data['path'],
+                            '%s.json' % (tmpl_data['base_file_name'],))
+
+    def refresh_inputs(self):
+        """Reload the URL map and base context if they changed, dropping
+        every rendered page."""
+        mtimes = [os.path.getmtime(path) if path else None
+                  for path in (self.url_map, self.base_context)]
+        if mtimes == self.input_mtimes:
+            return
+        compiler.DjangoJadeCompiler.preempt_url_patterns(
+            json.load(open(self.url_map)) if self.url_map else {})
+        base_context = (json.load(open(self.base_context))
+                        if self.base_context else {})
+        for compiler_obj in self.compilers:
+            compiler_obj.base_context = base_context
+        self.input_mtimes = mtimes
+        self.rendered = {}
+
+    def fingerprint(self, compiler_obj, tmpl_data):
+        jade_file = os.path.join(tmpl_data['path'],
+                                 '%s.jade' % (tmpl_data['base_file_name'],))
+        paths = ([jade_file, self.fixture_file(tmpl_data)] +
+                 compiler_obj.find_includes(**tmpl_data))
+        return tuple((path, os.path.getmtime(path)) for path in paths)
+
+    def render(self, url):
+        """Return a page's HTML and whether it came from the cache."""
+        compiler_obj, tmpl_data = self.pages[url]
+        fingerprint = self.fingerprint(compiler_obj, tmpl_data)
+        cached = self.rendered.get(url)
+        if cached is not None and cached[0] == fingerprint:
+            return cached[1], True
+        html_path = self.html_paths[compiler_obj]
+        if compiler_obj.include_templates:
+            for partial_data in compiler_obj.find_linked_partials(**tmpl_data):
+                workers.compile_to_file((
+                    compiler_obj.app, partial_data,
+                    compiler.partial_html_file(html_path, partial_data)))
+        workers.compile_to_file((compiler_obj.app, tmpl_data, os.path.join(
+            html_path, '%s.html' % (tmpl_data['base_file_name'],))))
+        compiler.reset_template_loaders()
+        html = compiler_obj.mock(pipeline=self.pipeline, **tmpl_data)
+        # A plain str, as WSGI servers insist on; not Django's SafeBytes
+        html = str(html.encode('utf8') if isinstance(html, unicode) else html)
+        self.rendered[url] = (fingerprint, html)
+        return html, False
+
+    def index(self):
+        links = [u'<li><a href="%s">%s</a></li>' % (cgi.escape(url, True),
+                                                    cgi.escape(url))
+                 for url in sorted(self.pages)]
+        return (u'<!DOCTYPE html><title>Mock pages</title><ul>%s</ul>' %
+                (u''.join(links),)).encode('utf8')
+
+    def __call__(self, environ, start_response):
+        path = environ.get('PATH_INFO') or '/'
+        self.refresh_inputs()
+        if (path not in self.pages and path.startswith(self.url_prefix) and
+                path.endswith('.html')):
+            # Perhaps a page added since; other paths, like static files,
+            # can't be pages
+            self.discover()
+        if path == '/':
+            start_response('200 OK',
+                           [('Content-Type', 'text/html; charset=utf-8')])
+            return [self.index()]
+        if path not in self.pages:
+            if self.static_handler is not None:
+                return self.static_handler(environ, start_response)
+            start_response('404 Not Found', [('Content-Type', 'text/plain')])
+            return ['No mock page at %s\n' % (path,)]
+        started = time.time()
+        try:
+            html, cached = self.render(path)
+        except Exception:
+            logger.exception('Failed to render %s', path)
+            start_response('500 Internal Server Error',
+                           [('Content-Type', 'text/plain; charset=utf-8')])
+            return [traceback.format_exc()]
+        logger.info('%s %s in %.1fms', 'Served cached' if cached else
+                    'Rendered', path, (time.time() - started) * 1000)
+        start_response('200 OK',
+                       [('Content-Type', 'text/html; charset=utf-8'),
+                        ('X-Mock-Cache', 'hit' if cached else 'miss')])
+        return [html]
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import time
+from collections import defaultdict
+
+# The profiler collecting timings in this process, if any
+active = None
+
+
+class _Phase(object):
+    def __init__(self, profiler, template, name):
+        self.profiler = profiler
+        self.template = template
+        self.name = name
+
+    def __enter__(self):
+        self.started = time.time()
+
+    def __exit__(self, *exc_info):
+        self.profiler.record(self.template, self.name,
+                             time.time() - self.started)
+
+
+class _NoPhase(object):
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_no_phase = _NoPhase()
+
+
+class Profiler(object):
+    """Wall time and call counts per template and build phase.
+
+    ``timings`` maps template names to phase names to ``[seconds,
+    count]``. Time spent outside any one template, such as loading
+    middleware, is recorded under the template ``"-"``.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.timings = defaultdict(lambda: defaultdict(lambda: [0.0, 0]))
+
+    def phase(self, template, name):
+        return _Phase(self, template, name)
+
+    def record(self, template, name, seconds, count=1):
+        timing = self.timings[template][name]
+        timing[0] += seconds
+        timing[1] += count
+
+    def merge(self, timings):
+        """Add the ``timings`` of another profiler, e.g. a worker's."""
+        for template, phases in timings.iteritems():
+            for name, (seconds, count) in phases.iteritems():
+                self.record(template, name, seconds, count)
+
+    def plain_timings(self):
+        return dict((template, dict((name, list(timing))
+                                    for name, timing in phases.iteritems()))
+                    for template, phases in self.timings.iteritems())
+
+    def report(self):
+        phases = defaultdict(lambda: {'seconds': 0.0, 'count': 0})
+        templates = {}
+        for template, template_phases in self.timings.iteritems():
+            templates[template] = {'seconds': 0.0, 'phases': {}}
+            for name, (seconds, count) in template_phases.iteritems():
+                templates[template]['seconds'] += seconds
+                templates[template]['phases'][name] = {'seconds': seconds,
+                                                       'count': count}
+                phases[name]['seconds'] += seconds
+                phases[name]['count'] += count
+        return {'format': 1,
+                'wall_time': time.time() - self.started,
+                'phases': dict(phases),
+                'templates': templates}
+
+    def summary(self, report, limit=10):
+        """Return the lines of a summary of the slowest phases and
+        templates."""
+        lines = ['%-40s %11s %11s' % ('Phase', 'total', 'calls')]
+        for name, timing in sorted(report['phases'].iteritems(),
+                                   key=lambda item: -item[1]['seconds']):
+            lines.append('%-40s %9.1fms %11d' % (
+                name, timing['seconds'] * 1000, timing['count']))
+        lines.append('%-40s %11s  %s' % ('Slowest templates', 'total',
+                                         'slowest phase'))
+        slowest = sorted(report['templates'].iteritems(),
+                         key=lambda item: -item[1]['seconds'])[:limit]
+        for template, timing in slowest:
+            name, phase_timing = max(timing['phases'].iteritems(),
+                                     key=lambda item: item[1]['seconds'])
+            lines.append('%-40s %9.1fms  %s (%.1fms)' % (
+                template, timing['seconds'] * 1000, name,
+                phase_timing['seconds'] * 1000))
+        lines.append('Wall time %.1fms' % (report['wall_time'] * 1000,))
+        return lines
+
+
+def phase(template, name):
+    """Time a ``with`` block as phase ``name`` of ``template`` if profiling
+    is on; otherwise do nothing."""
+    if active is None:
+        return _no_phase
+    return active.phase(template, name)
+
+
+def start():
+    global active
+    active = Profiler()
+    return active
+
+
+def stop():
+    global active
+    profiler, active = active, None
+    return profiler
+
+
+class ProfiledCall(object):
+    """Wraps a worker function so each call is profiled in the worker and
+    its timings are returned alongside its result, as
+    ``(result, timings)``."""
+
+    def __init__(self, fn):
+        self.fn = fn
+
+    def __call__(self, job):
+        profiler = start()
+        try:
+            result = self.fn(job)
+        finally:
+            stop()
+        return result, profiler.plain_timings()
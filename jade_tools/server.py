@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os
+import sys
+import json
+import time
+import errno
+import socket
+import traceback
+from StringIO import StringIO
+
+from django.core.management.base import CommandError
+from django.db import connections
+
+from jade_tools.compiler import DjangoJadeCompiler, reset_template_loaders
+
+# What a client may ask the server to run
+SUBCOMMANDS = ('compile', 'mock', 'make_context')
+
+
+class CommandServer(object):
+    """Runs ``jade_tools`` subcommands for clients connecting to a Unix
+    socket, so Django, the installed apps and pyjade are only imported and
+    set up once.
+
+    Clients (see ``jade_tools.client``) send one JSON line,
+    ``{"argv": [...], "cwd": "..."}``, with the arguments they would have
+    given ``manage.py jade_tools``. The server runs the command in that
+    directory and answers with one JSON line holding its exit status, stdout
+    and stderr. Requests are handled one at a time.
+    """
+
+    def __init__(self, socket_path, command_class):
+        self.socket_path = socket_path
+        self.command_class = command_class
+        self.requests_served = 0
+
+    def listen(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            os.remove(self.socket_path)
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+        # Only the user running the server can connect
+        umask = os.umask(0177)
+        try:
+            sock.bind(self.socket_path)
+        finally:
+            os.umask(umask)
+        sock.listen(16)
+        return sock
+
+    def serve_forever(self):
+        sock = self.listen()
+        logger.info('Serving jade_tools on %s', self.socket_path)
+        try:
+            while True:
+                connection, _ = sock.accept()
+                try:
+                    self.handle_connection(connection)
+                except Exception:
+                    logger.exception('Failed to handle a request')
+                finally:
+                    connection.close()
+        finally:
+            sock.close()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+    def handle_connection(self, connection):
+        request = json.loads(connection.makefile('rb').readline())
+        started = time.time()
+        status, stdout, stderr = self.run(request['argv'],
+                                          request.get('cwd') or os.getcwd())
+        logger.info('Ran %s in %.1fms', ' '.join(request['argv']),
+                    (time.time() - started) * 1000)
+        connection.sendall(json.dumps({
+            'status': status,
+            'stdout': stdout.decode('utf8', 'replace'),
+            'stderr': stderr.decode('utf8', 'replace')}) + '\n')
+        self.requests_served += 1
+
+    def run(self, argv, cwd):
+        """Run the command with ``argv`` in ``cwd``, returning its exit
+        status, stdout and stderr."""
+        if not argv or argv[0] not in SUBCOMMANDS:
+            return 2, '', 'The server runs %s.\n' % (', '.join(SUBCOMMANDS),)
+        command = self.command_class()
+        parser = command.create_parser('manage.py', 'jade_tools')
+        stdout, stderr = StringIO(), StringIO()
+        real_stdout, real_stderr, real_cwd = sys.stdout, sys.stderr, os.getcwd()
+        status = 0
+        # Commands write straight to sys.stdout too, e.g. make_context
+        sys.stdout, sys.stderr = stdout, stderr
+        try:
+            os.chdir(cwd)
+            options, args = parser.parse_args(argv)
+            command.execute(*args, skip_validation=True, **vars(options))
+        except CommandError, e:
+            # As manage.py reports them
+            stderr.write('CommandError: %s\n' % (e,))
+            status = 1
+        except SystemExit, e:
+            # As Python exits: None is success, messages are failures
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                stderr.write('%s\n' % (e.code,))
+                status = 1
+        except Exception:
+            traceback.print_exc(file=stderr)
+            status = 1
+        finally:
+            sys.stdout, sys.stderr = real_stdout, real_stderr
+            os.chdir(real_cwd)
+            self.reset()
+        return status, stdout.getvalue(), stderr.getvalue()
+
+    def reset(self):
+        """Undo what one command leaves behind that would affect the
+        next."""
+        DjangoJadeCompiler.restore_url_patterns()
+        # Templates compiled by this command must not be served stale
+        reset_template_loaders()
+        for connection in connections.all():
+            connection.close()
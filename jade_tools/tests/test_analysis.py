@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from django import template
+from django.template import Template, TemplateDoesNotExist, loader_tags
+from django.template.base import builtins
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from jade_tools import analysis
+from jade_tools.analysis import TemplateAnalysis, template_variable_paths
+
+TEMPLATES = {
+    'card.html': '{{ card.title }}{{ secret }}',
+    'base.html': ('<title>{{ site.name }}</title>'
+                  '{% block content %}{{ block.super }}{% endblock %}'),
+    'nested.html': '{% include "card.html" with card=entry %}',
+}
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def whole_context(context):
+    return ''
+
+
+@register.simple_tag
+def upper_of(value):
+    return value.upper()
+
+
+def get_template(template_name, dirs=None):
+    try:
+        return Template(TEMPLATES[template_name], name=template_name)
+    except KeyError:
+        raise TemplateDoesNotExist(template_name)
+
+
+# A value used as a whole
+T = {None: True}
+
+
+class TemplateAnalysisTest(SimpleTestCase):
+
+    def setUp(self):
+        # Constant includes load their templates as they are parsed, and
+        # the analysis loads the rest
+        self.get_templates = loader_tags.get_template, analysis.get_template
+        loader_tags.get_template = analysis.get_template = get_template
+        builtins.append(register)
+
+    def tearDown(self):
+        loader_tags.get_template, analysis.get_template = self.get_templates
+        builtins.remove(register)
+
+    def analyse(self, source):
+        result = TemplateAnalysis()
+        result.visit_template(Template(source), {})
+        return result
+
+    def assertPaths(self, source, paths):
+        self.assertEqual(template_variable_paths(Template(source)), paths)
+
+    def assertIncomplete(self, source):
+        self.assertFalse(self.analyse(source).complete)
+        self.assertIsNone(template_variable_paths(Template(source)))
+
+    def test_variables(self):
+        self.assertPaths(
+            '{{ user.username }} {{ items.0.name }} {{ True }} {{ "x" }}'
+            '{% if user.is_staff and not hidden %}{% endif %}',
+            {'user': {'username': T, 'is_staff': T},
+             'items': {'*': {'name': T}}, 'hidden': T})
+
+    def test_filters_use_the_whole_value(self):
+        self.assertPaths('{{ user.name|default:fallback.name|upper }}',
+                         {'user': {'name': T}, 'fallback': {'name': T}})
+
+    def test_for_aliases_items(self):
+        self.assertPaths(
+            '{% for item in order.items %}{{ item.name }}'
+            '{{ forloop.counter }}{% empty %}{{ item }}{% endfor %}',
+            {'order': {'items': {'*': {'name': T}}}, 'item': T})
+
+    def test_for_unpacks_items(self):
+        self.assertPaths(
+            '{% for key, value in pairs %}{{ value.x }}{% endfor %}',
+            {'pairs': {'*': {'*': {'x': T}}}})
+
+    def test_for_over_a_filtered_sequence(self):
+        self.assertPaths(
+            '{% for item in items|slice:":2" %}{{ item.name }}{% endfor %}',
+            {'items': T})
+
+    def test_with_aliases(self):
+        self.assertPaths(
+            '{% with name=user.profile.name total=items|length %}'
+            '{{ name }}{{ total }}{% endwith %}{{ name }}',
+            {'user': {'profile': {'name': T}}, 'items': T, 'name': T})
+
+    def test_include_with(self):
+        self.assertPaths(
+            '{% for item in items %}'
+            '{% include "card.html" with card=item %}{% endfor %}',
+            {'items': {'*': {'title': T}}, 'secret': T})
+
+    def test_include_with_only(self):
+        self.assertPaths('{% include "card.html" with card=item only %}',
+                         {'item': {'title': T}})
+
+    def test_nested_include(self):
+        self.assertPaths('{% include "nested.html" with entry=post %}',
+                         {'post': {'title': T}, 'secret': T})
+
+    def test_variable_include(self):
+        self.assertIncomplete('{% include template_name %}')
+        self.assertIncomplete('{% include "card.html"|add:suffix %}')
+
+    @override_settings(TEMPLATE_DEBUG=False)
+    def test_missing_include(self):
+        self.assertIncomplete('{% include "missing.html" %}')
+
+    def test_extends_literal_parent(self):
+        self.assertPaths(
+            '{% extends "base.html" %}'
+            '{% block content %}{{ article.title }}{% endblock %}',
+            {'site': {'name': T}, 'article': {'title': T}})
+
+    def test_extends_variable_parent(self):
+        self.assertIncomplete('{% extends parent %}')
+        self.assertIncomplete('{% extends "missing.html" %}')
+
+    def test_blocktrans(self):
+        self.assertPaths(
+            '{% load i18n %}{% blocktrans with name=user.name %}'
+            'Hi {{ name }}, {{ greeting }}{% endblocktrans %}',
+            {'user': {'name': T}, 'greeting': T})
+        self.assertPaths(
+            '{% load i18n %}{% blocktrans count n=cart.items|length %}'
+            '{{ n }} item{% plural %}{{ n }} items{% endblocktrans %}',
+            {'cart': {'items': T}})
+
+    def test_tags(self):
+        self.assertPaths('{% upper_of user.name %}', {'user': {'name': T}})
+        self.assertIncomplete('{% whole_context %}')
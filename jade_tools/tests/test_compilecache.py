@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import errno
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from jade_tools import compilecache
+from jade_tools.compilecache import CompileCache
+
+
+def read_only(*args):
+    raise OSError(errno.EROFS, 'Read-only file system')
+
+
+class CompileCacheTest(SimpleTestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = CompileCache(self.directory, max_size=1000)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        compilecache._compiler_version = None
+
+    def add(self, source, size=300, mtime=None):
+        key = self.cache.key(source)
+        self.cache.set(key, u'x' * size)
+        if mtime is not None:
+            os.utime(self.cache.path(key), (mtime, mtime))
+        return key
+
+    def test_write_and_hit(self):
+        key = self.cache.key(u'p caf\xe9')
+        self.assertIsNone(self.cache.get(key))
+        self.cache.set(key, u'<p>caf\xe9</p>')
+        self.assertEqual(self.cache.get(key), u'<p>caf\xe9</p>')
+        self.assertTrue(self.cache.path(key).startswith(
+            os.path.join(self.directory, key[:2], '')))
+
+    def test_key(self):
+        self.assertEqual(self.cache.key(u'p a'), self.cache.key(u'p a'))
+        self.assertNotEqual(self.cache.key(u'p a'), self.cache.key(u'p b'))
+
+    def test_compiler_version_invalidates(self):
+        key = self.add(u'p a')
+        compilecache._compiler_version = 'another-pyjade'
+        self.assertNotEqual(self.cache.key(u'p a'), key)
+        self.assertIsNone(self.cache.get(self.cache.key(u'p a')))
+
+    def test_lru_eviction(self):
+        first = self.add(u'first', mtime=100)
+        second = self.add(u'second', mtime=200)
+        third = self.add(u'third', mtime=300)
+        # Reading the oldest makes it the most recently used
+        self.cache.get(first)
+        fourth = self.add(u'fourth')
+        # Down to 90% of max_size: just the least recently used goes
+        self.assertIsNone(self.cache.get(second))
+        for key in (first, third, fourth):
+            self.assertIsNotNone(self.cache.get(key))
+        self.assertEqual(self.cache.total_size(), 900)
+
+    def test_eviction_below_max_size(self):
+        keys = [self.add(u'p %d' % (i,), size=100, mtime=i + 1)
+                for i in range(10)]
+        self.assertEqual(len(self.cache.entries()), 10)
+        self.add(u'p 10', size=100)
+        self.assertEqual(self.cache.total_size(), 900)
+        self.assertIsNone(self.cache.get(keys[0]))
+        self.assertIsNone(self.cache.get(keys[1]))
+        self.assertIsNotNone(self.cache.get(keys[2]))
+
+    def test_read_only(self):
+        key = self.add(u'p a')
+        utime, write = os.utime, compilecache.write_file_atomically
+        os.utime = compilecache.write_file_atomically = read_only
+        try:
+            self.assertEqual(self.cache.get(key), u'x' * 300)
+            other = self.cache.key(u'p b')
+            self.cache.set(other, u'<p>b</p>')
+            self.assertIsNone(self.cache.get(other))
+        finally:
+            os.utime, compilecache.write_file_atomically = utime, write
+
+    def test_unwritable_directory(self):
+        # A regular file where the cache directory would be
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+        cache = CompileCache(os.path.join(path, 'cache'))
+        cache.set(cache.key(u'p a'), u'<p>a</p>')
+        self.assertIsNone(cache.get(cache.key(u'p a')))
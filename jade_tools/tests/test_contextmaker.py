@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import re
+import json
+import inspect
+import decimal
+import datetime
+import itertools
+
+from django.conf import settings
+from django.conf.urls import patterns, url
+from django.contrib.auth.models import Permission
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.core.serializers.json import DateTimeAwareJSONEncoder
+from django.db import models
+from django.db.models.query import QuerySet
+from django.http import HttpResponse
+from django.test import SimpleTestCase, TransactionTestCase
+from django.utils.functional import SimpleLazyObject
+from django.views.generic import TemplateView
+
+from jade_tools.contextmaker import ContextMaker, DirectViewCaller
+
+
+# The test project's test view (testproject/local/views.py), with a fixed
+# date so separate requests serialize the same, and a lazy object like the
+# user context processors add
+class TestObject(object):
+    def has_args(self, foo):
+        return False
+
+    def has_no_args(self):
+        return True
+
+    def has_arg_with_default(self, default=True):
+        return default
+
+    @property
+    def is_a_property(self):
+        return True
+
+    attr = True
+    list_attr = range(1, 20)
+    dict_attr = {k: k for k in range(1, 20)}
+
+
+class TestView(TemplateView):
+    template_name = 'does/not/exist/do/not/care.html'
+
+    def get_context_data(self, **kwargs):
+        context = super(TestView, self).get_context_data(**kwargs)
+        context['list_arg'] = [1, 'a', True]
+        context['dict_arg'] = {'nested': {'nested': {'nested': 'nested'}},
+                               'decimal': decimal.Decimal('3.14159'),
+                               'date': datetime.datetime(2014, 11, 28, 12)}
+        context['too_many'] = range(1, 100)
+        context['object'] = TestObject()
+        context['qs'] = Permission.objects.all()
+        # As deep as the queryset's items, as deeper objects get their
+        # related managers' create() called
+        context['users'] = [SimpleLazyObject(
+            lambda: Permission.objects.get(codename='add_permission'))]
+        return context
+
+urlpatterns = patterns(
+    '',
+    url(r'^testview/(?P<arg1>\d+)/(?P<arg2>\d+)/', TestView.as_view(),
+        name='test-view'),
+)
+
+
+class RecordingMiddleware(object):
+    calls = []
+
+    def process_request(self, request):
+        self.calls.append(('request', request.path, request.user))
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        self.calls.append(('view', view_args, view_kwargs))
+
+
+class ShortCircuitMiddleware(object):
+    def process_request(self, request):
+        return HttpResponse('Not a template response')
+
+
+class UnusedMiddleware(object):
+    def __init__(self):
+        raise MiddlewareNotUsed
+
+
+def repr_maybe(value):
+    return repr(value) if not isinstance(value, basestring) else value
+
+
+class OldContextMaker(object):
+    """How jade_tools 0.1 serialized a context."""
+
+    def __init__(self, max_length=10, max_depth=3):
+        self.max_length = max_length
+        self.max_depth = max_depth
+
+    def serialize_queryset(self, qs, depth):
+        if depth:
+            return [self.serialize_object(obj, depth-1)
+                    for obj in qs[:self.max_length]]
+        else:
+            return repr_maybe(qs)
+
+    def serialize_iterable(self, list_, depth):
+        if depth:
+            return [self.serialize_foo(item, depth-1)
+                    for item in itertools.islice(list_, 0, self.max_length)]
+        else:
+            return [repr_maybe(item)
+                    for item in itertools.islice(list_, 0, self.max_length)]
+
+    def serialize_dict(self, dict_, depth):
+        return {key: self.serialize_foo(value, depth-1)
+                for key, value in dict_.iteritems()}
+
+    def serialize_object(self, obj, depth):
+        to_return = {"": unicode(obj)}
+        for attrname in [a for a in dir(obj) if not a.startswith('_')]:
+            try:
+                attr = getattr(obj, attrname)
+            except AttributeError:
+                continue
+            if not depth:
+                to_return[attrname] = repr_maybe(attr)
+                continue
+            if isinstance(attr, type(self.serialize_object)):
+                if (isinstance(obj, models.Model) and
+                        attrname in ('save', 'delete', 'save_base', 'clean',
+                                     'clean_fields', 'full_clean')):
+                    continue
+                argspec = inspect.getargspec(attr)
+                args, defaults = argspec.args, argspec.defaults
+                if args and args[0] == 'self':
+                    args.pop(0)
+                if args and (not defaults or len(defaults) < len(args)):
+                    continue
+                try:
+                    to_return[attrname] = self.serialize_foo(attr(),
+                                                             depth-1)
+                except Exception, e:
+                    to_return[attrname] = repr_maybe(e)
+            else:
+                to_return[attrname] = self.serialize_foo(attr, depth-1)
+        if len(to_return) == 1:
+            return to_return.values()[0]
+        return to_return
+
+    def serialize_foo(self, foo, depth):
+        if not depth:
+            return repr_maybe(foo)
+        if isinstance(foo, type):
+            return repr_maybe(foo)
+        if isinstance(foo, QuerySet):
+            return self.serialize_queryset(foo, depth)
+        if isinstance(foo, basestring):
+            return foo
+        if isinstance(foo, dict):
+            return self.serialize_dict(foo, depth)
+        if hasattr(foo, '__iter__'):
+            return self.serialize_iterable(foo, depth)
+        if not isinstance(foo, (int, long, bool, float, complex,
+                                decimal.Decimal, set)):
+            return self.serialize_object(foo, depth)
+        return foo
+
+    def serialize(self, context):
+        return self.serialize_dict(context, depth=self.max_depth)
+
+
+ADDRESS_RE = re.compile(r' at 0x[0-9a-fA-F]+')
+
+
+def normalized(serialized):
+    """``serialized`` as it would be read back from JSON, without the
+    addresses in reprs, which differ between objects."""
+    return json.loads(ADDRESS_RE.sub(
+        ' at 0x', json.dumps(serialized, cls=DateTimeAwareJSONEncoder)))
+
+
+def truncated_nodes(value):
+    if isinstance(value, dict):
+        return int('__truncated__' in value) + sum(
+            truncated_nodes(item) for item in value.values())
+    elif isinstance(value, list):
+        return sum(truncated_nodes(item) for item in value)
+    return 0
+
+
+# Serializing calls model methods whose failed queries would break a
+# TestCase's transaction
+class ContextMakerTest(TransactionTestCase):
+    urls = 'jade_tools.tests.test_contextmaker'
+
+    def maker(self, **kwargs):
+        return ContextMaker('test-view', kwargs={'arg1': 1, 'arg2': 2},
+                            **kwargs)
+
+    def generate(self, **kwargs):
+        return normalized(self.maker(**kwargs).generate_context())
+
+    def stream(self, **kwargs):
+        return json.loads(ADDRESS_RE.sub(' at 0x', ''.join(
+            self.maker(**kwargs).generate_context_json())))
+
+    def test_same_as_old_implementation(self):
+        # Any deeper and related managers' create() gets called
+        for max_length, max_depth in ((10, 3), (5, 2), (3, 1), (2, 3)):
+            maker = self.maker(max_length=max_length, max_depth=max_depth)
+            context = maker.get_context()
+            self.assertEqual(
+                normalized(maker.serialize(context)),
+                normalized(OldContextMaker(max_length, max_depth).serialize(
+                    context)))
+
+    def test_lazy_object_fields(self):
+        user = self.generate()['users'][0]
+        self.assertEqual(user['codename'], 'add_permission')
+        for name in ('id', 'name', 'content_type_id', 'content_type'):
+            self.assertIn(name, user)
+
+    def test_stream(self):
+        self.assertEqual(self.stream(), self.generate())
+        self.assertEqual(self.stream(max_depth=2, max_length=3),
+                         self.generate(max_depth=2, max_length=3))
+        self.assertEqual(self.stream(model_fields=True),
+                         self.generate(model_fields=True))
+
+    def test_direct(self):
+        caller = DirectViewCaller(settings.MIDDLEWARE_CLASSES)
+        self.assertEqual(self.generate(view_caller=caller), self.generate())
+        self.assertEqual(self.stream(view_caller=DirectViewCaller()),
+                         self.generate())
+
+    def test_budgets_not_run_out(self):
+        expected = self.generate()
+        for budget in ({'max_nodes': 10 ** 6}, {'max_bytes': 10 ** 9},
+                       {'max_seconds': 3600}):
+            maker = self.maker(**budget)
+            self.assertEqual(normalized(maker.generate_context()), expected)
+            self.assertIsNone(maker.truncated)
+            self.assertEqual(self.stream(**budget), expected)
+
+    def test_budgets_run_out(self):
+        unbudgeted = self.generate()
+        for budget, name in (({'max_nodes': 20}, 'nodes'),
+                             ({'max_bytes': 500}, 'bytes'),
+                             ({'max_seconds': 0}, 'seconds')):
+            maker = self.maker(**budget)
+            serialized = normalized(maker.generate_context())
+            self.assertEqual(maker.truncated, name)
+            self.assertTrue(truncated_nodes(serialized))
+            self.assertNotEqual(serialized, unbudgeted)
+            if name != 'seconds':
+                # Breadth first, so the top level is all there
+                self.assertEqual(sorted(serialized), sorted(unbudgeted))
+                self.assertEqual(self.stream(**budget), serialized)
+
+
+class DirectViewCallerTest(SimpleTestCase):
+    urls = 'jade_tools.tests.test_contextmaker'
+    url = '/testview/1/2/'
+
+    def tearDown(self):
+        del RecordingMiddleware.calls[:]
+
+    def middleware(self, *names):
+        return DirectViewCaller(['jade_tools.tests.test_contextmaker.%s' %
+                                 (name,) for name in names])
+
+    def test_same_context_as_the_client(self):
+        maker = ContextMaker('test-view', kwargs={'arg1': 1, 'arg2': 2})
+        from_client = maker.get_context()
+        maker.view_caller = self.middleware('RecordingMiddleware')
+        direct = maker.get_context()
+        self.assertEqual(sorted(direct), sorted(from_client))
+        for name in ('arg1', 'arg2', 'list_arg', 'dict_arg', 'too_many'):
+            self.assertEqual(direct[name], from_client[name])
+        self.assertEqual(list(direct['qs']), list(from_client['qs']))
+        self.assertIsInstance(direct['object'], TestObject)
+
+    def test_middleware(self):
+        caller = self.middleware('UnusedMiddleware', 'RecordingMiddleware')
+        self.assertEqual(len(caller.middleware), 1)
+        caller.get_context(self.url + '?page=2')
+        (_, path, user), view_call = RecordingMiddleware.calls
+        self.assertEqual(path, self.url)
+        self.assertTrue(user.is_anonymous())
+        self.assertEqual(view_call, ('view', (), {'arg1': '1', 'arg2': '2'}))
+
+    def test_response_without_context(self):
+        caller = self.middleware('ShortCircuitMiddleware',
+                                 'RecordingMiddleware')
+        with self.assertRaisesRegexp(ValueError, 'without context data'):
+            caller.get_context(self.url)
+        # Later middleware never sees the request
+        self.assertEqual(RecordingMiddleware.calls, [])
+
+    def test_bad_middleware(self):
+        for path in ('jade_tools.tests.test_contextmaker.Missing',
+                     'jade_tools.missing.Middleware', 'Middleware'):
+            with self.assertRaises(ImproperlyConfigured):
+                DirectViewCaller([path])
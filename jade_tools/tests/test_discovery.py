@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import itertools
+import tempfile
+
+from django.test import SimpleTestCase
+
+from jade_tools import discovery
+from jade_tools.discovery import PrefixTrie
+
+STANDALONE_PATHS = ['pages/about', 'pages/legal/terms', 'errors',
+                    'caf\xc3\xa9']
+
+
+def old_is_standalone(template_path_base, standalone_paths):
+    """How jade_tools 0.1 matched a template against standalone.txt."""
+    return any([os.path.commonprefix([template_path_base, standalone_path]) ==
+                template_path_base for standalone_path in standalone_paths])
+
+
+class PrefixTrieTest(SimpleTestCase):
+
+    def test_same_as_commonprefix(self):
+        candidates = ['', 'p', 'pages', 'pages/', 'pages/about',
+                      'pages/about/team', 'pages/legal', 'pages/legal/t',
+                      'pages/other', 'error', 'errors', 'errors/404', 'caf',
+                      'caf\xc3\xa9', 'Pages']
+        for count in range(len(STANDALONE_PATHS) + 1):
+            for paths in itertools.combinations(STANDALONE_PATHS, count):
+                trie = PrefixTrie(paths)
+                for candidate in candidates:
+                    self.assertEqual(trie.is_prefix_of_any(candidate),
+                                     old_is_standalone(candidate, paths),
+                                     (candidate, paths))
+
+    def test_add(self):
+        trie = PrefixTrie()
+        self.assertFalse(trie.is_prefix_of_any('pages'))
+        trie.add('pages/about')
+        self.assertTrue(trie.is_prefix_of_any('pages'))
+
+
+class WalkTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.outside = tempfile.mkdtemp()
+        for name in ('page.jade', 'parts/_nav.jade', 'parts/deep/_item.jade'):
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').close()
+        open(os.path.join(self.outside, 'other.jade'), 'w').close()
+        os.symlink(self.outside, os.path.join(self.root, 'linked'))
+        # A loop back to the top would never end if it were followed
+        os.symlink(self.root, os.path.join(self.root, 'parts', 'loop'))
+        os.symlink(os.path.join(self.root, 'page.jade'),
+                   os.path.join(self.root, 'alias.jade'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.outside)
+
+    def test_symlinked_directories_are_not_followed(self):
+        walked = dict((os.path.relpath(path, self.root), sorted(files))
+                      for path, files in discovery.walk(self.root))
+        self.assertEqual(walked, {
+            '.': ['alias.jade', 'page.jade'],
+            'parts': ['_nav.jade'],
+            os.path.join('parts', 'deep'): ['_item.jade'],
+        })
+
+    def test_same_as_os_walk(self):
+        self.assertEqual(
+            sorted((path, sorted(files))
+                   for path, files in discovery.walk(self.root)),
+            sorted((path, sorted(files))
+                   for path, _, files in os.walk(self.root)))
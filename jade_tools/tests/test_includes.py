@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from jade_tools.compiler import IncludeExpander
+
+FILES = {
+    'page.jade': (u'doctype html\nhtml\n  head\n    include _head\n'
+                  u'  body\n    include parts/_nav.jade\n    p caf\xe9\n'
+                  u'    include parts/_nav\n'),
+    '_head.jade': u'title Page\nmeta(charset="utf-8")\n',
+    'parts/_nav.jade': (u'nav\n  ul\n    include _item\n'
+                        u'    include ../_footer\n'),
+    'parts/_item.jade': u'li\n  a(href="/") Home\n\n',
+    '_footer.jade': u'footer Bye',
+}
+# Whole seconds, which set exactly on every filesystem
+MTIME = 1400000000
+
+
+def old_preprocess_includes(template_src,
+                            INCLUDE_RE=IncludeExpander.INCLUDE_RE):
+    """How jade_tools 0.1 expanded includes, relative to the working
+    directory."""
+    match = INCLUDE_RE.search(template_src)
+    while match:
+        base_indent, included_path = match.groups()
+        included_path = os.path.normpath(
+            os.path.join(os.getcwd(), included_path)).strip()
+        if os.path.exists(included_path):
+            included_src = open(included_path, 'r').read()
+        else:
+            included_src = open("%s.jade" % included_path, 'r').read()
+        included_src = included_src.decode('utf8')
+        if INCLUDE_RE.search(included_src):
+            current_pwd = os.getcwd()
+            os.chdir(os.path.dirname(included_path))
+            included_src = old_preprocess_includes(included_src)
+            os.chdir(current_pwd)
+        template_src = (
+            template_src[0:match.start()] + base_indent +
+            included_src.replace(u'\n', u'\n'+base_indent).rstrip() +
+            template_src[match.end():]
+        )
+        match = INCLUDE_RE.search(template_src)
+    return template_src
+
+
+class IncludeExpanderTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name, source in FILES.iteritems():
+            self.write(name, source, MTIME)
+        self.expander = IncludeExpander()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def write(self, name, source, mtime=None):
+        if not os.path.isdir(os.path.dirname(self.path(name))):
+            os.makedirs(os.path.dirname(self.path(name)))
+        with open(self.path(name), 'w') as f:
+            f.write(source.encode('utf8'))
+        if mtime is not None:
+            os.utime(self.path(name), (mtime, mtime))
+
+    def test_same_as_old_preprocess_includes(self):
+        cwd = os.getcwd()
+        os.chdir(self.root)
+        try:
+            expected = old_preprocess_includes(FILES['page.jade'])
+        finally:
+            os.chdir(cwd)
+        self.assertEqual(self.expander.expand(FILES['page.jade'], self.root),
+                         expected)
+        self.assertIn(u'        li\n          a(href="/") Home', expected)
+
+    def test_dependencies(self):
+        expanded, dependencies = self.expander.expand_file(
+            self.path('page.jade'))
+        self.assertEqual(dependencies, frozenset(
+            self.path(name) for name in FILES if name != 'page.jade'))
+
+    def test_no_includes(self):
+        self.assertEqual(self.expander.expand_with_dependencies(
+            u'p no includes', self.root), (u'p no includes', frozenset()))
+
+    def test_touching_a_nested_partial_invalidates(self):
+        page = self.path('page.jade')
+        self.assertIn(u'a(href="/") Home', self.expander.expand_file(page)[0])
+        self.write('parts/_item.jade', u'li Away', MTIME + 10)
+        expanded = self.expander.expand_file(page)[0]
+        self.assertNotIn(u'Home', expanded)
+        self.assertIn(u'        li Away', expanded)
+
+    def test_memoized(self):
+        page = self.path('page.jade')
+        expanded = self.expander.expand_file(page)[0]
+        # Same mtime, so the memo is used
+        self.write('_footer.jade', u'footer Changed', MTIME)
+        self.assertEqual(self.expander.expand_file(page)[0], expanded)
+
+    def test_recursive_include(self):
+        self.write('parts/_item.jade', u'li\n  include _nav\n')
+        with self.assertRaisesRegexp(Exception, 'Recursive include'):
+            self.expander.expand_file(self.path('page.jade'))
+
+    def test_include_itself(self):
+        self.write('_self.jade', u'p\ninclude _self\n')
+        with self.assertRaisesRegexp(Exception, 'Recursive include'):
+            self.expander.expand_file(self.path('_self.jade'))
+
+    def test_shared_partial_is_not_recursion(self):
+        # _nav is included twice, side by side
+        self.assertEqual(
+            self.expander.expand_file(self.path('page.jade'))[0].count(
+                u'footer Bye'), 2)
+
+    def test_missing_include(self):
+        with self.assertRaisesRegexp(Exception, "doesn't exist"):
+            self.expander.expand(u'include _missing', self.root)
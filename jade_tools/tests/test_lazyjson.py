@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import copy
+import json
+import pickle
+from StringIO import StringIO
+
+from django.test import SimpleTestCase
+
+from jade_tools.compiler import (DictWithSpecialUnicode, LazyJSON,
+                                 load_fixture, load_lazy_fixture)
+
+ESCAPES = r'''{
+    "quote": "say \"hi\"",
+    "backslash": "C:\\temp\\",
+    "unicode": "caf\u00e9 \u2603",
+    "brackets": "{[not] a {nested} value]",
+    "escaped \"key\"": {"inner": "}\\"},
+    "after": [1, "]", {"x": "{"}]
+}'''
+
+EMPTY = '''{"object": {}, "array": [], "nested": {"a": [{}, []], "b": {}},
+            "string": "", "null": null, "false": false, "zero": 0}'''
+
+# The reference comes before the object carrying its id, and one shared
+# object refers to another
+REF_BEFORE_ID = '''{
+    "first": {"__ref__": 2},
+    "list": [{"__ref__": 1}, {"__ref__": 2}],
+    "owner": {"__id__": 1, "name": "jag", "best": {"__ref__": 2}},
+    "friend": {"__id__": 2, "name": "bob", "tags": ["a", "b"]}
+}'''
+
+TOP_LEVEL_ARRAY = '''  [{"__id__": 1, "a": 1}, {"__ref__": 1}, [], {}, "x"]'''
+
+LABELLED = '''{"user": {"": "Jag", "name": "jag"}, "plain": {"name": "bob"}}'''
+
+
+def plain(value):
+    """``value`` with its fixture dicts turned into plain dicts."""
+    if isinstance(value, dict):
+        return dict((key, plain(item)) for key, item in value.items())
+    elif isinstance(value, list):
+        return [plain(item) for item in value]
+    return value
+
+
+def load_both(text):
+    return (load_fixture(StringIO(text)), load_lazy_fixture(StringIO(text)))
+
+
+class LazyFixtureTest(SimpleTestCase):
+
+    def assertSameFixture(self, text):
+        eager, lazy = load_both(text)
+        self.assertEqual(plain(lazy), plain(eager))
+        return eager, lazy
+
+    def test_escapes(self):
+        eager, lazy = self.assertSameFixture(ESCAPES)
+        self.assertEqual(lazy['escaped "key"']['inner'], u'}\\')
+        self.assertEqual(lazy['unicode'], u'café ☃')
+
+    def test_escapes_looked_up_one_at_a_time(self):
+        eager, lazy = load_both(ESCAPES)
+        for key in reversed(sorted(eager)):
+            self.assertEqual(plain(lazy[key]), plain(eager[key]))
+
+    def test_empty_containers(self):
+        eager, lazy = self.assertSameFixture(EMPTY)
+        self.assertIsInstance(lazy['object'], LazyJSON)
+        self.assertEqual(len(lazy['nested']['b']), 0)
+        self.assertEqual(list(lazy['object']), [])
+
+    def test_ref_before_id(self):
+        eager, lazy = self.assertSameFixture(REF_BEFORE_ID)
+        self.assertIs(lazy['first'], lazy['friend'])
+        self.assertIs(lazy['list'][0], lazy['owner'])
+        self.assertIs(lazy['owner']['best'], lazy['first'])
+        self.assertNotIn('__id__', lazy['owner'])
+        self.assertIs(eager['first'], eager['friend'])
+
+    def test_top_level_array(self):
+        eager, lazy = self.assertSameFixture(TOP_LEVEL_ARRAY)
+        self.assertIsInstance(lazy, list)
+        self.assertIs(lazy[1], lazy[0])
+
+    def test_labels(self):
+        eager, lazy = self.assertSameFixture(LABELLED)
+        self.assertEqual(unicode(lazy['user']), unicode(eager['user']))
+        self.assertEqual(unicode(lazy['plain']), unicode(eager['plain']))
+        self.assertEqual(repr(lazy['user']), repr(eager['user']))
+
+    def test_dict_storage_is_only_filled_by_materialize(self):
+        # What LazyJSON's docstring warns about: these bypass its methods
+        eager, lazy = load_both(REF_BEFORE_ID)
+        self.assertEqual(dict(lazy), {})
+        self.assertEqual(json.loads(json.dumps(lazy)), {})
+        self.assertEqual(json.loads(json.dumps(lazy.materialize())),
+                         json.loads(json.dumps(eager)))
+        self.assertEqual(plain(dict(lazy['owner'])), plain(eager['owner']))
+
+    def test_copies_are_plain(self):
+        eager, lazy = load_both(REF_BEFORE_ID)
+        for copied in (copy.copy(lazy), copy.deepcopy(lazy),
+                       pickle.loads(pickle.dumps(lazy, 2))):
+            self.assertIsInstance(copied, DictWithSpecialUnicode)
+            self.assertEqual(plain(copied), plain(eager))
+        copied = copy.deepcopy(lazy)
+        self.assertIs(type(copied['owner']), DictWithSpecialUnicode)
+        self.assertIs(copied['first'], copied['friend'])
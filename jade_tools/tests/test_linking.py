@@ -0,0 +1,127 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import re
+import shutil
+import tempfile
+
+from django.template import Context, Template, TemplateDoesNotExist
+from django.template import loader_tags
+from django.test import SimpleTestCase
+
+from jade_tools import compiler
+from jade_tools.management.commands.jade_tools import Command
+
+FILES = {
+    'jade_templates/page.jade': (
+        u'html\n'
+        u'  body\n'
+        u'    include _card\n'
+        u'    div\n'
+        u'      include parts/_all\n'
+        u'    include _card.jade\n'
+        u'    include _wrap\n'
+        u'      p inside\n'
+        u'    include _blocky\n'
+        u'    include _mixer\n'
+        u'    include ../outside/_out\n'),
+    'jade_templates/_card.jade': u'p.card= title\n',
+    'jade_templates/parts/_all.jade': u'ul\n  include _item\n',
+    'jade_templates/parts/_item.jade': u'li= item_name\n',
+    'jade_templates/_wrap.jade': u'section.wrap\n',
+    'jade_templates/_blocky.jade': u'block extra\n  p extra\n',
+    'jade_templates/_mixer.jade': u'mixin hello\n  p hello\n+hello\n',
+    'outside/_out.jade': u'p outside\n',
+}
+
+CONTEXT = {'title': u'Title', 'item_name': u'Item'}
+
+
+class LinkIncludesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name, source in FILES.iteritems():
+            path = os.path.join(self.root, name)
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            open(path, 'w').write(source.encode('utf8'))
+        self.compiler = compiler.DjangoJadeCompiler('jade_tools')
+        self.compiler.template_path = os.path.join(self.root,
+                                                   'jade_templates')
+        self.page = {'base_file_name': 'page', 'template_path': '',
+                     'path': self.compiler.template_path}
+        # Compiled partials, by template name
+        self.templates = {}
+        self.get_template = loader_tags.get_template
+        loader_tags.get_template = self.get_partial
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        loader_tags.get_template = self.get_template
+        compiler.DjangoJadeCompiler.include_templates = False
+
+    def get_partial(self, template_name, dirs=None):
+        try:
+            return Template(self.templates[template_name], name=template_name)
+        except KeyError:
+            raise TemplateDoesNotExist(template_name)
+
+    def test_link_includes(self):
+        source = FILES['jade_templates/page.jade']
+        linked, partials = self.compiler.link_includes(
+            source, self.compiler.template_path)
+        self.assertEqual(partials, [
+            os.path.join(self.compiler.template_path, name) for name in
+            ('_card.jade', 'parts/_all.jade', '_card.jade')])
+        self.assertIn(u'\n    {% include "jade_tools/_card.html" %}\n'
+                      u'    div\n'
+                      u'      {% include "jade_tools/parts/_all.html" %}\n'
+                      u'    {% include "jade_tools/_card.html" %}\n',
+                      linked)
+        # Inlined: nested lines, page blocks, mixins and outside partials
+        for line in (u'    include _wrap\n      p inside',
+                     u'    include _blocky', u'    include _mixer',
+                     u'    include ../outside/_out'):
+            self.assertIn(line, linked)
+
+    def test_find_linked_partials(self):
+        self.assertEqual(self.compiler.find_linked_partials(**self.page), [
+            {'base_file_name': '_card', 'template_path': '',
+             'path': self.compiler.template_path},
+            {'base_file_name': '_item', 'template_path': 'parts',
+             'path': os.path.join(self.compiler.template_path, 'parts')},
+            {'base_file_name': '_all', 'template_path': 'parts',
+             'path': os.path.join(self.compiler.template_path, 'parts')},
+        ])
+
+    def test_partial_stages(self):
+        partials = [(self.compiler, partial_data) for partial_data
+                    in self.compiler.find_linked_partials(**self.page)]
+        self.assertEqual(Command().partial_stages(partials),
+                         [partials[:2], partials[2:]])
+
+    def test_partial_outside_jade_templates(self):
+        self.assertIsNone(self.compiler.partial_tmpl_data(
+            os.path.join(self.root, 'outside', '_out.jade')))
+
+    def render(self, source):
+        html = Template(source).render(Context(CONTEXT))
+        return re.sub(r'\s+', '', html)
+
+    def test_renders_like_inlined(self):
+        inlined = self.compiler.compile(**self.page)
+        self.assertNotIn(u'{% include', inlined)
+        compiler.DjangoJadeCompiler.include_templates = True
+        # Included partials come first, as they have to be compiled first
+        for partial_data in self.compiler.find_linked_partials(**self.page):
+            self.templates[self.compiler.partial_template_name(
+                partial_data)] = self.compiler.compile(**partial_data)
+        linked = self.compiler.compile(**self.page)
+        self.assertEqual(linked.count(u'{% include'), 3)
+        self.assertEqual(self.render(linked), self.render(inlined))
+        self.assertIn(u'<pclass="card">Title</p><div><ul><li>Item</li></ul>',
+                      self.render(linked))
+        self.assertIn(u'<sectionclass="wrap"><p>inside</p></section>',
+                      self.render(linked))
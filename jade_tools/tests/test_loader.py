@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from django.template import Context, TemplateDoesNotExist
+from django.test import SimpleTestCase
+
+from jade_tools import discovery
+from jade_tools.compiler import DjangoJadeCompiler
+from jade_tools.loader import LRUCache, Loader
+
+FILES = {
+    'page.jade': u'div\n  include parts/_greeting\n',
+    'parts/_greeting.jade': u'p Hello {{ name }}\n',
+}
+MTIME = 1400000000
+
+
+class LoaderTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for name, source in FILES.iteritems():
+            self.write(name, source)
+        self.loader = Loader(max_size=2)
+        # Both apps' templates come from the temporary directory
+        for app in ('jade_tools', 'django.contrib.auth'):
+            compiler_obj = self.loader.get_compiler(app)
+            compiler_obj.template_path = self.root
+        discovery._jade_apps = ['jade_tools', 'django.contrib.auth']
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        discovery.forget_jade_apps()
+
+    def write(self, name, source, mtime=MTIME):
+        path = os.path.join(self.root, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(source.encode('utf8'))
+        os.utime(path, (mtime, mtime))
+
+    def render(self, template_name):
+        template, _ = self.loader.load_template(template_name)
+        return template.render(Context({'name': u'Jade'})).strip()
+
+    def test_resolves_app_templates(self):
+        self.assertIn(u'<p>Hello Jade</p>',
+                      self.render('jade_tools/page.html'))
+        self.assertIn(u'<p>Hello Jade</p>',
+                      self.render('jade_tools/parts/_greeting.html'))
+        # Dotted app names map to slashes
+        self.assertIn(u'<p>Hello Jade</p>',
+                      self.render('django/contrib/auth/page.html'))
+        self.assertIsInstance(self.loader.get_compiler('jade_tools'),
+                              DjangoJadeCompiler)
+
+    def test_unknown_templates(self):
+        for template_name in ('jade_tools/missing.html', 'jade_tools/page.txt',
+                              'jade_tools/page', 'page.html',
+                              'other_app/page.html', 'jade_toolspage.html'):
+            with self.assertRaises(TemplateDoesNotExist):
+                self.loader.load_template(template_name)
+
+    def test_cached(self):
+        template, _ = self.loader.load_template('jade_tools/page.html')
+        self.assertIs(self.loader.load_template('jade_tools/page.html')[0],
+                      template)
+
+    def test_changed_include_recompiles(self):
+        template, _ = self.loader.load_template('jade_tools/page.html')
+        # Same mtime, so the cached template is used
+        self.write('parts/_greeting.jade', u'p Bye {{ name }}\n')
+        self.assertIs(self.loader.load_template('jade_tools/page.html')[0],
+                      template)
+        self.write('parts/_greeting.jade', u'p Bye {{ name }}\n', MTIME + 10)
+        self.assertIn(u'<p>Bye Jade</p>', self.render('jade_tools/page.html'))
+
+    def test_removed_include_recompiles(self):
+        self.render('jade_tools/page.html')
+        self.write('page.jade', u'p Alone\n', MTIME + 10)
+        os.remove(os.path.join(self.root, 'parts', '_greeting.jade'))
+        self.assertEqual(self.render('jade_tools/page.html'), u'<p>Alone</p>')
+
+    def test_reset(self):
+        template, _ = self.loader.load_template('jade_tools/page.html')
+        self.loader.reset()
+        self.assertIsNot(self.loader.load_template('jade_tools/page.html')[0],
+                         template)
+
+
+class LRUCacheTest(SimpleTestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c'), len(cache)),
+                         (1, 3, 2))
+        cache.delete('a')
+        self.assertEqual(cache.get('a', 'gone'), 'gone')
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import json
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from jade_tools import compiler
+from jade_tools.management.commands.jade_tools import Command
+from jade_tools.manifest import BuildManifest
+
+FILES = {
+    'page.jade': u'html\n  include _head\n  body\n',
+    '_head.jade': u'head\n  include _meta\n',
+    '_meta.jade': u'meta(charset="utf-8")\n',
+}
+MTIME = 1400000000
+
+
+class BuildManifestTest(SimpleTestCase):
+    """Whether ``compile`` rebuilds a page, as ``Command.compile_job``
+    decides with the manifest."""
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.project = os.path.join(self.root, 'project')
+        os.makedirs(os.path.join(self.project, 'jade_templates'))
+        for name, source in FILES.iteritems():
+            self.write(name, source)
+        self.compiler = compiler.DjangoJadeCompiler('jade_tools')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        compiler.DjangoJadeCompiler.include_templates = False
+
+    def write(self, name, source, mtime=MTIME):
+        path = os.path.join(self.project, 'jade_templates', name)
+        with open(path, 'w') as f:
+            f.write(source.encode('utf8'))
+        os.utime(path, (mtime, mtime))
+
+    def build(self, force=False):
+        """Run a compile of the page, returning whether it was rebuilt."""
+        self.compiler.template_path = os.path.join(self.project,
+                                                   'jade_templates')
+        tmpl_data = {'base_file_name': 'page', 'template_path': '',
+                     'path': self.compiler.template_path}
+        html_file = os.path.join(self.project, 'templates', 'page.html')
+        manifest = BuildManifest(os.path.join(self.project, 'manifest.json'))
+        job = Command().compile_job(manifest, self.compiler, tmpl_data,
+                                    html_file, force)
+        if job is None:
+            return False
+        _, jade_file, inputs = job
+        if not os.path.isdir(os.path.dirname(html_file)):
+            os.makedirs(os.path.dirname(html_file))
+        open(html_file, 'w').close()
+        manifest.record(manifest.key('compile', jade_file), inputs)
+        manifest.save()
+        return True
+
+    def test_unchanged_is_skipped(self):
+        self.assertTrue(self.build())
+        self.assertFalse(self.build())
+        # Only contents count, not mtimes
+        self.write('_meta.jade', FILES['_meta.jade'], MTIME + 10)
+        self.assertFalse(self.build())
+
+    def test_changed_transitive_include(self):
+        self.build()
+        self.write('_meta.jade', u'meta(name="robots")\n', MTIME + 10)
+        self.assertTrue(self.build())
+        self.assertFalse(self.build())
+
+    def test_added_include(self):
+        self.build()
+        self.write('_body.jade', u'p Body\n')
+        self.write('page.jade', FILES['page.jade'] + u'  include _body\n',
+                   MTIME + 10)
+        self.assertTrue(self.build())
+        self.write('_body.jade', u'p Changed\n', MTIME + 10)
+        self.assertTrue(self.build())
+
+    def test_missing_output(self):
+        self.build()
+        os.remove(os.path.join(self.project, 'templates', 'page.html'))
+        self.assertTrue(self.build())
+
+    def test_force(self):
+        self.build()
+        self.assertTrue(self.build(force=True))
+        self.assertTrue(self.build(force=True))
+
+    def test_include_templates(self):
+        self.build()
+        compiler.DjangoJadeCompiler.include_templates = True
+        self.assertTrue(self.build())
+        self.assertFalse(self.build())
+
+    def test_moved_checkout(self):
+        self.build()
+        moved = os.path.join(self.root, 'moved')
+        shutil.move(self.project, moved)
+        self.project = moved
+        self.assertFalse(self.build())
+        entries = json.load(open(os.path.join(moved, 'manifest.json')))
+        self.assertEqual(entries['entries'].keys(),
+                         ['compile:jade_templates/page.jade'])
+
+    def test_other_version(self):
+        self.build()
+        manifest_file = os.path.join(self.project, 'manifest.json')
+        data = json.load(open(manifest_file))
+        data['jade_tools'] = 'other'
+        json.dump(data, open(manifest_file, 'w'))
+        self.assertTrue(self.build())
+
+    def test_unreadable(self):
+        self.build()
+        open(os.path.join(self.project, 'manifest.json'), 'w').write('{')
+        self.assertTrue(self.build())
+
+    def test_no_manifest(self):
+        manifest = BuildManifest(None)
+        manifest.record('compile:page.jade', {})
+        self.assertFalse(manifest.is_current('compile:page.jade', {}))
+        manifest.save()
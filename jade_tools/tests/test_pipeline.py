@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from jade_tools import compiler
+
+MIDDLEWARE_CLASSES = (
+    'django.contrib.sessions.middleware.SessionMiddleware',
+    'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'jade_tools.tests.test_pipeline.CountingMiddleware',
+)
+
+
+class CountingMiddleware(object):
+    loaded = 0
+    requests = []
+
+    def __init__(self):
+        CountingMiddleware.loaded += 1
+
+    def process_request(self, request):
+        self.requests.append(request.path)
+
+
+@override_settings(MIDDLEWARE_CLASSES=MIDDLEWARE_CLASSES)
+class MockPipelineTest(SimpleTestCase):
+
+    def setUp(self):
+        CountingMiddleware.loaded = 0
+        del CountingMiddleware.requests[:]
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        compiler.reset_template_loaders()
+
+    def test_middleware_loaded_once(self):
+        pipeline = compiler.MockPipeline()
+        requests = [pipeline.make_request('/app/page%d.html' % (page,))
+                    for page in xrange(3)]
+        self.assertEqual(CountingMiddleware.loaded, 1)
+        self.assertEqual(CountingMiddleware.requests,
+                         ['/app/page0.html', '/app/page1.html',
+                          '/app/page2.html'])
+        for request in requests:
+            self.assertTrue(request.user.is_anonymous())
+            self.assertIsNotNone(request.session)
+        self.assertEqual(pipeline.requests_made, 3)
+        self.assertEqual(pipeline.setup_time_saved, pipeline.setup_time * 2)
+
+    def test_shared_pipeline_renders_the_same(self):
+        template_path = os.path.join(self.root, 'jade_templates')
+        os.makedirs(template_path)
+        with open(os.path.join(template_path, 'page.jade'), 'w') as jade_file:
+            jade_file.write('p {{ name }} {{ user.is_authenticated }}\n')
+        with open(os.path.join(template_path, 'page.json'), 'w') as fixture:
+            fixture.write('{"name": "Jade"}')
+        compiler_obj = compiler.DjangoJadeCompiler('jade_tools',
+                                                   base_context={})
+        compiler_obj.template_path = template_path
+        tmpl_data = {'base_file_name': 'page', 'path': template_path,
+                     'template_path': ''}
+        html_dir = os.path.join(self.root, 'templates', 'jade_tools')
+        os.makedirs(html_dir)
+        with open(os.path.join(html_dir, 'page.html'), 'w') as html_file:
+            html_file.write(compiler_obj.compile(**tmpl_data).encode('utf8'))
+        with self.settings(TEMPLATE_DIRS=(os.path.join(self.root,
+                                                       'templates'),)):
+            compiler.reset_template_loaders()
+            pipeline = compiler.MockPipeline()
+            shared = [compiler_obj.mock(pipeline=pipeline, **tmpl_data)
+                      for _ in xrange(2)]
+            standalone = compiler_obj.mock(**tmpl_data)
+        self.assertEqual(shared, [standalone, standalone])
+        self.assertIn(u'<p>Jade False</p>', standalone)
+        # One load for the shared pipeline, one for the standalone mock
+        self.assertEqual(CountingMiddleware.loaded, 2)
@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import json
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+from django.test.utils import override_settings
+
+from jade_tools import compiler, workers
+from jade_tools.preview import PreviewServer
+
+FILES = {
+    'page.jade': u'div\n  include _greeting\n  p {{ site }}\n',
+    'page.json': u'{"name": "Jade"}',
+    '_greeting.jade': u'p Hello {{ name }}\n',
+    'standalone.jade': u'p No fixture\n',
+}
+MTIME = 1400000000
+
+
+class PreviewServerTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.template_path = os.path.join(self.root, 'jade_templates')
+        for name, source in FILES.iteritems():
+            self.write(name, source)
+        self.base_context = os.path.join(self.root, 'base_context.json')
+        self.write_base_context(u'Site', MTIME)
+        self.settings = override_settings(
+            TEMPLATE_DIRS=(os.path.join(self.root, 'templates'),),
+            STATIC_URL='/static/')
+        self.settings.enable()
+        compiler.reset_template_loaders()
+        self.compiler = compiler.DjangoJadeCompiler('jade_tools')
+        self.compiler.template_path = self.template_path
+        # Pages are compiled with the workers' compiler for the app
+        self.compilers = dict(workers._compilers)
+        workers._compilers['jade_tools'] = self.compiler
+        html_path = os.path.join(self.root, 'templates', 'jade_tools')
+        self.server = PreviewServer(
+            [self.compiler], {self.compiler: html_path}, output_prefix='mock',
+            base_context=self.base_context)
+
+    def tearDown(self):
+        self.settings.disable()
+        workers._compilers.clear()
+        workers._compilers.update(self.compilers)
+        compiler.DjangoJadeCompiler.restore_url_patterns()
+        compiler.reset_template_loaders()
+        shutil.rmtree(self.root)
+
+    def write(self, name, source, mtime=MTIME):
+        path = os.path.join(self.template_path, name)
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write(source.encode('utf8'))
+        os.utime(path, (mtime, mtime))
+
+    def write_base_context(self, site, mtime):
+        with open(self.base_context, 'w') as f:
+            json.dump({'site': site}, f)
+        os.utime(self.base_context, (mtime, mtime))
+
+    def get(self, path):
+        response = []
+        body = self.server({'PATH_INFO': path, 'REQUEST_METHOD': 'GET'},
+                           lambda status, headers: response.append(
+                               (status, dict(headers))))
+        status, headers = response[0]
+        return status, headers.get('X-Mock-Cache'), ''.join(body)
+
+    def test_pages(self):
+        self.assertEqual(self.server.pages.keys(), ['/static/mock/page.html'])
+        status, _, index = self.get('/')
+        self.assertEqual(status, '200 OK')
+        self.assertIn('href="/static/mock/page.html"', index)
+
+    def test_cache_hit_and_miss(self):
+        status, cache, html = self.get('/static/mock/page.html')
+        self.assertEqual((status, cache), ('200 OK', 'miss'))
+        self.assertIn('<p>Hello Jade</p>', html)
+        self.assertIn('<p>Site</p>', html)
+        self.assertEqual(self.get('/static/mock/page.html'),
+                         ('200 OK', 'hit', html))
+
+    def test_changed_inputs_invalidate(self):
+        self.get('/static/mock/page.html')
+        # Only mtimes are compared
+        self.write('page.json', u'{"name": "Pug"}')
+        self.assertEqual(self.get('/static/mock/page.html')[1], 'hit')
+        for name, source in (('page.json', u'{"name": "Pug"}'),
+                             ('_greeting.jade', u'p Bye {{ name }}\n'),
+                             ('page.jade', u'div\n  include _greeting\n')):
+            self.write(name, source, MTIME + 10)
+            status, cache, html = self.get('/static/mock/page.html')
+            self.assertEqual(cache, 'miss', name)
+            self.assertEqual(self.get('/static/mock/page.html')[1], 'hit')
+        self.assertIn('<p>Bye Pug</p>', html)
+        self.assertNotIn('Site', html)
+
+    def test_changed_base_context_invalidates(self):
+        self.get('/static/mock/page.html')
+        self.write_base_context(u'Other site', MTIME + 10)
+        status, cache, html = self.get('/static/mock/page.html')
+        self.assertEqual(cache, 'miss')
+        self.assertIn('<p>Other site</p>', html)
+
+    def test_new_page_is_discovered(self):
+        self.write('other.jade', u'p Other {{ name }}\n')
+        self.write('other.json', u'{"name": "page"}')
+        status, cache, html = self.get('/static/mock/other.html')
+        self.assertEqual((status, cache), ('200 OK', 'miss'))
+        self.assertIn('<p>Other page</p>', html)
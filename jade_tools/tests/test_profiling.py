@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+from django.test import SimpleTestCase
+
+from jade_tools import profiling, workers
+
+
+def timed(job):
+    with profiling.phase('page%d' % (job,), 'compile'):
+        pass
+    with profiling.phase('-', 'middleware'):
+        pass
+    return job
+
+
+class ProfilerTest(SimpleTestCase):
+
+    def tearDown(self):
+        profiling.stop()
+
+    def test_phases_only_recorded_while_profiling(self):
+        timed(0)
+        profiler = profiling.start()
+        timed(0)
+        timed(1)
+        self.assertIs(profiling.stop(), profiler)
+        timed(2)
+        self.assertEqual(sorted(profiler.timings), ['-', 'page0', 'page1'])
+        self.assertEqual(profiler.timings['-']['middleware'][1], 2)
+        self.assertEqual(profiler.timings['page0']['compile'][1], 1)
+
+    def test_report(self):
+        profiler = profiling.Profiler()
+        profiler.record('page', 'compile', 0.5)
+        profiler.record('page', 'render', 0.25, count=2)
+        profiler.merge({'other': {'compile': [1.0, 3]}})
+        report = profiler.report()
+        self.assertEqual(report['phases'], {
+            'compile': {'seconds': 1.5, 'count': 4},
+            'render': {'seconds': 0.25, 'count': 2}})
+        self.assertEqual(report['templates']['page']['seconds'], 0.75)
+        lines = profiler.summary(report, limit=1)
+        # Slowest first, with one template
+        self.assertTrue(lines[1].startswith('compile'))
+        self.assertTrue(lines[4].startswith('other'))
+        self.assertTrue(lines[5].startswith('Wall time'))
+        self.assertEqual(len(lines), 6)
+
+    def test_worker_timings_are_merged(self):
+        for processes in (1, 3):
+            profiler = profiling.start()
+            self.assertEqual(sorted(workers.run_jobs(timed, range(4),
+                                                     processes)),
+                             range(4))
+            profiling.stop()
+            self.assertEqual(
+                sorted((template, phases.keys()[0], phases.values()[0][1])
+                       for template, phases in profiler.timings.iteritems()),
+                [('-', 'middleware', 4)] +
+                [('page%d' % (job,), 'compile', 1) for job in range(4)])
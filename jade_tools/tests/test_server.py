@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import sys
+import json
+import socket
+import tempfile
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import SimpleTestCase
+
+from jade_tools.server import CommandServer
+
+
+class ExitCommand(BaseCommand):
+    """Ends the way ``--end`` says, after writing to both streams."""
+    option_list = BaseCommand.option_list + (
+        make_option('--end', action='store', dest='end', default='return'),
+    )
+
+    def handle(self, subcommand, end, **options):
+        sys.stdout.write('out %s\n' % (os.getcwd(),))
+        sys.stderr.write('err\n')
+        if end == 'exit':
+            sys.exit()
+        elif end == 'exit-none':
+            raise SystemExit(None)
+        elif end == 'exit-3':
+            sys.exit(3)
+        elif end == 'exit-message':
+            sys.exit('Stopped')
+        elif end == 'command-error':
+            raise CommandError('Bad options')
+        elif end == 'error':
+            raise ValueError('Broken')
+
+
+class CommandServerTest(SimpleTestCase):
+
+    def setUp(self):
+        self.server = CommandServer(None, ExitCommand)
+        self.cwd = os.getcwd()
+        self.stdout = sys.stdout
+
+    def run_command(self, *argv):
+        return self.server.run(list(argv), self.cwd)
+
+    def test_success(self):
+        for end in ('return', 'exit', 'exit-none'):
+            self.assertEqual(self.run_command('compile', '--end', end),
+                             (0, 'out %s\n' % (self.cwd,), 'err\n'))
+
+    def test_exit_codes(self):
+        self.assertEqual(self.run_command('mock', '--end', 'exit-3')[0], 3)
+        self.assertEqual(self.run_command('mock', '--end', 'exit-message'),
+                         (1, 'out %s\n' % (self.cwd,), 'err\nStopped\n'))
+
+    def test_errors(self):
+        status, _, stderr = self.run_command('compile', '--end',
+                                             'command-error')
+        self.assertEqual((status, stderr.splitlines()[-1]),
+                         (1, 'CommandError: Bad options'))
+        status, _, stderr = self.run_command('compile', '--end', 'error')
+        self.assertEqual(status, 1)
+        self.assertIn('Traceback', stderr)
+        self.assertIn('ValueError: Broken', stderr)
+
+    def test_bad_arguments(self):
+        # optparse exits with 2 on options it doesn't know
+        status, _, stderr = self.run_command('compile', '--unknown')
+        self.assertEqual(status, 2)
+        self.assertIn('no such option: --unknown', stderr)
+        self.assertEqual(self.run_command('serve')[0], 2)
+        self.assertEqual(self.run_command()[0], 2)
+
+    def test_runs_in_the_clients_directory(self):
+        directory = os.path.realpath(tempfile.mkdtemp())
+        try:
+            self.assertEqual(self.server.run(['compile'], directory)[1],
+                             'out %s\n' % (directory,))
+        finally:
+            os.rmdir(directory)
+        self.assertEqual(os.getcwd(), self.cwd)
+        self.assertIs(sys.stdout, self.stdout)
+
+    def test_handle_connection(self):
+        server_end, client_end = socket.socketpair()
+        try:
+            client_end.sendall(json.dumps({'argv': ['compile', '--end',
+                                                    'exit-3'],
+                                           'cwd': self.cwd}) + '\n')
+            self.server.handle_connection(server_end)
+            response = json.loads(client_end.makefile('rb').readline())
+        finally:
+            server_end.close()
+            client_end.close()
+        self.assertEqual(response, {'status': 3,
+                                    'stdout': 'out %s\n' % (self.cwd,),
+                                    'stderr': 'err\n'})
+        self.assertEqual(self.server.requests_served, 1)
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import itertools
+
+from django.test import SimpleTestCase
+
+from jade_tools.compiler import URLMap
+
+POSITIONAL_MAP = {
+    'article': {
+        '2014': {'05': './may-2014.html',
+                 '__default__': './2014.html'},
+        '__default__': {'05': './may.html',
+                        '__default__': './article.html'},
+    },
+    'home': './index.html',
+}
+
+# The same map, matched on keyword arguments instead
+KEYWORD_MAP = {
+    'article': {
+        'year=2014': {'month=05': './may-2014.html',
+                      '__default__': './2014.html'},
+        '__default__': {'month=05': './may.html',
+                        '__default__': './article.html'},
+    },
+    'home': './index.html',
+}
+
+
+def old_reverse(url_map, viewname, args):
+    """How jade_tools 0.1 looked positional arguments up in a URL map, or
+    None where it fell back to Django's reverse."""
+    args = list(args)
+    if viewname not in url_map:
+        return None
+    mapped = url_map[viewname]
+    while not isinstance(mapped, basestring):
+        next_arg = args.pop(0)
+        if unicode(next_arg) in mapped:
+            mapped = mapped[unicode(next_arg)]
+        elif '__default__' in mapped:
+            mapped = mapped['__default__']
+        else:
+            return None
+    return mapped
+
+
+class UnhashableView(object):
+    __hash__ = None
+
+    def __call__(self, request):
+        pass
+
+
+class URLMapTest(SimpleTestCase):
+    years = ('2014', '2015', 2014)
+    months = ('05', '06')
+
+    def test_positional_arguments_match_old_reverse(self):
+        url_map = URLMap(POSITIONAL_MAP)
+        for args in itertools.product(self.years, self.months):
+            self.assertEqual(url_map.lookup('article', args),
+                             old_reverse(POSITIONAL_MAP, 'article', args))
+        self.assertEqual(url_map.lookup('home', ()), './index.html')
+        self.assertEqual(url_map.lookup('missing', ('x',)), None)
+
+    def test_keyword_arguments_match_positional_ones(self):
+        url_map = URLMap(KEYWORD_MAP)
+        for year, month in itertools.product(self.years, self.months):
+            self.assertEqual(
+                url_map.lookup('article', kwargs={'year': year,
+                                                  'month': month}),
+                old_reverse(POSITIONAL_MAP, 'article', (year, month)))
+
+    def test_default_keeps_keyword_arguments_it_does_not_stand_for(self):
+        # "month" sorts before "year"; falling back to the year's default
+        # must not use up the month
+        url_map = URLMap(KEYWORD_MAP)
+        self.assertEqual(url_map.lookup('article', kwargs={'year': '1999',
+                                                           'month': '05'}),
+                         './may.html')
+        url_map = URLMap({'feed': {'__default__': {
+            'page=2': './2.html', '__default__': './1.html'}}})
+        self.assertEqual(url_map.lookup('feed', kwargs={'page': 2}),
+                         './2.html')
+
+    def test_unhashable_view_and_arguments(self):
+        url_map = URLMap(POSITIONAL_MAP)
+        self.assertIsNone(url_map.lookup(UnhashableView(), ('2014',)))
+        self.assertIsNone(url_map.lookup(['article'], ('2014',)))
+        # Arguments are matched by their text, hashable or not
+        self.assertEqual(url_map.lookup('article', ([2014], '05')),
+                         './may.html')
+        self.assertEqual(url_map.lookup('article', kwargs={'year': {}}),
+                         './article.html')
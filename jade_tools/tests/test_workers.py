@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import os
+import shutil
+import tempfile
+
+from django.test import SimpleTestCase
+
+from jade_tools import compiler, workers
+
+PAGES = 4
+
+
+def double(job):
+    return job, job * 2, os.getpid()
+
+
+class RunJobsTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.template_path = os.path.join(self.root, 'jade_templates')
+        os.makedirs(self.template_path)
+        for page in xrange(PAGES):
+            with open(os.path.join(self.template_path, 'page%d.jade' %
+                                   (page,)), 'w') as jade_file:
+                jade_file.write('div\n  p Page %d {{ name }}\n' % (page,))
+        compiler_obj = compiler.DjangoJadeCompiler('jade_tools')
+        compiler_obj.template_path = self.template_path
+        # Forked workers inherit the compiler
+        self.compilers = dict(workers._compilers)
+        workers._compilers['jade_tools'] = compiler_obj
+
+    def tearDown(self):
+        workers._compilers.clear()
+        workers._compilers.update(self.compilers)
+        shutil.rmtree(self.root)
+
+    def jobs(self, html_dir):
+        return [('jade_tools', {'base_file_name': 'page%d' % (page,),
+                                'path': self.template_path,
+                                'template_path': ''},
+                 os.path.join(self.root, html_dir, 'page%d.html' % (page,)))
+                for page in xrange(PAGES)]
+
+    def read(self, html_dir):
+        return dict((name, open(os.path.join(self.root, html_dir,
+                                             name)).read())
+                    for name in os.listdir(os.path.join(self.root, html_dir)))
+
+    def test_serial(self):
+        results = list(workers.run_jobs(double, range(5), 1))
+        self.assertEqual([result[:2] for result in results],
+                         [(job, job * 2) for job in range(5)])
+        self.assertEqual(set(result[2] for result in results),
+                         set([os.getpid()]))
+
+    def test_parallel(self):
+        results = list(workers.run_jobs(double, range(5), 2))
+        self.assertEqual(sorted(result[:2] for result in results),
+                         [(job, job * 2) for job in range(5)])
+        self.assertNotIn(os.getpid(), set(result[2] for result in results))
+
+    def test_parallel_compile_matches_serial(self):
+        serial = list(workers.run_jobs(workers.compile_to_file,
+                                       self.jobs('serial'), 1))
+        parallel = list(workers.run_jobs(workers.compile_to_file,
+                                         self.jobs('parallel'), 3))
+        self.assertEqual(len(serial), PAGES)
+        self.assertEqual(len(parallel), PAGES)
+        self.assertEqual(self.read('parallel'), self.read('serial'))
+        self.assertIn('Page 3 {{ name }}',
+                      self.read('serial')['page3.html'])
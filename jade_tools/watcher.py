@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os
+import time
+
+from jade_tools import discovery
+
+
+class TemplateWatcher(object):
+    """Polls the ``jade_templates`` directories of a set of apps and works out
+    which pages need rebuilding when files in them change.
+
+    Each page is tracked with the files it depends on - its own source, its
+    JSON fixture and everything it includes - so editing a partial affects
+    every page that includes it. Polling only needs ``os.stat``, so no
+    external services or libraries are involved.
+    """
+
+    def __init__(self, compilers, interval=0.5):
+        self.compilers = compilers
+        self.interval = interval
+        self.pages = {}
+        self.dependencies = {}
+        self.files_added_or_removed = False
+        self.mtimes = self.snapshot()
+        self.discover()
+
+    def snapshot(self):
+        mtimes = {}
+        for compiler_obj in self.compilers:
+            for path, files in discovery.walk(compiler_obj.template_path):
+                for file_name in files:
+                    file_path = os.path.join(path, file_name)
+                    try:
+                        mtimes[file_path] = os.path.getmtime(file_path)
+                    except OSError:
+                        # Deleted between listing and stat
+                        continue
+        return mtimes
+
+    def _track(self, jade_file):
+        compiler_obj, tmpl_data = self.pages[jade_file]
+        dependencies = set([jade_file, os.path.join(
+            tmpl_data['path'], '%s.json' % (tmpl_data['base_file_name'],))])
+        try:
+            dependencies.update(compiler_obj.find_includes(**tmpl_data))
+        except Exception:
+            # A half-written include; the compile will report it properly
+            logger.exception('Could not resolve includes of %s', jade_file)
+        self.dependencies[jade_file] = dependencies
+
+    def discover(self):
+        """(Re)build the list of compilable pages and their dependencies."""
+        self.pages, self.dependencies = {}, {}
+        for compiler_obj in self.compilers:
+            for tmpl_data in compiler_obj.find_compilable_jade_templates():
+                jade_file = os.path.join(
+                    tmpl_data['path'], '%s.jade' % (tmpl_data['base_file_name'],))
+                self.pages[jade_file] = (compiler_obj, tmpl_data)
+                self._track(jade_file)
+        logger.debug('Watching %d page(s)', len(self.pages))
+
+    def changed_files(self):
+        mtimes = self.snapshot()
+        changed = set(path for path in set(mtimes) | set(self.mtimes)
+                      if mtimes.get(path) != self.mtimes.get(path))
+        # Added or removed files may change which pages are compilable
+        self.files_added_or_removed = set(mtimes) != set(self.mtimes)
+        self.mtimes = mtimes
+        return changed
+
+    def affected_pages(self, changed):
+        """Return ``(compiler, tmpl_data)`` for every page depending on one of
+        the ``changed`` files."""
+        if self.files_added_or_removed or [
+                path for path in changed
+                if os.path.basename(path) == 'standalone.txt']:
+            self.discover()
+        affected = [jade_file for jade_file, dependencies
+                    in self.dependencies.iteritems()
+                    if dependencies & changed]
+        for jade_file in affected:
+            # Its includes may have changed too
+            self._track(jade_file)
+        return [self.pages[jade_file] for jade_file in sorted(affected)]
+
+    def watch(self, rebuild):
+        """Poll forever, calling ``rebuild(pages)`` with the pages affected by
+        each batch of changes."""
+        while True:
+            time.sleep(self.interval)
+            changed = self.changed_files()
+            if not changed:
+                continue
+            logger.debug('Changed files: %s', sorted(changed))
+            pages = self.affected_pages(changed)
+            if pages:
+                rebuild(pages)
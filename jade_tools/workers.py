@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+import os
+import multiprocessing
+
+import django
+from django.db import connections
+from django.test.client import Client
+
+from jade_tools import compiler, contextmaker, profiling
+from jade_tools.manifest import write_file_atomically
+
+# Compilers are cached per process so each worker only resolves an app's
+# template directory once.
+_compilers = {}
+# What mock workers share between the pages they render
+_mock_state = {}
+# What make_context workers share between the views they inspect
+_context_state = {}
+
+
+def initialize_worker():
+    """Bootstrap Django once in a freshly started worker process."""
+    setup = getattr(django, 'setup', None)
+    if setup is not None:
+        setup()
+    logger.debug('Worker %d ready', os.getpid())
+
+
+def initialize_mock_worker(url_map, base_context):
+    """Bootstrap a worker process for rendering mock pages."""
+    initialize_worker()
+    compiler.DjangoJadeCompiler.preempt_url_patterns(url_map)
+    _mock_state['base_context'] = base_context
+    _mock_state['pipeline'] = compiler.MockPipeline()
+
+
+def get_compiler(app):
+    if app not in _compilers:
+        _compilers[app] = compiler.DjangoJadeCompiler(app)
+    return _compilers[app]
+
+
+def compile_to_file(job):
+    """Compile one template and write its HTML.
+
+    ``job`` is an ``(app, tmpl_data, html_file)`` tuple so it can be sent to a
+    worker process as-is. Serial and parallel builds both go through here, so
+    they produce the same files.
+    """
+    app, tmpl_data, html_file = job
+    compiler_obj = get_compiler(app)
+    html = compiler_obj.compile(**tmpl_data)
+    logger.info('Saving HTML file %s', html_file)
+    with profiling.phase(compiler_obj.template_name(
+            tmpl_data['base_file_name'], tmpl_data['template_path']), 'write'):
+        html_dir = os.path.dirname(html_file)
+        if not os.path.exists(html_dir):
+            try:
+                os.makedirs(html_dir)
+            except OSError:
+                # Another worker got there first
+                if not os.path.isdir(html_dir):
+                    raise
+        open(html_file, 'w').write(
+            html.encode('utf8') if isinstance(html, unicode) else html)
+    return job
+
+
+def mock_to_html(job):
+    """Render the mock HTML of one ``(app, tmpl_data)`` page in a worker set
+    up by ``initialize_mock_worker``."""
+    app, tmpl_data = job
+    compiler_obj = get_compiler(app)
+    compiler_obj.base_context = _mock_state['base_context']
+    return job, compiler_obj.mock(pipeline=_mock_state['pipeline'],
+                                  **tmpl_data)
+
+
+def get_client():
+    if 'client' not in _context_state:
+        _context_state['client'] = Client()
+    return _context_state['client']
+
+
+def get_view_caller(middleware):
+    key = ('view_caller', middleware)
+    if key not in _context_state:
+        _context_state[key] = contextmaker.DirectViewCaller(middleware)
+    return _context_state[key]
+
+
+def make_context_file(job):
+    """Generate one static context file for a batch ``make_context`` run.
+
+    ``job`` is an ``(entry, maker_options, fixture_file)`` tuple, where
+    ``entry`` holds the view name, args and kwargs. A ``direct_middleware``
+    tuple in ``maker_options`` calls the view directly with that middleware.
+    Returns the job and the number of queries serializing the context
+    issued.
+    """
+    entry, maker_options, fixture_file = job
+    maker_options = dict(maker_options)
+    middleware = maker_options.pop('direct_middleware', None)
+    if middleware is not None:
+        maker_options['view_caller'] = get_view_caller(middleware)
+    else:
+        maker_options['client'] = get_client()
+    maker = contextmaker.ContextMaker(
+        entry['view_name'], entry.get('args', []), entry.get('kwargs', {}),
+        **maker_options)
+    logger.info('Saving context file %s', fixture_file)
+    write_file_atomically(
+        fixture_file,
+        (chunk.encode('utf-8')
+         for chunk in maker.generate_context_json(indent=4)))
+    return job, maker.queries_issued
+
+
+def close_connections():
+    """Close this process's database connections before forking workers,
+    which must not share them."""
+    for connection in connections.all():
+        connection.close()
+
+
+def run_jobs(fn, jobs, processes, initializer=initialize_worker,
+             initargs=()):
+    """Yield ``fn(job)`` for every job, spread across ``processes`` worker
+    processes when there is more than one. Results arrive in completion
+    order.
+
+    While profiling, workers profile each job and their timings are added
+    to this process's profile.
+    """
+    if processes <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            yield fn(job)
+        return
+    close_connections()
+    profiler = profiling.active
+    if profiler is not None:
+        fn = profiling.ProfiledCall(fn)
+    pool = multiprocessing.Pool(min(processes, len(jobs)),
+                                initializer=initializer, initargs=initargs)
+    try:
+        for result in pool.imap_unordered(fn, jobs):
+            if profiler is not None:
+                result, timings = result
+                profiler.merge(timings)
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()